@@ -0,0 +1,3 @@
+"""
+Derailed Load-testing and Benchmarks.
+"""
@@ -0,0 +1,149 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+from typing import Any
+
+from .stand_ins import FakeGateway, Postgres
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+async def bench(args: argparse.Namespace) -> dict[str, Any]:
+    import httpx
+
+    from derailed.app import app
+    from derailed.database import AsyncSessionFactory, engine
+    from derailed.models import Base
+
+    from .seed import seed
+    from .workloads import WORKLOADS, Context, run
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+
+    async with AsyncSessionFactory() as session:
+        data = await seed(
+            session,
+            seed=args.seed,
+            guilds=args.guilds,
+            channels_per_guild=args.channels,
+            messages_per_channel=args.messages,
+        )
+
+    results: dict[str, Any] = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('out', 'compare')},
+        'workloads': {},
+    }
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        ctx = Context(data, seed=args.seed)
+        await ctx.login_owners(client)
+
+        for name in args.workloads:
+            results['workloads'][name] = await run(
+                client, ctx, WORKLOADS[name], args.duration, args.concurrency, args.warmup
+            )
+            print_row(name, results['workloads'][name])
+
+    await engine.dispose()
+    return results
+
+
+def print_row(name: str, result: dict[str, Any]) -> None:
+    lat = result['latency_us']
+    print(
+        f'{name:<15} {result["throughput"]:>10.1f} req/s  errors {result["errors"]:<6}'
+        f' p50 {lat["p50"]:>8}us  p99 {lat["p99"]:>8}us  p99.9 {lat["p99.9"]:>8}us  max {lat["max"]:>8}us'
+    )
+
+
+def _change(before: float, after: float) -> float:
+    return (after / before - 1) * 100 if before else 0.0
+
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    print(f'{old["commit"]} -> {new["commit"]}')
+
+    for name, result in new['workloads'].items():
+        before = old['workloads'].get(name)
+
+        if before is None:
+            continue
+
+        tput = _change(before['throughput'], result['throughput'])
+        p99 = _change(before['latency_us']['p99'], result['latency_us']['p99'])
+        print(f'{name:<15} throughput {tput:+7.1f}%  p99 {p99:+7.1f}%')
+
+
+def main() -> None:
+    from .workloads import WORKLOADS
+
+    parser = argparse.ArgumentParser(
+        'benchmarks', description='Load-test the API in-process against local stand-ins of its services.'
+    )
+    parser.add_argument('--workloads', nargs='+', choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds measured per workload')
+    parser.add_argument('--warmup', type=float, default=2.0, help='seconds run before measuring')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--guilds', type=int, default=10)
+    parser.add_argument('--channels', type=int, default=20, help='text channels per guild')
+    parser.add_argument('--messages', type=int, default=200, help='messages per channel')
+    parser.add_argument('--out', help='write results as JSON to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    with FakeGateway(), Postgres() as uri:
+        # the database, and with it the app, can only be imported once this is set
+        os.environ['PG_URI'] = uri
+
+        import derailed.app  # noqa: F401  installs uvloop before the loop is created
+
+        results = asyncio.run(bench(args))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
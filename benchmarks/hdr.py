@@ -0,0 +1,79 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import math
+from collections import Counter
+
+__all__ = ['Histogram', 'PERCENTILES']
+
+PERCENTILES = (50.0, 90.0, 99.0, 99.9, 99.99)
+
+
+class Histogram:
+    """
+    A High Dynamic Range histogram of latencies in microseconds.
+
+    Values are bucketed to `digits` significant figures, so memory stays
+    bounded no matter how many values are recorded while every percentile
+    stays within 10^-digits of the real one, from microseconds to minutes.
+    """
+
+    def __init__(self, digits: int = 3) -> None:
+        self.digits = digits
+        self.buckets: Counter[int] = Counter()
+        self.count = 0
+        self.max = 0
+
+    def _bucket(self, value: int) -> int:
+        if value < 10**self.digits:
+            return value
+
+        scale = 10 ** (int(math.log10(value)) + 1 - self.digits)
+        return (value // scale) * scale
+
+    def record(self, seconds: float) -> None:
+        value = max(int(seconds * 1_000_000), 0)
+
+        self.buckets[self._bucket(value)] += 1
+        self.count += 1
+
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: 'Histogram') -> None:
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile: float) -> int:
+        if self.count == 0:
+            return 0
+
+        wanted = math.ceil(self.count * percentile / 100)
+        seen = 0
+
+        for value in sorted(self.buckets):
+            seen += self.buckets[value]
+
+            if seen >= wanted:
+                return value
+
+        return self.max
+
+    def summary(self) -> dict[str, int]:
+        summary = {f'p{p:g}': self.percentile(p) for p in PERCENTILES}
+        summary['max'] = self.max
+        return summary
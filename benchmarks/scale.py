@@ -0,0 +1,398 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import accumulate
+from typing import Iterator
+
+from derailed.permissions import DEFAULT_PERMISSIONS
+
+from .seed import _EPOCH, _SEED_MS, PASSWORD, _snowflake
+
+__all__ = ['Distributions', 'Plan', 'seed_scale']
+
+# the low 22 bits of message ids are their channel's index, see `Plan.messages`
+MAX_CHANNELS = 1 << 22
+
+_SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ze', 'pa', 'do', 'fi', 'gu', 'ha', 'je', 'wo']
+
+
+class Distributions:
+    """
+    How big, and how skewed, a generated dataset is.
+
+    Guild sizes and channel activity are drawn from Pareto distributions, smaller `*_skew`s
+    giving longer tails. A guild gets a text channel for every `members_per_channel` members,
+    filed into categories of `channels_per_category`, up to `max_channels` channels altogether.
+    Authors are drawn from a guild's members, the earliest `author_skew` times as often.
+    """
+
+    def __init__(
+        self,
+        users: int = 1_000_000,
+        guilds: int = 100_000,
+        members: int = 10_000_000,
+        messages: int = 1_000_000_000,
+        guild_skew: float = 1.16,
+        activity_skew: float = 1.5,
+        author_skew: float = 3.0,
+        members_per_channel: int = 200,
+        channels_per_category: int = 25,
+        max_channels: int = 500,
+        history_days: int = 365,
+        words: tuple[float, float] = (1.6, 0.9),
+    ) -> None:
+        self.users = users
+        self.guilds = guilds
+        self.members = members
+        self.messages = messages
+        self.guild_skew = guild_skew
+        self.activity_skew = activity_skew
+        self.author_skew = author_skew
+        self.members_per_channel = members_per_channel
+        self.channels_per_category = channels_per_category
+        self.max_channels = max_channels
+        self.history_days = history_days
+        # mu and sigma of the log-normal number of words in a message
+        self.words = words
+
+
+class Plan:
+    """
+    Everything about a dataset which is decided up front, from which any guild can be generated alone.
+
+    Each guild draws from a generator seeded with its own index, so what's generated doesn't depend
+    on how guilds are split between workers.
+    """
+
+    def __init__(self, dist: Distributions, seed: int = 0) -> None:
+        self.dist = dist
+        self.seed = seed
+        rng = random.Random(f'{seed}:plan')
+
+        weights = [rng.paretovariate(dist.guild_skew) for _ in range(dist.guilds)]
+        scale = dist.members / sum(weights)
+        self.sizes = array('q', (min(dist.users, max(1, round(w * scale))) for w in weights))
+
+        # text channels for each guild, capped so that they and their categories fit in `max_channels`
+        per = dist.channels_per_category
+        cap = dist.max_channels * per // (per + 1)
+        self.text = array('q', (min(cap, max(1, size // dist.members_per_channel)) for size in self.sizes))
+        self.categories = array('q', (math.ceil(text / per) for text in self.text))
+
+        counts = [t + c for t, c in zip(self.text, self.categories)]
+        self.channel_offsets = array('q', accumulate(counts, initial=0))
+
+        if self.channel_offsets[-1] > MAX_CHANNELS:
+            raise ValueError(f'{self.channel_offsets[-1]} channels is more than the {MAX_CHANNELS} supported')
+
+        # busier guilds have busier channels
+        activity = [size * rng.paretovariate(dist.activity_skew) for size in self.sizes]
+        total = sum(a * text for a, text in zip(activity, self.text))
+        self.activity = array('d', (a * dist.messages / total for a in activity))
+
+        self.history_ms = dist.history_days * 24 * 3600 * 1000
+        self.vocabulary = [a + b + c for a in _SYLLABLES for b in _SYLLABLES for c in _SYLLABLES]
+
+    def user_id(self, user: int) -> int:
+        return _snowflake(user)
+
+    def guild_id(self, guild: int) -> int:
+        return _snowflake(self.dist.users + guild)
+
+    def channel_id(self, channel: int) -> int:
+        return _snowflake(self.dist.users + self.dist.guilds + channel)
+
+    def _rng(self, kind: str, guild: int) -> random.Random:
+        return random.Random(f'{self.seed}:{kind}:{guild}')
+
+    def members(self, guild: int) -> list[int]:
+        # the first is the owner
+        return self._rng('members', guild).sample(range(self.dist.users), self.sizes[guild])
+
+    def guild(self, guild: int, members: list[int]) -> dict[str, list[tuple]]:
+        """
+        Rows of the guild, its members and channels, keyed by table.
+        """
+        guild_id = self.guild_id(guild)
+        text, categories = self.text[guild], self.categories[guild]
+        per = self.dist.channels_per_category
+        offset = self.channel_offsets[guild]
+        channels = []
+
+        for c in range(categories):
+            children = min(per, text - c * per)
+            category_id = self.channel_id(offset + c)
+            channels.append((category_id, 'CATEGORY', f'category-{c + 1}', None, guild_id, c + 1, children))
+
+        for t in range(text):
+            parent = self.channel_id(offset + t // per)
+            channel_id = self.channel_id(offset + categories + t)
+            channels.append((channel_id, 'TEXT', f'channel-{t + 1}', parent, guild_id, t % per + 1, 0))
+
+        return {
+            'guilds': [
+                (
+                    guild_id,
+                    f'guild{guild}',
+                    0,
+                    self.user_id(members[0]),
+                    DEFAULT_PERMISSIONS,
+                    len(channels),
+                    len(members),
+                    categories,
+                )
+            ],
+            'members': [(self.user_id(m), guild_id, None) for m in members],
+            'channels': channels,
+        }
+
+    def messages(self, guild: int, members: list[int]) -> Iterator[tuple]:
+        """
+        Rows of messages in the guild's text channels, each channel's in order.
+
+        Messages arrive over `history_days` as a Poisson process, a channel's at a rate drawn from
+        its activity. Ids are their millisecond followed by their channel's index, which is unique
+        because a channel never gets two messages in one millisecond.
+        """
+        rng = self._rng('messages', guild)
+        dist = self.dist
+        # history runs on from the seeding date, which is well after the snowflake epoch
+        start = _SEED_MS
+        offset = self.channel_offsets[guild] + self.categories[guild]
+        vocabulary = self.vocabulary
+        mu, sigma = dist.words
+
+        for t in range(self.text[guild]):
+            channel = offset + t
+            channel_id = self.channel_id(channel)
+            count = min(self.history_ms, int(rng.expovariate(1 / self.activity[guild])))
+            gap = self.history_ms / max(count, 1)
+            ms = start
+
+            for _ in range(count):
+                ms = max(ms + 1, ms + round(rng.expovariate(1 / gap)))
+                author = members[int(len(members) * rng.random() ** dist.author_skew)]
+                words = max(1, min(300, int(rng.lognormvariate(mu, sigma))))
+                # a few words make up most of what's said
+                content = ' '.join(vocabulary[int(len(vocabulary) * rng.random() ** 3)] for _ in range(words))
+
+                yield (
+                    ((ms - _EPOCH) << 22) | channel,
+                    self.user_id(author),
+                    content[:2024],
+                    channel_id,
+                    datetime.utcfromtimestamp(ms / 1000),
+                    None,
+                )
+
+
+COLUMNS: dict[str, list[str]] = {
+    'users': ['id', 'username', 'discriminator', 'email', 'password', 'flags', 'system', 'suspended'],
+    'settings': ['user_id', 'status'],
+    'guilds': [
+        'id', 'name', 'flags', 'owner_id', 'permissions', 'channel_count', 'member_count', 'max_position'
+    ],
+    'members': ['user_id', 'guild_id', 'nick'],
+    'channels': ['id', 'type', 'name', 'parent_id', 'guild_id', 'position', 'max_position'],
+    'messages': ['id', 'author_id', 'content', 'channel_id', 'timestamp', 'edited_timestamp'],
+}
+
+
+async def _connect(uri: str):
+    import asyncpg
+
+    conn = await asyncpg.connect(uri.replace('postgresql+asyncpg://', 'postgresql://'))
+    # a lost seed is simply run again
+    await conn.execute('SET synchronous_commit TO off')
+    return conn
+
+
+async def _copy_users(uri: str, plan: Plan, password: str, lo: int, hi: int, batch: int) -> Counter[str]:
+    rows: Counter[str] = Counter()
+    conn = await _connect(uri)
+
+    try:
+        for start in range(lo, hi, batch):
+            users = range(start, min(hi, start + batch))
+            records = [
+                (
+                    plan.user_id(i),
+                    f'user{i}',
+                    '%04d' % (i % 9999 + 1),
+                    f'user{i}@bench.derailed.one',
+                    password,
+                    0,
+                    False,
+                    False,
+                )
+                for i in users
+            ]
+            await conn.copy_records_to_table('users', records=records, columns=COLUMNS['users'])
+            await conn.copy_records_to_table(
+                'settings', records=[(r[0], 'ONLINE') for r in records], columns=COLUMNS['settings']
+            )
+            rows['users'] += len(records)
+            rows['settings'] += len(records)
+    finally:
+        await conn.close()
+
+    return rows
+
+
+async def _copy_guilds(uri: str, plan: Plan, worker: int, workers: int, batch: int) -> Counter[str]:
+    rows: Counter[str] = Counter()
+    conn = await _connect(uri)
+
+    async def copy(table: str, records: list[tuple]) -> None:
+        await conn.copy_records_to_table(table, records=records, columns=COLUMNS[table])
+        rows[table] += len(records)
+
+    try:
+        # striding, rather than ranges, evens out the few huge guilds between workers
+        for guild in range(worker, plan.dist.guilds, workers):
+            members = plan.members(guild)
+
+            for table, records in plan.guild(guild, members).items():
+                await copy(table, records)
+
+            messages = []
+
+            for message in plan.messages(guild, members):
+                messages.append(message)
+
+                if len(messages) >= batch:
+                    await copy('messages', messages)
+                    messages = []
+
+            if messages:
+                await copy('messages', messages)
+    finally:
+        await conn.close()
+
+    return rows
+
+
+def _run(coro_fn, *args) -> Counter[str]:
+    # entry point of worker processes, each with its own loop and connection
+    return asyncio.run(coro_fn(*args))
+
+
+async def seed_scale(
+    uri: str, dist: Distributions, seed: int = 0, workers: int = 8, batch: int = 10_000
+) -> Counter[str]:
+    """
+    Copy a generated dataset into the, empty, database at `uri`, from `workers` processes.
+
+    Every user goes in first, since anyone may be a member anywhere, then each worker copies
+    its share of guilds together with their members, channels and messages.
+    """
+    from argon2 import PasswordHasher
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    plan = Plan(dist, seed)
+    password = PasswordHasher().hash(PASSWORD)
+    loop = asyncio.get_running_loop()
+    rows: Counter[str] = Counter()
+
+    with ProcessPoolExecutor(workers) as pool:
+        bounds = [dist.users * w // workers for w in range(workers + 1)]
+        stages = [
+            [(_copy_users, uri, plan, password, bounds[w], bounds[w + 1], batch) for w in range(workers)],
+            [(_copy_guilds, uri, plan, w, workers, batch) for w in range(workers)],
+        ]
+
+        for stage in stages:
+            for result in await asyncio.gather(*(loop.run_in_executor(pool, _run, *args) for args in stage)):
+                rows.update(result)
+
+    engine = create_async_engine(uri)
+
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(
+                text(
+                    '''
+                    UPDATE channels SET last_message_id = (
+                        SELECT max(id) FROM messages WHERE messages.channel_id = channels.id
+                    )
+                    WHERE type = 'TEXT'
+                    '''
+                )
+            )
+
+        async with engine.connect() as conn:
+            await conn.execution_options(isolation_level='AUTOCOMMIT')
+            await conn.execute(text('ANALYZE'))
+    finally:
+        await engine.dispose()
+
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        'benchmarks.scale', description='Generate a large, skewed, deterministic dataset with COPY.'
+    )
+    parser.add_argument('uri', help='of the database, which is wiped')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=8, help='processes copying guilds')
+    parser.add_argument('--batch-size', type=int, default=10_000, help='rows per COPY')
+    defaults = Distributions()
+
+    for name, value in vars(defaults).items():
+        if not isinstance(value, tuple):
+            parser.add_argument('--' + name.replace('_', '-'), type=type(value), default=value)
+
+    args = parser.parse_args()
+    dist = Distributions(**{name: getattr(args, name) for name in vars(defaults) if name != 'words'})
+
+    async def run() -> Counter[str]:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        from derailed.models import Base
+
+        engine = create_async_engine(args.uri)
+
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+
+        await engine.dispose()
+        return await seed_scale(args.uri, dist, args.seed, args.workers, args.batch_size)
+
+    started = time.perf_counter()
+    rows = asyncio.run(run())
+    took = time.perf_counter() - started
+
+    for table, count in rows.items():
+        print(f'{table:<10} {count:>15,}')
+
+    total = sum(rows.values())
+    print(f'{total:,} rows in {timedelta(seconds=round(took))}, {total / took:,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Iterator
+
+from argon2 import PasswordHasher
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from derailed.models import Channel, Guild, Member, Message, Settings, User
+from derailed.models.channel import ChannelType
+from derailed.models.user import DefaultStatus
+from derailed.permissions import DEFAULT_PERMISSIONS
+
+__all__ = ['Dataset', 'PASSWORD', 'seed']
+
+PASSWORD = 'benchmarks-password'
+
+# 2023-06-01, keeps every seeded id the same between runs
+_SEED_MS = 1685577600000
+_EPOCH = 1672531200000
+
+
+def _snowflake(n: int, start_ms: int = _SEED_MS) -> int:
+    # the `n`th id, 4096 to a millisecond from `start_ms`
+    return ((start_ms - _EPOCH + n // 4096) << 22) | (n % 4096)
+
+
+def _snowflakes(start_ms: int = _SEED_MS) -> Iterator[int]:
+    n = 0
+    while True:
+        yield _snowflake(n, start_ms)
+        n += 1
+
+
+class Dataset:
+    def __init__(self) -> None:
+        self.users: list[tuple[int, str]] = []
+        self.guilds: list[int] = []
+        self.owners: dict[int, int] = {}
+        self.channels: dict[int, list[int]] = {}
+        self.messages: int = 0
+
+
+async def seed(
+    session: AsyncSession,
+    seed: int = 0,
+    users: int = 50,
+    guilds: int = 10,
+    channels_per_guild: int = 20,
+    messages_per_channel: int = 200,
+) -> Dataset:
+    """
+    Insert a deterministic dataset.
+
+    Every user shares the same password hash, so logins cost a single argon2 hash to seed.
+    Guilds are owned round-robin by the users and every user is a member of every guild.
+    """
+    rng = random.Random(seed)
+    ids = _snowflakes()
+    data = Dataset()
+    password = PasswordHasher().hash(PASSWORD)
+
+    user_rows = []
+    for i in range(users):
+        uid = next(ids)
+        email = f'user{i}@bench.derailed.one'
+        data.users.append((uid, email))
+        user_rows.append(
+            {
+                'id': uid,
+                'username': f'user{i}',
+                'discriminator': '%04d' % rng.randint(1, 9999),
+                'email': email,
+                'password': password,
+                'flags': 0,
+                'system': False,
+                'suspended': False,
+            }
+        )
+
+    await session.execute(insert(User), user_rows)
+    await session.execute(
+        insert(Settings), [{'user_id': uid, 'status': DefaultStatus.ONLINE} for uid, _ in data.users]
+    )
+
+    guild_rows, member_rows, channel_rows, message_rows = [], [], [], []
+    started = datetime(2023, 6, 1)
+
+    for i in range(guilds):
+        gid = next(ids)
+        owner = data.users[i % users][0]
+        data.guilds.append(gid)
+        data.owners[gid] = owner
+        data.channels[gid] = []
+
+        guild_rows.append(
+            {
+                'id': gid,
+                'name': f'guild{i}',
+                'flags': 0,
+                'owner_id': owner,
+                'permissions': DEFAULT_PERMISSIONS,
+                'channel_count': channels_per_guild + 1,
+                'member_count': users,
+                'max_position': 1,
+            }
+        )
+        member_rows.extend({'user_id': uid, 'guild_id': gid, 'nick': None} for uid, _ in data.users)
+
+        category = next(ids)
+        channel_rows.append(
+            {
+                'id': category,
+                'type': ChannelType.CATEGORY,
+                'name': 'general',
+                'parent_id': None,
+                'guild_id': gid,
+                'position': 1,
+                'max_position': channels_per_guild,
+                'last_message_id': None,
+            }
+        )
+
+        for position in range(1, channels_per_guild + 1):
+            cid = next(ids)
+            data.channels[gid].append(cid)
+            channel_rows.append(
+                {
+                    'id': cid,
+                    'type': ChannelType.TEXT,
+                    'name': f'channel-{position}',
+                    'parent_id': category,
+                    'guild_id': gid,
+                    'position': position,
+                    'max_position': 0,
+                    'last_message_id': None,
+                }
+            )
+
+            for m in range(messages_per_channel):
+                message_rows.append(
+                    {
+                        'id': next(ids),
+                        'author_id': rng.choice(data.users)[0],
+                        'content': 'a' * rng.randint(1, 300),
+                        'channel_id': cid,
+                        'timestamp': started + timedelta(seconds=m),
+                        'edited_timestamp': None,
+                    }
+                )
+
+    await session.execute(insert(Guild), guild_rows)
+    await session.execute(insert(Member), member_rows)
+    await session.execute(insert(Channel), channel_rows)
+
+    for i in range(0, len(message_rows), 5000):
+        await session.execute(insert(Message), message_rows[i : i + 5000])
+
+    data.messages = len(message_rows)
+    await session.commit()
+
+    return data
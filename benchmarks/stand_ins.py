@@ -0,0 +1,218 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+
+from derailed.grpc import derailed_pb2_grpc
+from derailed.grpc.auth import auth_pb2_grpc
+from derailed.grpc.auth.auth_pb2 import NewToken, Valid
+from derailed.grpc.derailed_pb2 import Publr, RepliedGuildInfo, RepliedGuildsInfo, UPublr
+
+__all__ = ['FakeGateway', 'Postgres', 'free_port']
+
+SECRET = b'derailed-benchmarks'
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class _Events:
+    def __init__(self) -> None:
+        self.published: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, event: str) -> None:
+        with self._lock:
+            self.published[event] += 1
+
+
+class FakeGuild(derailed_pb2_grpc.GuildServicer):
+    def __init__(self, events: _Events) -> None:
+        self.events = events
+
+    def publish(self, request, context) -> Publr:
+        self.events.record(request.message.event)
+        return Publr(message='')
+
+    @staticmethod
+    def info(guild_id: str) -> RepliedGuildInfo:
+        # a stable, made up, presence count so previews are comparable between runs
+        return RepliedGuildInfo(presences=int(guild_id) % 1000, available=True)
+
+    def get_guild_info(self, request, context) -> RepliedGuildInfo:
+        return self.info(request.guild_id)
+
+    def get_guilds_info(self, request, context) -> RepliedGuildsInfo:
+        return RepliedGuildsInfo(guilds={guild_id: self.info(guild_id) for guild_id in request.guild_ids})
+
+
+class FakeUser(derailed_pb2_grpc.UserServicer):
+    def __init__(self, events: _Events) -> None:
+        self.events = events
+
+    def publish(self, request, context) -> UPublr:
+        self.events.record(request.message.event)
+        return UPublr(message='')
+
+
+class FakeAuthorization(auth_pb2_grpc.AuthorizationServicer):
+    @staticmethod
+    def sign(user_id: str, password: str) -> str:
+        uid = base64.urlsafe_b64encode(user_id.encode()).decode()
+        signature = hmac.new(SECRET, f'{user_id}:{password}'.encode(), hashlib.sha256).hexdigest()
+        return f'{uid}.{signature}'
+
+    def create(self, request, context) -> NewToken:
+        return NewToken(token=self.sign(request.user_id, request.password))
+
+    def validate(self, request, context) -> Valid:
+        expected = self.sign(request.user_id, request.password)
+        return Valid(valid=hmac.compare_digest(expected, request.token))
+
+
+class FakeGateway:
+    """
+    In-process stand-ins for the Guild, User and Authorization gRPC services.
+
+    Each service listens on its own port and `start` points
+    `GUILD_CHANNEL`, `USER_CHANNEL` and `AUTH_CHANNEL` at them.
+    """
+
+    def __init__(self) -> None:
+        self.events = _Events()
+        self._servers: list[grpc.Server] = []
+
+    def start(self) -> 'FakeGateway':
+        services = {
+            'GUILD_CHANNEL': (derailed_pb2_grpc.add_GuildServicer_to_server, FakeGuild(self.events)),
+            'USER_CHANNEL': (derailed_pb2_grpc.add_UserServicer_to_server, FakeUser(self.events)),
+            'AUTH_CHANNEL': (auth_pb2_grpc.add_AuthorizationServicer_to_server, FakeAuthorization()),
+        }
+
+        for env, (add, servicer) in services.items():
+            server = grpc.server(ThreadPoolExecutor(max_workers=4))
+            add(servicer, server)
+            port = server.add_insecure_port('127.0.0.1:0')
+            server.start()
+
+            self._servers.append(server)
+            os.environ[env] = f'127.0.0.1:{port}'
+
+        return self
+
+    def stop(self) -> None:
+        for server in self._servers:
+            server.stop(None)
+
+        self._servers.clear()
+
+    def __enter__(self) -> 'FakeGateway':
+        """Start every service."""
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        """Stop every service."""
+        self.stop()
+
+
+class Postgres:
+    """
+    A throwaway Postgres cluster.
+
+    Uses `BENCH_PG_URI` when set, otherwise runs `initdb` and `pg_ctl`
+    (from `PG_BIN` or `PATH`) in a temporary directory, with durability turned off.
+    """
+
+    def __init__(self, uri: str | None = None) -> None:
+        self.uri = uri or os.getenv('BENCH_PG_URI')
+        self._datadir: str | None = None
+        self._pg_ctl: str | None = None
+
+    @staticmethod
+    def available() -> bool:
+        return bool(os.getenv('BENCH_PG_URI')) or Postgres._binary('initdb') is not None
+
+    @staticmethod
+    def _binary(name: str) -> str | None:
+        pg_bin = os.getenv('PG_BIN')
+        if pg_bin:
+            return os.path.join(pg_bin, name)
+        return shutil.which(name)
+
+    def start(self) -> str:
+        if self.uri is not None:
+            return self.uri
+
+        initdb = self._binary('initdb')
+
+        if initdb is None:
+            raise RuntimeError('Postgres is unavailable, install it or set BENCH_PG_URI')
+
+        self._pg_ctl = self._binary('pg_ctl')
+        self._datadir = tempfile.mkdtemp(prefix='derailed-bench-')
+        port = free_port()
+
+        subprocess.run(
+            [initdb, '-D', self._datadir, '-U', 'postgres', '--auth=trust', '--no-sync'],
+            check=True,
+            capture_output=True,
+        )
+        options = (
+            f'-p {port} -k {self._datadir} -c fsync=off -c synchronous_commit=off -c full_page_writes=off'
+        )
+        subprocess.run(
+            [self._pg_ctl, '-D', self._datadir, '-o', options, '-w', 'start'],
+            check=True,
+            capture_output=True,
+        )
+
+        self.uri = f'postgresql+asyncpg://postgres@127.0.0.1:{port}/postgres'
+        return self.uri
+
+    def stop(self) -> None:
+        if self._datadir is None:
+            return
+
+        subprocess.run([self._pg_ctl, '-D', self._datadir, '-m', 'immediate', 'stop'], capture_output=True)
+
+        # give the postmaster a moment to let go of the directory
+        time.sleep(0.1)
+        shutil.rmtree(self._datadir, ignore_errors=True)
+        self._datadir = None
+
+    def __enter__(self) -> str:
+        """Start the cluster, returning its URI."""
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        """Stop the cluster, if it was started here."""
+        self.stop()
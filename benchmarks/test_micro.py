@@ -0,0 +1,96 @@
+"""
+Micro-benchmarks of the pure-Python helpers every request goes through.
+
+Run with `pytest benchmarks`, see the README for comparing against a baseline.
+"""
+import base64
+import os
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+# the database module needs a URI to build its (unconnected) engine
+os.environ.setdefault('PG_URI', 'postgresql+asyncpg://bench@localhost/bench')
+
+from fastapi import APIRouter  # noqa: E402
+
+from derailed.database import to_dict  # noqa: E402
+from derailed.identification import IDMedium, version  # noqa: E402
+from derailed.models import Message  # noqa: E402
+from derailed.permissions import GuildPermissions, merge_permissions, unwrap_guild_permissions  # noqa: E402
+from derailed.powerbase import parse_token  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def roles():
+    perms = list(GuildPermissions)
+    return [
+        unwrap_guild_permissions(
+            allow=perms[i % len(perms)] | perms[(i * 7) % len(perms)],
+            deny=perms[(i * 3) % len(perms)] if i % 4 == 0 else 0,
+            pos=i,
+        )
+        for i in range(50)
+    ]
+
+
+@pytest.fixture(scope='module')
+def messages():
+    return [
+        Message(
+            id=(1 << 50) + i,
+            author_id=(1 << 45) + i,
+            content='a' * 200,
+            channel_id=1 << 48,
+            timestamp=datetime(2023, 6, 1),
+            edited_timestamp=None,
+        )
+        for i in range(100)
+    ]
+
+
+def test_merge_permissions_50_roles(benchmark, roles):
+    benchmark(merge_permissions, *roles)
+
+
+def test_to_dict_100_messages(benchmark, messages):
+    result = benchmark(to_dict, messages)
+    assert len(result) == 100
+
+
+def test_snowflake_10k(benchmark):
+    medium = IDMedium(node_id=1)
+
+    def take() -> None:
+        for _ in range(10_000):
+            medium.snowflake()
+
+    benchmark(take)
+
+
+def test_take_10k(benchmark):
+    # bounded by the 4096 ids a node may issue per millisecond, about 4 million per second
+    medium = IDMedium(node_id=1)
+
+    assert len(benchmark(medium.take, 10_000)) == 10_000
+
+
+def test_version_route_expansion(benchmark):
+    async def endpoint() -> None:
+        ...
+
+    def expand() -> None:
+        router = APIRouter()
+
+        for i in range(20):
+            version(f'/guilds/{{guild_id}}/route{i}', 1, router, 'GET')(endpoint)
+
+    benchmark(expand)
+
+
+def test_parse_token(benchmark):
+    token = base64.urlsafe_b64encode(str(1 << 60).encode()).decode() + '.' + 'a' * 64
+
+    assert benchmark(parse_token, token) == 1 << 60
@@ -0,0 +1,140 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable
+
+import httpx
+
+from .hdr import Histogram
+from .seed import PASSWORD, Dataset
+
+__all__ = ['Context', 'WORKLOADS', 'run']
+
+
+class Context:
+    def __init__(self, data: Dataset, seed: int = 0) -> None:
+        self.data = data
+        self.rng = random.Random(seed)
+        # guild_id -> token of its owner
+        self.tokens: dict[int, str] = {}
+
+    async def login_owners(self, client: httpx.AsyncClient) -> None:
+        emails = dict(self.data.users)
+
+        for guild_id, owner_id in self.data.owners.items():
+            resp = await client.post('/v1/login', json={'email': emails[owner_id], 'password': PASSWORD})
+            resp.raise_for_status()
+            self.tokens[guild_id] = resp.json()['token']
+
+    def guild(self) -> tuple[int, dict[str, str]]:
+        guild_id = self.rng.choice(self.data.guilds)
+        return guild_id, {'Authorization': self.tokens[guild_id]}
+
+    def channel(self) -> tuple[int, dict[str, str]]:
+        guild_id, headers = self.guild()
+        return self.rng.choice(self.data.channels[guild_id]), headers
+
+
+Workload = Callable[[httpx.AsyncClient, Context], Awaitable[httpx.Response]]
+
+
+async def login(client: httpx.AsyncClient, ctx: Context) -> httpx.Response:
+    _, email = ctx.rng.choice(ctx.data.users)
+    return await client.post('/v1/login', json={'email': email, 'password': PASSWORD})
+
+
+async def message_send(client: httpx.AsyncClient, ctx: Context) -> httpx.Response:
+    channel_id, headers = ctx.channel()
+    content = 'a' * ctx.rng.randint(1, 300)
+    return await client.post(
+        f'/v1/channels/{channel_id}/messages', json={'content': content}, headers=headers
+    )
+
+
+async def history_read(client: httpx.AsyncClient, ctx: Context) -> httpx.Response:
+    channel_id, headers = ctx.channel()
+    return await client.get(f'/v1/channels/{channel_id}/messages', params={'limit': 50}, headers=headers)
+
+
+async def channel_list(client: httpx.AsyncClient, ctx: Context) -> httpx.Response:
+    guild_id, headers = ctx.guild()
+    return await client.get(f'/v1/guilds/{guild_id}/channels', headers=headers)
+
+
+async def guild_preview(client: httpx.AsyncClient, ctx: Context) -> httpx.Response:
+    guild_id, _ = ctx.guild()
+    return await client.get(f'/v1/guilds/{guild_id}/preview')
+
+
+WORKLOADS: dict[str, Workload] = {
+    'login': login,
+    'message_send': message_send,
+    'history_read': history_read,
+    'channel_list': channel_list,
+    'guild_preview': guild_preview,
+}
+
+
+async def run(
+    client: httpx.AsyncClient,
+    ctx: Context,
+    workload: Workload,
+    duration: float,
+    concurrency: int,
+    warmup: float = 1.0,
+) -> dict[str, Any]:
+    """
+    Run `workload` from `concurrency` closed-loop workers.
+
+    Requests finishing during the `warmup` seconds aren't recorded.
+    """
+    histogram = Histogram()
+    errors = 0
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    async def worker() -> None:
+        nonlocal errors
+
+        while True:
+            begin = time.perf_counter()
+
+            if begin >= deadline:
+                return
+
+            resp = await workload(client, ctx)
+            end = time.perf_counter()
+
+            if begin < measure_from:
+                continue
+
+            histogram.record(end - begin)
+
+            if resp.status_code >= 400:
+                errors += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    return {
+        'requests': histogram.count,
+        'errors': errors,
+        'throughput': round(histogram.count / duration, 2),
+        'latency_us': histogram.summary(),
+    }
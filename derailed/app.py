@@ -14,11 +14,10 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import asyncio
 import os
 
 if os.name != 'nt':
-    import asyncio
-
     import uvloop
 
     asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
@@ -30,7 +29,13 @@ from .models.base import Base
 
 load_dotenv()
 
-from .database import engine
+from .database import AsyncSessionFactory, engine
+from .identification import DatabaseLease, medium
+from .partitions import MESSAGE_PARTITIONING, create_ahead, maintain
+from .powerbase import ORDERING, acks, deletor, presences, rebalancer
+from .profiler import ProfilerMiddleware
+from .querywatch import QueryWatchMiddleware, install
+from .retention import Purger
 
 # routers
 from .routers import user
@@ -44,12 +49,67 @@ app.include_router(guild_management.router)
 app.include_router(guild_channel.router)
 app.include_router(message.router)
 
+app.add_middleware(
+    ProfilerMiddleware,
+    directory=os.getenv('PROFILE_DIR', 'profiles'),
+    token=os.getenv('PROFILE_TOKEN'),
+    sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+    threshold_ms=float(os.getenv('PROFILE_THRESHOLD_MS', '0')),
+)
+
+if os.getenv('QUERY_WATCH'):
+    install(engine.sync_engine)
+    app.add_middleware(QueryWatchMiddleware, strict=os.environ['QUERY_WATCH'] == 'strict')
+
+
+_background: set[asyncio.Task] = set()
+
+
+def _run_in_background(coro) -> None:
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
 
 @app.on_event('startup')
 async def on_startup() -> None:
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+        if MESSAGE_PARTITIONING == 'range':
+            # messages can't be inserted before their partition exists
+            await create_ahead(conn)
+
+    if MESSAGE_PARTITIONING == 'range':
+        _run_in_background(maintain(engine))
+
+    if os.getenv('SNOWFLAKE_LEASE') == 'database':
+        lease = DatabaseLease(AsyncSessionFactory)
+        medium.node_id = await lease.acquire()
+
+        _run_in_background(lease.keep_alive(medium))
+
+    if ORDERING == 'rank':
+        _run_in_background(rebalancer.run())
+
+    _run_in_background(acks.run())
+    _run_in_background(presences.run())
+
+    # off when deletion jobs are left to `python -m derailed.deletion` workers instead
+    if os.getenv('DELETION_JOBS', 'on') != 'off':
+        _run_in_background(deletor.run())
+
+    # every process would purge the same messages, so this is opted into for one of them
+    if os.getenv('RETENTION_PURGE') == 'on':
+        _run_in_background(Purger(AsyncSessionFactory).run())
+
+
+@app.on_event('shutdown')
+async def on_shutdown() -> None:
+    # acks and presences only live in memory until flushed
+    await acks.drain()
+    await presences.drain()
+
 
 @app.get('/')
 async def index(request: Request) -> str:
@@ -0,0 +1,280 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import socket
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import delete, or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from .identification import medium
+from .models.activity import Activity
+from .models.channel import Channel, ChannelMember, Mention, Message, ReadState, UnreadMention
+from .models.guild import Guild, GuildTemplate, Invite
+from .models.job import DeletionJob, JobKind
+from .models.member import Member, MemberRole, Role, RolePermissions
+from .models.user import GuildPosition, Settings, User
+
+__all__ = ['BATCH_SIZE', 'Deletor', 'STEPS', 'schedule']
+
+log = logging.getLogger(__name__)
+
+# rows deleted per transaction, and the pause between them, so jobs never hog the database
+BATCH_SIZE = int(os.getenv('DELETION_BATCH_SIZE', '1000'))
+PAUSE_MS = float(os.getenv('DELETION_PAUSE_MS', '50'))
+
+# deletes at most `limit` rows of one kind, returning how many it did
+Step = Callable[[AsyncSession, int, int], Awaitable[int]]
+
+
+def _chunk(model: Any, where: Callable[[int], Any]) -> Step:
+    primary_key = list(model.__table__.primary_key.columns)
+
+    async def step(session: AsyncSession, target_id: int, limit: int) -> int:
+        chosen = select(*primary_key).where(where(target_id)).limit(limit)
+        stmt = (
+            delete(model)
+            .where(tuple_(*primary_key).in_(chosen))
+            .execution_options(synchronize_session=False)
+        )
+        return (await session.execute(stmt)).rowcount
+
+    return step
+
+
+def _unset(column: Any, where: Callable[[int], Any]) -> Step:
+    # drops references which would otherwise block deleting what they point at
+    async def step(session: AsyncSession, target_id: int, limit: int) -> int:
+        stmt = (
+            update(column.class_)
+            .where(where(target_id))
+            .values({column.key: None})
+            .execution_options(synchronize_session=False)
+        )
+        await session.execute(stmt)
+        return 0
+
+    return step
+
+
+async def _leave_guilds(session: AsyncSession, user_id: int, limit: int) -> int:
+    guild_ids = select(Member.guild_id).where(Member.user_id == user_id)
+    await session.execute(
+        update(Guild)
+        .where(Guild.id.in_(guild_ids))
+        .values(member_count=Guild.member_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(
+        delete(Member).where(Member.user_id == user_id).execution_options(synchronize_session=False)
+    )
+    return 0
+
+
+def _guild_channels(guild_id: int) -> Any:
+    return select(Channel.id).where(Channel.guild_id == guild_id)
+
+
+def _guild_roles(guild_id: int) -> Any:
+    return select(Role.id).where(Role.guild_id == guild_id)
+
+
+def _authored(user_id: int) -> Any:
+    return select(Message.id).where(Message.author_id == user_id)
+
+
+# run in order, each one repeated until it deletes less than a whole batch
+STEPS: dict[JobKind, list[Step]] = {
+    JobKind.CHANNEL: [
+        _unset(Channel.last_message_id, lambda t: Channel.id == t),
+        _chunk(Mention, lambda t: Mention.channel_id == t),
+        _chunk(UnreadMention, lambda t: UnreadMention.channel_id == t),
+        _chunk(ReadState, lambda t: ReadState.channel_id == t),
+        _chunk(Message, lambda t: Message.channel_id == t),
+        _chunk(ChannelMember, lambda t: ChannelMember.channel_id == t),
+        _chunk(Channel, lambda t: Channel.id == t),
+    ],
+    JobKind.GUILD: [
+        _chunk(GuildTemplate, lambda t: GuildTemplate.guild_id == t),
+        _chunk(Invite, lambda t: Invite.guild_id == t),
+        _unset(Channel.last_message_id, lambda t: Channel.guild_id == t),
+        _chunk(Mention, lambda t: Mention.channel_id.in_(_guild_channels(t))),
+        _chunk(UnreadMention, lambda t: UnreadMention.channel_id.in_(_guild_channels(t))),
+        _chunk(ReadState, lambda t: ReadState.channel_id.in_(_guild_channels(t))),
+        _chunk(Message, lambda t: Message.channel_id.in_(_guild_channels(t))),
+        _chunk(ChannelMember, lambda t: ChannelMember.channel_id.in_(_guild_channels(t))),
+        _unset(Channel.parent_id, lambda t: Channel.guild_id == t),
+        _chunk(Channel, lambda t: Channel.guild_id == t),
+        _chunk(MemberRole, lambda t: MemberRole.guild_id == t),
+        _chunk(RolePermissions, lambda t: RolePermissions.role_id.in_(_guild_roles(t))),
+        _chunk(Role, lambda t: Role.guild_id == t),
+        _chunk(Member, lambda t: Member.guild_id == t),
+        _chunk(GuildPosition, lambda t: GuildPosition.guild_id == t),
+        _chunk(Guild, lambda t: Guild.id == t),
+    ],
+    JobKind.USER: [
+        _unset(Channel.last_message_id, lambda t: Channel.last_message_id.in_(_authored(t))),
+        _chunk(Mention, lambda t: Mention.id.in_(_authored(t))),
+        _chunk(Message, lambda t: Message.author_id == t),
+        _chunk(Mention, lambda t: Mention.target_id == t),
+        _chunk(UnreadMention, lambda t: UnreadMention.user_id == t),
+        _chunk(ReadState, lambda t: ReadState.user_id == t),
+        _chunk(Invite, lambda t: Invite.author_id == t),
+        _chunk(GuildTemplate, lambda t: GuildTemplate.creator_id == t),
+        _chunk(MemberRole, lambda t: MemberRole.user_id == t),
+        _leave_guilds,
+        _chunk(GuildPosition, lambda t: GuildPosition.user_id == t),
+        _chunk(ChannelMember, lambda t: ChannelMember.user_id == t),
+        _chunk(Activity, lambda t: Activity.user_id == t),
+        _chunk(Settings, lambda t: Settings.user_id == t),
+        _chunk(User, lambda t: User.id == t),
+    ],
+}
+
+
+def schedule(session: AsyncSession, kind: JobKind, target_id: int) -> DeletionJob:
+    """
+    Queue deleting `target_id` and everything depending on it, committed along with the caller's changes.
+    """
+    job = DeletionJob(
+        id=medium.snowflake(),
+        kind=kind,
+        target_id=target_id,
+        step=0,
+        deleted=0,
+        created_at=datetime.utcnow(),
+    )
+    session.add(job)
+    return job
+
+
+class Deletor:
+    """
+    Works through deletion jobs a batch at a time.
+
+    Every batch commits together with the job's progress, so a job picks up where it left off after
+    a restart, and jobs held by a process which went away are taken over once their hold expires.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        batch_size: int = BATCH_SIZE,
+        pause: float = PAUSE_MS / 1000,
+        interval: float = 5.0,
+        hold: timedelta = timedelta(seconds=60),
+    ) -> None:
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self.hold = hold
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}'
+        self._wake = asyncio.Event()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    async def claim(self) -> int | None:
+        now = datetime.utcnow()
+        stmt = (
+            select(DeletionJob)
+            .where(DeletionJob.finished_at.is_(None))
+            .where(or_(DeletionJob.held_until.is_(None), DeletionJob.held_until < now))
+            .order_by(DeletionJob.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+
+        async with self.session_factory() as session:
+            job = (await session.execute(stmt)).scalar()
+
+            if job is None:
+                return None
+
+            job.holder = self.holder
+            job.held_until = now + self.hold
+            await session.commit()
+
+            return job.id
+
+    async def batch(self, job_id: int) -> bool:
+        """
+        Run one batch of a job, returning whether there's more to do.
+        """
+        async with self.session_factory() as session:
+            stmt = (
+                select(DeletionJob)
+                .where(DeletionJob.id == job_id)
+                .where(DeletionJob.holder == self.holder)
+                .with_for_update()
+            )
+            job = (await session.execute(stmt)).scalar()
+
+            if job is None or job.finished_at is not None:
+                # taken over, after we went too long without renewing
+                return False
+
+            steps = STEPS[job.kind]
+            now = datetime.utcnow()
+
+            if job.step >= len(steps):
+                job.finished_at = now
+                await session.commit()
+                log.info('deleted %s %d, %d rows', job.kind.value, job.target_id, job.deleted)
+                return False
+
+            done = await steps[job.step](session, job.target_id, self.batch_size)
+
+            job.deleted += done
+            job.held_until = now + self.hold
+
+            if done < self.batch_size:
+                job.step += 1
+
+            await session.commit()
+            return True
+
+    async def run(self) -> None:
+        while True:
+            try:
+                job_id = await self.claim()
+
+                while job_id is not None and await self.batch(job_id):
+                    await asyncio.sleep(self.pause)
+            except Exception:
+                log.exception('deletion job failed, retrying')
+                job_id = None
+
+            if job_id is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+                self._wake.clear()
+
+
+if __name__ == '__main__':
+    from .database import AsyncSessionFactory
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(Deletor(AsyncSessionFactory).run())
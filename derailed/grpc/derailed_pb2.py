@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(
-    b'\n\x0e\x64\x65railed.proto\x12\rderailed.grpc"&\n\x07Message\x12\r\n\x05\x65vent\x18\x01 \x01(\t\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\t"A\n\x04Publ\x12\x10\n\x08guild_id\x18\x01 \x01(\t\x12\'\n\x07message\x18\x02 \x01(\x0b\x32\x16.derailed.grpc.Message"\x18\n\x05Publr\x12\x0f\n\x07message\x18\x01 \x01(\t" \n\x0cGetGuildInfo\x12\x10\n\x08guild_id\x18\x01 \x01(\t"8\n\x10RepliedGuildInfo\x12\x11\n\tpresences\x18\x01 \x01(\x05\x12\x11\n\tavailable\x18\x02 \x01(\x08"A\n\x05UPubl\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\'\n\x07message\x18\x02 \x01(\x0b\x32\x16.derailed.grpc.Message"\x19\n\x06UPublr\x12\x0f\n\x07message\x18\x01 \x01(\t2\x91\x01\n\x05Guild\x12\x36\n\x07publish\x12\x13.derailed.grpc.Publ\x1a\x14.derailed.grpc.Publr"\x00\x12P\n\x0eget_guild_info\x12\x1b.derailed.grpc.GetGuildInfo\x1a\x1f.derailed.grpc.RepliedGuildInfo"\x00\x32@\n\x04User\x12\x38\n\x07publish\x12\x14.derailed.grpc.UPubl\x1a\x15.derailed.grpc.UPublr"\x00\x42+\n\x11one.derailed.grpcB\rDerailedProtoP\x01\xa2\x02\x04\x44RLPb\x06proto3'
+    b'\n\x0e\x64\x65railed.proto\x12\rderailed.grpc"&\n\x07Message\x12\r\n\x05\x65vent\x18\x01 \x01(\t\x12\x0c\n\x04\x64\x61ta\x18\x02 \x01(\t"A\n\x04Publ\x12\x10\n\x08guild_id\x18\x01 \x01(\t\x12\'\n\x07message\x18\x02 \x01(\x0b\x32\x16.derailed.grpc.Message"\x18\n\x05Publr\x12\x0f\n\x07message\x18\x01 \x01(\t" \n\x0cGetGuildInfo\x12\x10\n\x08guild_id\x18\x01 \x01(\t"8\n\x10RepliedGuildInfo\x12\x11\n\tpresences\x18\x01 \x01(\x05\x12\x11\n\tavailable\x18\x02 \x01(\x08""\n\rGetGuildsInfo\x12\x11\n\tguild_ids\x18\x01 \x03(\t"\xa1\x01\n\x11RepliedGuildsInfo\x12<\n\x06guilds\x18\x01 \x03(\x0b\x32,.derailed.grpc.RepliedGuildsInfo.GuildsEntry\x1aN\n\x0bGuildsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12.\n\x05value\x18\x02 \x01(\x0b\x32\x1f.derailed.grpc.RepliedGuildInfo:\x02\x38\x01"A\n\x05UPubl\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\'\n\x07message\x18\x02 \x01(\x0b\x32\x16.derailed.grpc.Message"\x19\n\x06UPublr\x12\x0f\n\x07message\x18\x01 \x01(\t2\xe6\x01\n\x05Guild\x12\x36\n\x07publish\x12\x13.derailed.grpc.Publ\x1a\x14.derailed.grpc.Publr"\x00\x12P\n\x0eget_guild_info\x12\x1b.derailed.grpc.GetGuildInfo\x1a\x1f.derailed.grpc.RepliedGuildInfo"\x00\x12S\n\x0fget_guilds_info\x12\x1c.derailed.grpc.GetGuildsInfo\x1a .derailed.grpc.RepliedGuildsInfo"\x00\x32@\n\x04User\x12\x38\n\x07publish\x12\x14.derailed.grpc.UPubl\x1a\x15.derailed.grpc.UPublr"\x00\x42+\n\x11one.derailed.grpcB\rDerailedProtoP\x01\xa2\x02\x04\x44RLPb\x06proto3'
 )
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
@@ -22,6 +22,8 @@ if _descriptor._USE_C_DESCRIPTORS is False:
 
     DESCRIPTOR._options = None
     DESCRIPTOR._serialized_options = b'\n\021one.derailed.grpcB\rDerailedProtoP\001\242\002\004DRLP'
+    _REPLIEDGUILDSINFO_GUILDSENTRY._options = None
+    _REPLIEDGUILDSINFO_GUILDSENTRY._serialized_options = b'8\001'
     _MESSAGE._serialized_start = 33
     _MESSAGE._serialized_end = 71
     _PUBL._serialized_start = 73
@@ -32,12 +34,18 @@ if _descriptor._USE_C_DESCRIPTORS is False:
     _GETGUILDINFO._serialized_end = 198
     _REPLIEDGUILDINFO._serialized_start = 200
     _REPLIEDGUILDINFO._serialized_end = 256
-    _UPUBL._serialized_start = 258
-    _UPUBL._serialized_end = 323
-    _UPUBLR._serialized_start = 325
-    _UPUBLR._serialized_end = 350
-    _GUILD._serialized_start = 353
-    _GUILD._serialized_end = 498
-    _USER._serialized_start = 500
-    _USER._serialized_end = 564
+    _GETGUILDSINFO._serialized_start = 258
+    _GETGUILDSINFO._serialized_end = 292
+    _REPLIEDGUILDSINFO._serialized_start = 295
+    _REPLIEDGUILDSINFO._serialized_end = 456
+    _REPLIEDGUILDSINFO_GUILDSENTRY._serialized_start = 378
+    _REPLIEDGUILDSINFO_GUILDSENTRY._serialized_end = 456
+    _UPUBL._serialized_start = 458
+    _UPUBL._serialized_end = 523
+    _UPUBLR._serialized_start = 525
+    _UPUBLR._serialized_end = 550
+    _GUILD._serialized_start = 553
+    _GUILD._serialized_end = 783
+    _USER._serialized_start = 785
+    _USER._serialized_end = 849
 # @@protoc_insertion_point(module_scope)
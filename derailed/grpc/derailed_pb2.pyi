@@ -1,10 +1,12 @@
 from typing import ClassVar as _ClassVar
+from typing import Iterable as _Iterable
 from typing import Mapping as _Mapping
 from typing import Optional as _Optional
 from typing import Union as _Union
 
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
+from google.protobuf.internal import containers as _containers
 
 DESCRIPTOR: _descriptor.FileDescriptor
 
@@ -14,6 +16,12 @@ class GetGuildInfo(_message.Message):
     guild_id: str
     def __init__(self, guild_id: _Optional[str] = ...) -> None: ...
 
+class GetGuildsInfo(_message.Message):
+    __slots__ = ['guild_ids']
+    GUILD_IDS_FIELD_NUMBER: _ClassVar[int]
+    guild_ids: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, guild_ids: _Optional[_Iterable[str]] = ...) -> None: ...
+
 class Message(_message.Message):
     __slots__ = ['data', 'event']
     DATA_FIELD_NUMBER: _ClassVar[int]
@@ -46,6 +54,22 @@ class RepliedGuildInfo(_message.Message):
     presences: int
     def __init__(self, presences: _Optional[int] = ..., available: bool = ...) -> None: ...
 
+class RepliedGuildsInfo(_message.Message):
+    __slots__ = ['guilds']
+
+    class GuildsEntry(_message.Message):
+        __slots__ = ['key', 'value']
+        KEY_FIELD_NUMBER: _ClassVar[int]
+        VALUE_FIELD_NUMBER: _ClassVar[int]
+        key: str
+        value: RepliedGuildInfo
+        def __init__(
+            self, key: _Optional[str] = ..., value: _Optional[_Union[RepliedGuildInfo, _Mapping]] = ...
+        ) -> None: ...
+    GUILDS_FIELD_NUMBER: _ClassVar[int]
+    guilds: _containers.MessageMap[str, RepliedGuildInfo]
+    def __init__(self, guilds: _Optional[_Mapping[str, RepliedGuildInfo]] = ...) -> None: ...
+
 class UPubl(_message.Message):
     __slots__ = ['message', 'user_id']
     MESSAGE_FIELD_NUMBER: _ClassVar[int]
@@ -25,6 +25,11 @@ class GuildStub(object):
             request_serializer=derailed__pb2.GetGuildInfo.SerializeToString,
             response_deserializer=derailed__pb2.RepliedGuildInfo.FromString,
         )
+        self.get_guilds_info = channel.unary_unary(
+            '/derailed.grpc.Guild/get_guilds_info',
+            request_serializer=derailed__pb2.GetGuildsInfo.SerializeToString,
+            response_deserializer=derailed__pb2.RepliedGuildsInfo.FromString,
+        )
 
 
 class GuildServicer(object):
@@ -42,6 +47,12 @@ class GuildServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def get_guilds_info(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_GuildServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -55,6 +66,11 @@ def add_GuildServicer_to_server(servicer, server):
             request_deserializer=derailed__pb2.GetGuildInfo.FromString,
             response_serializer=derailed__pb2.RepliedGuildInfo.SerializeToString,
         ),
+        'get_guilds_info': grpc.unary_unary_rpc_method_handler(
+            servicer.get_guilds_info,
+            request_deserializer=derailed__pb2.GetGuildsInfo.FromString,
+            response_serializer=derailed__pb2.RepliedGuildsInfo.SerializeToString,
+        ),
     }
     generic_handler = grpc.method_handlers_generic_handler('derailed.grpc.Guild', rpc_method_handlers)
     server.add_generic_rpc_handlers((generic_handler,))
@@ -122,6 +138,35 @@ class Guild(object):
             metadata,
         )
 
+    @staticmethod
+    def get_guilds_info(
+        request,
+        target,
+        options=(),
+        channel_credentials=None,
+        call_credentials=None,
+        insecure=False,
+        compression=None,
+        wait_for_ready=None,
+        timeout=None,
+        metadata=None,
+    ):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/derailed.grpc.Guild/get_guilds_info',
+            derailed__pb2.GetGuildsInfo.SerializeToString,
+            derailed__pb2.RepliedGuildsInfo.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+        )
+
 
 class UserStub(object):
     """Missing associated documentation comment in .proto file."""
@@ -14,49 +14,382 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import asyncio
+import atexit
+import logging
 import os
 import secrets
+import socket
+import tempfile
 import threading
 import time
+import weakref
+from datetime import datetime, timedelta, timezone
 from random import randint
 from typing import Callable
 
 from fastapi import APIRouter
+from sqlalchemy import func, select, text, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .models.snowflake import SnowflakeNode
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
 
 versions = 1
 default_version = 1
 
+log = logging.getLogger(__name__)
+
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+# the top 2^IMPORT_NODE_BITS node ids are never leased, they're kept for ids made by the importer
+IMPORT_NODE_BITS = 4
+MAX_LEASED_NODE_ID = MAX_NODE_ID - (1 << IMPORT_NODE_BITS)
+
+# how far behind the last issued id the clock may be at startup before we refuse to wait it out
+MAX_CLOCK_WAIT_MS = 5000
+
+
+def _clock_wait(high_water: int) -> float:
+    # seconds to wait for the clock to pass the last id issued by this node
+    behind = high_water - int(time.time() * 1000)
+
+    if behind > MAX_CLOCK_WAIT_MS:
+        raise RuntimeError(f'Clock is {behind}ms behind the last id issued by this node')
+    elif behind >= 0:
+        log.warning('clock is %dms behind the last id issued by this node, waiting', behind)
+        return (behind + 1) / 1000
+
+    return 0
+
+
+class FileLease:
+    """
+    Leases a node id unique to this host by locking one of `MAX_LEASED_NODE_ID + 1` files.
+
+    The lock is dropped by the OS when the process exits, and the last millisecond
+    the node issued an id in is written back on release.
+    """
+
+    def __init__(self, directory: str | None = None) -> None:
+        self.directory = directory or os.getenv(
+            'SNOWFLAKE_LEASE_DIR', os.path.join(tempfile.gettempdir(), 'derailed-snowflake')
+        )
+        self.node_id: int | None = None
+        self._file = None
+
+    @staticmethod
+    def _lock(fd: int) -> bool:
+        try:
+            if os.name == 'nt':
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def acquire(self) -> int:
+        os.makedirs(self.directory, exist_ok=True)
+
+        # start at a pid dependant offset, so workers don't all fight over node 0
+        start = os.getpid() % (MAX_LEASED_NODE_ID + 1)
+
+        for i in range(MAX_LEASED_NODE_ID + 1):
+            node_id = (start + i) % (MAX_LEASED_NODE_ID + 1)
+            f = open(os.path.join(self.directory, f'node-{node_id}.lock'), 'a+')
+
+            if not self._lock(f.fileno()):
+                f.close()
+                continue
+
+            f.seek(0)
+            high_water = f.read().strip()
+
+            if high_water:
+                time.sleep(_clock_wait(int(high_water)))
+
+            self._file = f
+            self.node_id = node_id
+            return node_id
+
+        raise RuntimeError('Every snowflake node id on this host is leased')
+
+    def release(self, high_water: int = 0) -> None:
+        if self._file is None:
+            return
+
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(str(high_water))
+        self._file.close()
+        self._file = None
+        self.node_id = None
+
+
+class DatabaseLease:
+    """
+    Leases a node id unique across every host sharing a database.
+
+    The lease has to be renewed before `ttl` runs out, see `keep_alive`.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker, ttl: float = 60.0) -> None:
+        self.session_factory = session_factory
+        self.ttl = timedelta(seconds=ttl)
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}'
+        self.node_id: int | None = None
+
+    async def acquire(self) -> int:
+        # take the lowest free or expired node in one statement,
+        # losing a race to another acquirer just means trying again
+        stmt = text(
+            '''
+            INSERT INTO snowflake_nodes (node_id, holder, expires_at, high_water)
+            SELECT n, :holder, :expires_at, 0 FROM generate_series(0, :max_node) AS n
+            WHERE n NOT IN (SELECT node_id FROM snowflake_nodes WHERE expires_at > :now)
+            ORDER BY n LIMIT 1
+            ON CONFLICT (node_id) DO UPDATE
+            SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE snowflake_nodes.expires_at <= :now
+            RETURNING node_id, high_water
+            '''
+        )
+
+        for _ in range(10):
+            now = datetime.utcnow()
+            params = {
+                'holder': self.holder,
+                'expires_at': now + self.ttl,
+                'now': now,
+                'max_node': MAX_LEASED_NODE_ID,
+            }
+
+            async with self.session_factory() as session:
+                result = await session.execute(stmt, params)
+                row = result.first()
+                await session.commit()
+
+            if row is not None:
+                # also called from `keep_alive`, so never block the loop
+                await asyncio.sleep(_clock_wait(row.high_water))
+                self.node_id = row.node_id
+                return row.node_id
+
+            async with self.session_factory() as session:
+                taken = await session.scalar(
+                    select(func.count()).select_from(SnowflakeNode).where(SnowflakeNode.expires_at > now)
+                )
+
+            if taken > MAX_LEASED_NODE_ID:
+                raise RuntimeError('Every snowflake node id is leased')
+
+        raise RuntimeError('Could not lease a snowflake node id')
+
+    async def renew(self, high_water: int) -> bool:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                update(SnowflakeNode)
+                .where(SnowflakeNode.node_id == self.node_id)
+                .where(SnowflakeNode.holder == self.holder)
+                .values(expires_at=datetime.utcnow() + self.ttl, high_water=high_water)
+            )
+            await session.commit()
+
+        return result.rowcount == 1
+
+    async def keep_alive(self, medium: 'IDMedium') -> None:
+        """
+        Renew the lease every third of its ttl, taking a new node if it was lost.
+
+        No ids are issued in between, the lost node may already be someone else's.
+        """
+        while True:
+            await asyncio.sleep(self.ttl.total_seconds() / 3)
+
+            if not await self.renew(medium.high_water):
+                log.error('lost the lease on snowflake node %d, leasing a new one', self.node_id)
+                medium.suspend()
+                medium.node_id = await self.acquire()
+
 
 class IDMedium:
-    def __init__(self, epoch: int = 1672531200000) -> None:
-        self._incr: int = 0
+    """
+    Snowflake generator.
+
+    Ids are made of 42 bits of milliseconds since `epoch`, a 10 bit node id
+    leased at startup and a 12 bit sequence, which restarts every millisecond
+    and waits for the next one once exhausted. Time is read from a monotonic
+    clock anchored to the wall clock, so clock adjustments never make ids go backwards.
+    """
+
+    def __init__(self, epoch: int = 1672531200000, node_id: int | None = None) -> None:
         self._epoch = epoch
+        self._node: int | None = None
+        self._suspended = False
+        self._lease: FileLease | None = None
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._seq = MAX_SEQUENCE
+        self._anchor_ms = int(time.time() * 1000)
+        self._anchor_ns = time.monotonic_ns()
+
+        if node_id is not None:
+            self.node_id = node_id
+
+        _mediums.add(self)
+
+    def _forget_node(self) -> None:
+        if self._lease is not None and self._lease._file is not None:
+            self._lease._file.close()
+
+        self._lock = threading.Lock()
+        self._node = None
+        self._lease = None
+
+    @property
+    def node_id(self) -> int:
+        if self._node is None:
+            env = os.getenv('SNOWFLAKE_NODE_ID')
+
+            if env is not None:
+                self.node_id = int(env)
+            else:
+                self._lease = FileLease()
+                self.node_id = self._lease.acquire()
+
+        return self._node
+
+    @node_id.setter
+    def node_id(self, node_id: int) -> None:
+        if not 0 <= node_id <= MAX_LEASED_NODE_ID:
+            raise ValueError(f'node id must be between 0 and {MAX_LEASED_NODE_ID}')
+
+        self._node = node_id
+        self._suspended = False
+
+    def suspend(self) -> None:
+        """
+        Refuse to issue ids until a node id is set again, for when the node's lease was lost.
+        """
+        self._suspended = True
+
+    def _leased_node(self) -> int:
+        # read with the lock held, so a node replaced since is never used
+        if self._suspended:
+            raise RuntimeError('Lost the lease on this snowflake node, no ids until a new one is leased')
+
+        return self._node
+
+    @property
+    def high_water(self) -> int:
+        return self._last_ms
+
+    def release(self) -> None:
+        if self._lease is not None:
+            self._lease.release(self._last_ms)
+            self._lease = None
+            self._node = None
+
+    def _now(self) -> int:
+        return self._anchor_ms + (time.monotonic_ns() - self._anchor_ns) // 1_000_000
+
+    def _next_ms(self) -> int:
+        # only called with the lock held, once this millisecond's sequence is exhausted
+        ms = self._now()
+
+        while ms <= self._last_ms:
+            time.sleep(0)
+            ms = self._now()
+
+        return ms
 
     def snowflake(self) -> int:
-        current_ms = int(time.time() * 1000)
-        epoch = current_ms - self._epoch << 22
+        if self._node is None:
+            # leases a node on first use
+            self.node_id
+
+        with self._lock:
+            node = self._leased_node()
+            ms = self._now()
+
+            if ms > self._last_ms:
+                self._last_ms = ms
+                self._seq = 0
+            elif self._seq < MAX_SEQUENCE:
+                self._seq += 1
+            else:
+                self._last_ms = self._next_ms()
+                self._seq = 0
+
+            return ((self._last_ms - self._epoch) << 22) | (node << SEQUENCE_BITS) | self._seq
+
+    def take(self, n: int) -> list[int]:
+        """
+        Reserve `n` ids at once, for bulk inserts.
+        """
+        if self._node is None:
+            # leases a node on first use
+            self.node_id
 
-        curthread = threading.current_thread().ident
-        if curthread is None:
-            raise AssertionError
+        ids: list[int] = []
 
-        epoch |= (curthread % 32) << 17
-        epoch |= (os.getpid() % 32) << 12
+        with self._lock:
+            node = self._leased_node()
 
-        epoch |= self._incr % 4096
+            while n > 0:
+                ms = self._now()
 
-        if self._incr == 9000000000:
-            self._incr = 0
+                if ms > self._last_ms:
+                    self._last_ms = ms
+                    self._seq = -1
+                elif self._seq >= MAX_SEQUENCE:
+                    self._last_ms = self._next_ms()
+                    self._seq = -1
 
-        self._incr += 1
+                count = min(n, MAX_SEQUENCE - self._seq)
+                base = ((self._last_ms - self._epoch) << 22) | (node << SEQUENCE_BITS)
+                ids.extend(range(base + self._seq + 1, base + self._seq + 1 + count))
 
-        return epoch
+                self._seq += count
+                n -= count
+
+        return ids
+
+    def at(self, when: datetime) -> int:
+        """
+        The lowest id which could be issued at `when`, so ranges of ids can stand in for ranges of time.
+        """
+        return max(int(when.timestamp() * 1000) - self._epoch, 0) << 22
+
+    def time_of(self, snowflake: int) -> datetime:
+        return datetime.fromtimestamp(((snowflake >> 22) + self._epoch) / 1000, timezone.utc)
 
     def invite(self) -> str:
         return secrets.token_urlsafe(randint(4, 9))
 
 
+_mediums: weakref.WeakSet[IDMedium] = weakref.WeakSet()
+
+
+def _after_fork() -> None:
+    # a forked child must never share its parent's node
+    for m in _mediums:
+        m._forget_node()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
 medium = IDMedium()
+atexit.register(medium.release)
 
 
 def version(
@@ -0,0 +1,469 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+import asyncio
+import os
+import secrets
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterator
+
+import msgspec
+from argon2 import PasswordHasher
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .identification import IMPORT_NODE_BITS, MAX_LEASED_NODE_ID, SEQUENCE_BITS, IDMedium, medium
+from .partitions import MESSAGE_PARTITIONING, create_between
+from .permissions import DEFAULT_PERMISSIONS
+
+__all__ = ['Importer', 'read_records']
+
+# `(table, columns)` copied in stages, every table only referencing those of earlier stages
+STAGES: list[list[str]] = [['users'], ['settings', 'guilds'], ['members', 'channels'], ['messages']]
+
+COLUMNS: dict[str, list[str]] = {
+    'users': ['id', 'username', 'discriminator', 'email', 'password', 'flags', 'system', 'suspended'],
+    'settings': ['user_id', 'status'],
+    'guilds': ['id', 'name', 'flags', 'owner_id', 'permissions'],
+    'members': ['user_id', 'guild_id', 'nick'],
+    'channels': ['id', 'type', 'name', 'parent_id', 'guild_id', 'position'],
+    'messages': ['id', 'author_id', 'content', 'channel_id', 'timestamp', 'edited_timestamp'],
+}
+
+# imported messages take the node ids which are never leased, counting through their sequences too
+FIRST_IMPORT_NODE = MAX_LEASED_NODE_ID + 1
+IMPORT_MASK = (1 << (IMPORT_NODE_BITS + SEQUENCE_BITS)) - 1
+
+
+# payload sizes of the fixed width msgpack types
+_FIXED = {0xCA: 4, 0xCB: 8, 0xCC: 1, 0xCD: 2, 0xCE: 4, 0xCF: 8, 0xD0: 1, 0xD1: 2, 0xD2: 4, 0xD3: 8}
+
+
+def _msgpack_end(buf: bytes | bytearray | memoryview, pos: int) -> int:
+    # where the msgpack object starting at `pos` ends, raising IndexError when it isn't all in `buf`
+    pending = 1
+
+    while pending:
+        pending -= 1
+        b = buf[pos]
+        pos += 1
+
+        if b <= 0x7F or b >= 0xE0 or b in (0xC0, 0xC2, 0xC3):
+            continue
+        elif 0x80 <= b <= 0x8F:
+            pending += 2 * (b & 0x0F)
+        elif 0x90 <= b <= 0x9F:
+            pending += b & 0x0F
+        elif 0xA0 <= b <= 0xBF:
+            pos += b & 0x1F
+        elif b in (0xC4, 0xC5, 0xC6, 0xD9, 0xDA, 0xDB):
+            width = {0xC4: 1, 0xC5: 2, 0xC6: 4, 0xD9: 1, 0xDA: 2, 0xDB: 4}[b]
+            pos += width + int.from_bytes(buf[pos : pos + width], 'big')
+        elif b in (0xC7, 0xC8, 0xC9):
+            width = {0xC7: 1, 0xC8: 2, 0xC9: 4}[b]
+            pos += width + 1 + int.from_bytes(buf[pos : pos + width], 'big')
+        elif b in (0xCA, 0xCB, 0xCC, 0xCD, 0xCE, 0xCF, 0xD0, 0xD1, 0xD2, 0xD3):
+            pos += _FIXED[b]
+        elif 0xD4 <= b <= 0xD8:
+            pos += 1 + (1 << (b - 0xD4))
+        elif b in (0xDC, 0xDD):
+            width = 2 if b == 0xDC else 4
+            pending += int.from_bytes(buf[pos : pos + width], 'big')
+            pos += width
+        elif b in (0xDE, 0xDF):
+            width = 2 if b == 0xDE else 4
+            pending += 2 * int.from_bytes(buf[pos : pos + width], 'big')
+            pos += width
+        else:
+            raise ValueError(f'invalid msgpack byte {b:#x}')
+
+        if pos > len(buf):
+            raise IndexError(pos)
+
+    return pos
+
+
+def read_records(path: str, chunk_size: int = 1 << 20) -> Iterator[dict[str, Any]]:
+    """
+    Records of a `.jsonl` file, or of a `.msgpack` file of concatenated objects, read a chunk at a time.
+    """
+    if path.endswith('.jsonl'):
+        decoder = msgspec.json.Decoder(dict)
+
+        with open(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield decoder.decode(line)
+
+        return
+
+    decoder = msgspec.msgpack.Decoder(dict)
+    buf = bytearray()
+
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            buf.extend(data)
+            pos = 0
+
+            while pos < len(buf):
+                try:
+                    end = _msgpack_end(buf, pos)
+                except IndexError:
+                    break
+
+                yield decoder.decode(memoryview(buf)[pos:end])
+                pos = end
+
+            del buf[:pos]
+
+            if not data:
+                if buf:
+                    raise ValueError(f'{path} ends partway through a record')
+                return
+
+
+class TimedIds:
+    """
+    Ids for rows from the past, made from their own timestamps so history stays in order.
+
+    They're in the node ids kept back from leasing, so never meet an id issued live. The bits under
+    the timestamp count up through the whole import instead of per millisecond, which would mean
+    remembering every millisecond seen, so two ids only meet when their rows share a millisecond
+    while being a multiple of 2^16 rows apart, and the copy then fails on the primary key.
+    """
+
+    def __init__(self, ids: IDMedium = medium) -> None:
+        self.ids = ids
+        self._count = 0
+
+    def at(self, when: datetime) -> int:
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+
+        epoch = self.ids.time_of(0)
+
+        # an id can't hold a time before the epoch, and clamping would jumble history
+        if when < epoch:
+            raise ValueError(f'{when.isoformat()} is before the snowflake epoch, {epoch.isoformat()}')
+
+        self._count += 1
+        return self.ids.at(when) | (FIRST_IMPORT_NODE << SEQUENCE_BITS) | (self._count & IMPORT_MASK)
+
+
+class Importer:
+    """
+    Copies an archive of `users`, `guilds`, `members`, `channels` and `messages` into the database.
+
+    Every table is a `<table>.jsonl` or `<table>.msgpack` file in the archive's directory, with ids
+    from wherever it came from, which are swapped for snowflakes taken in batches.
+    """
+
+    def __init__(self, engine: AsyncEngine, directory: str, batch_size: int = 5000, workers: int = 4) -> None:
+        self.engine = engine
+        self.directory = directory
+        self.batch_size = batch_size
+        self.workers = workers
+        # the archive's ids to ours, per table
+        self.ids: dict[str, dict[Any, int]] = {'users': {}, 'guilds': {}, 'channels': {}}
+        self.rows: Counter[str] = Counter()
+        self.seconds: dict[str, float] = {}
+        self.timed = TimedIds()
+        self.positions: Counter[tuple[int, int | None]] = Counter()
+        # imported users can't log in until they set a password
+        self.password = PasswordHasher().hash(secrets.token_urlsafe(32))
+
+    def _path(self, table: str) -> str | None:
+        for ext in ('.jsonl', '.msgpack'):
+            path = os.path.join(self.directory, table + ext)
+
+            if os.path.exists(path):
+                return path
+
+        return None
+
+    def _records(self, table: str) -> Iterator[dict[str, Any]]:
+        path = self._path('users' if table == 'settings' else table)
+        return read_records(path) if path else iter(())
+
+    def _take(self, table: str, records: list[dict[str, Any]]) -> None:
+        for record, snowflake in zip(records, medium.take(len(records))):
+            self.ids[table][record['id']] = snowflake
+
+    def _users(self, records: list[dict[str, Any]]) -> list[tuple]:
+        self._take('users', records)
+        return [
+            (
+                self.ids['users'][r['id']],
+                r['username'][:32],
+                r.get('discriminator') or '%04d' % (self.ids['users'][r['id']] % 9999 + 1),
+                r.get('email') or f'{r["id"]}@imported.invalid',
+                self.password,
+                0,
+                False,
+                False,
+            )
+            for r in records
+        ]
+
+    def _settings(self, records: list[dict[str, Any]]) -> list[tuple]:
+        return [(self.ids['users'][r['id']], 'ONLINE') for r in records]
+
+    def _guilds(self, records: list[dict[str, Any]]) -> list[tuple]:
+        self._take('guilds', records)
+        return [
+            (
+                self.ids['guilds'][r['id']],
+                r['name'][:32],
+                0,
+                self.ids['users'][r['owner_id']],
+                DEFAULT_PERMISSIONS,
+            )
+            for r in records
+        ]
+
+    def _members(self, records: list[dict[str, Any]]) -> list[tuple]:
+        return [
+            (self.ids['users'][r['user_id']], self.ids['guilds'][r['guild_id']], r.get('nick'))
+            for r in records
+        ]
+
+    def _channels(self, records: list[dict[str, Any]]) -> list[tuple]:
+        self._take('channels', records)
+        rows = []
+
+        for r in records:
+            guild_id = self.ids['guilds'][r['guild_id']]
+            parent_id = self.ids['channels'][r['parent_id']] if r.get('parent_id') is not None else None
+            self.positions[(guild_id, parent_id)] += 1
+
+            rows.append(
+                (
+                    self.ids['channels'][r['id']],
+                    'CATEGORY' if r.get('type') == 'category' else 'TEXT',
+                    r['name'][:32],
+                    parent_id,
+                    guild_id,
+                    r.get('position') or self.positions[(guild_id, parent_id)],
+                )
+            )
+
+        return rows
+
+    def _messages(self, records: list[dict[str, Any]]) -> list[tuple]:
+        rows = []
+
+        for r in records:
+            timestamp = _utc(r['timestamp'])
+            edited = r.get('edited_timestamp')
+
+            rows.append(
+                (
+                    self.timed.at(timestamp),
+                    self.ids['users'][r['author_id']],
+                    r['content'][:2024],
+                    self.ids['channels'][r['channel_id']],
+                    timestamp,
+                    _utc(edited) if edited else None,
+                )
+            )
+
+        return rows
+
+    def _batches(
+        self, table: str, keep: Callable[[dict[str, Any]], bool] | None = None
+    ) -> Iterator[list[dict[str, Any]]]:
+        records = self._records(table)
+
+        if keep is not None:
+            records = filter(keep, records)
+
+        batch = []
+
+        for record in records:
+            batch.append(record)
+
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    async def load(self, table: str) -> None:
+        started = time.perf_counter()
+
+        if table == 'channels':
+            # a foreign key can't see rows another connection hasn't committed yet, so every
+            # category is copied before any of the channels in them
+            await self._copy(table, self._batches(table, lambda r: r.get('parent_id') is None))
+            await self._copy(table, self._batches(table, lambda r: r.get('parent_id') is not None))
+        else:
+            await self._copy(table, self._batches(table))
+
+        self.seconds[table] = time.perf_counter() - started
+
+    async def _copy(self, table: str, batches: Iterator[list[dict[str, Any]]]) -> None:
+        convert: Callable[[list[dict[str, Any]]], list[tuple]] = getattr(self, f'_{table}')
+        queue: asyncio.Queue[list[tuple] | None] = asyncio.Queue(self.workers * 2)
+
+        async def copy() -> None:
+            async with self.engine.connect() as conn:
+                raw = (await conn.get_raw_connection()).driver_connection
+
+                while (rows := await queue.get()) is not None:
+                    await raw.copy_records_to_table(table, records=rows, columns=COLUMNS[table])
+                    self.rows[table] += len(rows)
+
+        workers = [asyncio.create_task(copy()) for _ in range(self.workers)]
+
+        try:
+            # the queue being bounded keeps reading no further ahead than copying
+            for batch in batches:
+                put = asyncio.ensure_future(queue.put(convert(batch)))
+                # a failed copy stops the import, rather than leaving the queue full forever
+                await asyncio.wait([put, *workers], return_when=asyncio.FIRST_COMPLETED)
+
+                for worker in workers:
+                    if worker.done():
+                        worker.result()
+
+                await put
+
+            for _ in workers:
+                await queue.put(None)
+
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def create_partitions(self) -> None:
+        """
+        Create the message partitions the archive's history falls in, only made ahead of time otherwise.
+        """
+        if MESSAGE_PARTITIONING != 'range':
+            return
+
+        oldest = newest = None
+
+        for record in self._records('messages'):
+            when = _utc(record['timestamp'])
+            oldest = when if oldest is None else min(oldest, when)
+            newest = when if newest is None else max(newest, when)
+
+        if oldest is None:
+            return
+
+        async with self.engine.begin() as conn:
+            await create_between(
+                conn, oldest.replace(tzinfo=timezone.utc), newest.replace(tzinfo=timezone.utc)
+            )
+
+    async def finalize(self) -> None:
+        """
+        Fill in what's derived from the rows just copied, counters and last messages.
+        """
+        guild_ids = list(self.ids['guilds'].values())
+
+        async with self.engine.begin() as conn:
+            for statement in FINALIZE:
+                await conn.execute(text(statement), {'guild_ids': guild_ids})
+
+    async def run(self) -> None:
+        for stage in STAGES:
+            if 'messages' in stage:
+                await self.create_partitions()
+
+            await asyncio.gather(*(self.load(table) for table in stage))
+
+        await self.finalize()
+
+    def report(self) -> str:
+        lines = []
+
+        for table in COLUMNS:
+            if table in self.seconds:
+                rate = self.rows[table] / self.seconds[table] if self.seconds[table] else 0.0
+                lines.append(f'{table:<10} {self.rows[table]:>12,} rows  {rate:>12,.0f} rows/s')
+
+        return '\n'.join(lines)
+
+
+def _utc(iso: str) -> datetime:
+    # naive utc, like the rest of our timestamps
+    when = datetime.fromisoformat(iso)
+
+    if when.tzinfo is not None:
+        when = when.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return when
+
+
+FINALIZE = [
+    '''
+    UPDATE channels SET last_message_id = last.id
+    FROM (
+        SELECT channel_id, max(id) AS id FROM messages
+        WHERE channel_id IN (SELECT id FROM channels WHERE guild_id = ANY(:guild_ids))
+        GROUP BY channel_id
+    ) AS last
+    WHERE channels.id = last.channel_id
+    ''',
+    '''
+    UPDATE channels
+    SET max_position = (SELECT coalesce(max(position), 0) FROM channels c WHERE c.parent_id = channels.id)
+    WHERE guild_id = ANY(:guild_ids) AND type = 'CATEGORY'
+    ''',
+    '''
+    UPDATE guilds SET
+        channel_count = (SELECT count(*) FROM channels WHERE guild_id = guilds.id),
+        member_count = (SELECT count(*) FROM members WHERE guild_id = guilds.id),
+        max_position = (
+            SELECT coalesce(max(position), 0) FROM channels WHERE guild_id = guilds.id AND parent_id IS NULL
+        )
+    WHERE id = ANY(:guild_ids)
+    ''',
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser('derailed.importer', description='Import an archive of a community.')
+    parser.add_argument('directory', help='holding <table>.jsonl or <table>.msgpack files')
+    parser.add_argument('--batch-size', type=int, default=5000, help='rows per COPY')
+    parser.add_argument('--workers', type=int, default=4, help='connections copying each table')
+    args = parser.parse_args()
+
+    from .database import engine
+
+    async def run() -> Importer:
+        importer = Importer(engine, args.directory, args.batch_size, args.workers)
+
+        try:
+            await importer.run()
+        finally:
+            await engine.dispose()
+
+        return importer
+
+    print(asyncio.run(run()).report())
+
+
+if __name__ == '__main__':
+    main()
@@ -5,5 +5,7 @@ from .activity import *
 from .base import *
 from .channel import *
 from .guild import *
+from .job import *
 from .member import *
+from .snowflake import *
 from .user import *
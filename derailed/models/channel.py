@@ -16,18 +16,67 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 from __future__ import annotations
 
+import os
+import re
 from datetime import datetime
 from enum import Enum
 
-from sqlalchemy import BigInteger, ForeignKey, String, delete, func, select, update
+from sqlalchemy import (
+    ARRAY,
+    BigInteger,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Values,
+    all_,
+    any_,
+    bindparam,
+    cast,
+    column,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    text,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert as upsert
+from sqlalchemy.dialects.postgresql import to_tsvector, websearch_to_tsquery
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql.elements import ColumnElement, TextClause
 
 from .base import Base
+from .member import Member, MemberRole, Role
+
+# `range` partitions new `messages` tables by id, so by time. see `partitions`
+MESSAGE_PARTITIONING = os.getenv('MESSAGE_PARTITIONING', 'none')
+
+# text search configuration messages are indexed with, changing it means rebuilding the index
+MESSAGE_SEARCH_CONFIG = os.getenv('MESSAGE_SEARCH_CONFIG', 'english')
+
+if not re.fullmatch(r'[a-z_]+', MESSAGE_SEARCH_CONFIG):
+    raise ValueError(f'Invalid MESSAGE_SEARCH_CONFIG {MESSAGE_SEARCH_CONFIG!r}')
+
+
+def _search_config() -> TextClause:
+    # inlined rather than bound, so queries match the index expression
+    return text(f"'{MESSAGE_SEARCH_CONFIG}'::regconfig")
 
 
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # history reads, and deleting a channel's or an author's messages a batch at a time
+        Index('ix_messages_channel_id_id', 'channel_id', 'id'),
+        Index('ix_messages_author_id', 'author_id'),
+        {'postgresql_partition_by': 'RANGE (id)'} if MESSAGE_PARTITIONING == 'range' else {},
+    )
 
     id: Mapped[int] = mapped_column(BigInteger(), primary_key=True)
     author_id: Mapped[int] = mapped_column(BigInteger(), ForeignKey('users.id'))
@@ -37,8 +86,84 @@ class Message(Base):
     edited_timestamp: Mapped[datetime | None]
 
     @classmethod
-    async def sorted_channel(cls, session: AsyncSession, channel: Channel, limit: int) -> list[Message]:
-        stmt = select(cls).where(Message.channel_id == channel.id).order_by(Message.id.desc()).limit(limit)
+    async def sorted_channel(
+        cls,
+        session: AsyncSession,
+        channel: Channel,
+        limit: int,
+        before: int | None = None,
+        after: int | None = None,
+    ) -> list[Message]:
+        """
+        The newest `limit` messages, or those right after `after`, newest first.
+
+        Bounding by id lets a partitioned table skip partitions outside the range.
+        """
+        stmt = select(cls).where(Message.channel_id == channel.id).limit(limit)
+
+        if before is not None:
+            stmt = stmt.where(Message.id < before)
+
+        if after is not None:
+            stmt = stmt.where(Message.id > after)
+
+        if after is not None and before is None:
+            result = await session.execute(stmt.order_by(Message.id.asc()))
+            return result.scalars().all()[::-1]
+
+        result = await session.execute(stmt.order_by(Message.id.desc()))
+        return result.scalars().all()
+
+    @classmethod
+    async def search(
+        cls,
+        session: AsyncSession,
+        query: str,
+        user_id: int,
+        limit: int,
+        guild_id: int | None = None,
+        channel_id: int | None = None,
+        author_id: int | None = None,
+        before: int | None = None,
+        after: int | None = None,
+    ) -> list[Message]:
+        """
+        Messages matching `query`, in web search syntax, newest first, paged by `before`.
+
+        Only messages in channels `user_id` can see are matched: those of `guild_id`, if they're a member,
+        or otherwise direct messages they're in. Channels being deleted are left out.
+        """
+        tsquery = websearch_to_tsquery(_search_config(), query)
+        stmt = (
+            select(cls)
+            .join(Channel, Channel.id == Message.channel_id)
+            .where(search_vector(Message.content).op('@@')(tsquery))
+            .where(Channel.message_deletor_job_id.is_(None))
+            .order_by(Message.id.desc())
+            .limit(limit)
+        )
+
+        if guild_id is not None:
+            stmt = stmt.where(Channel.guild_id == guild_id).where(
+                exists().where(Member.guild_id == Channel.guild_id).where(Member.user_id == user_id)
+            )
+        else:
+            stmt = stmt.where(Channel.guild_id.is_(None)).where(
+                exists().where(ChannelMember.channel_id == Channel.id).where(ChannelMember.user_id == user_id)
+            )
+
+        if channel_id is not None:
+            stmt = stmt.where(Message.channel_id == channel_id)
+
+        if author_id is not None:
+            stmt = stmt.where(Message.author_id == author_id)
+
+        if before is not None:
+            stmt = stmt.where(Message.id < before)
+
+        if after is not None:
+            stmt = stmt.where(Message.id > after)
+
         result = await session.execute(stmt)
         return result.scalars().all()
 
@@ -49,9 +174,59 @@ class Message(Base):
         return result.scalar()
 
     async def delete(self, session: AsyncSession, message_id: int) -> None:
+        await session.execute(delete(Mention).where(Mention.id == message_id))
+
         stmt = delete(Message).where(Message.id == message_id)
         await session.execute(stmt)
 
+    @classmethod
+    async def delete_many(cls, session: AsyncSession, channel_id: int, ids: list[int]) -> list[int]:
+        """
+        Delete many of a channel's messages in one `DELETE ... WHERE id = ANY(...)`, returning those deleted.
+
+        `last_message_id` is first moved to the newest message left, which it must keep referencing.
+        """
+        id_array = bindparam('ids', ids, type_=ARRAY(BigInteger()))
+
+        newest_left = (
+            select(func.max(Message.id))
+            .where(Message.channel_id == channel_id)
+            .where(Message.id != all_(id_array))
+            .scalar_subquery()
+        )
+        await session.execute(
+            update(Channel)
+            .where(Channel.id == channel_id)
+            .where(Channel.last_message_id == any_(id_array))
+            .values(last_message_id=newest_left)
+            .execution_options(synchronize_session=False)
+        )
+
+        await session.execute(
+            delete(Mention)
+            .where(Mention.channel_id == channel_id)
+            .where(Mention.id == any_(id_array))
+            .execution_options(synchronize_session=False)
+        )
+
+        stmt = (
+            delete(Message)
+            .where(Message.channel_id == channel_id)
+            .where(Message.id == any_(id_array))
+            .returning(Message.id)
+            .execution_options(synchronize_session=False)
+        )
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+
+def search_vector(content: ColumnElement) -> ColumnElement:
+    return to_tsvector(_search_config(), content)
+
+
+# searching, by the same expression as `Message.search`
+Index('ix_messages_content_search', search_vector(Message.content), postgresql_using='gin')
+
 
 class ChannelType(Enum):
     CATEGORY = 0
@@ -64,9 +239,20 @@ class ChannelMember(Base):
     channel_id: Mapped[int] = mapped_column(BigInteger(), ForeignKey('channels.id'), primary_key=True)
     user_id: Mapped[int] = mapped_column(BigInteger(), ForeignKey('users.id'))
 
+    @classmethod
+    async def has(cls, session: AsyncSession, channel_id: int, user_id: int) -> bool:
+        stmt = select(
+            exists().where(ChannelMember.channel_id == channel_id).where(ChannelMember.user_id == user_id)
+        )
+        return await session.scalar(stmt)
+
 
 class Channel(Base):
     __tablename__ = 'channels'
+    __table_args__ = (
+        Index('ix_channels_guild_parent_position', 'guild_id', 'parent_id', 'position'),
+        Index('ix_channels_guild_parent_rank', 'guild_id', 'parent_id', 'rank'),
+    )
 
     id: Mapped[int] = mapped_column(BigInteger(), primary_key=True)
     type: Mapped[ChannelType]
@@ -75,11 +261,17 @@ class Channel(Base):
     parent_id: Mapped[int | None] = mapped_column(ForeignKey('channels.id'))
     guild_id: Mapped[int | None] = mapped_column(ForeignKey('guilds.id'))
     position: Mapped[int | None]
+    # fractional ordering key, used over `position` with `rank` ordering. see `ordering`
+    rank: Mapped[str | None] = mapped_column(String(64, collation='C'))
+    # for categories, the highest position among their children. see `Guild.max_position`
+    max_position: Mapped[int] = mapped_column(default=0, server_default='0')
     message_deletor_job_id: Mapped[str | None]
+    # messages older than this many days are purged, overriding the guild's. see `retention`
+    retention_days: Mapped[int | None]
 
     @classmethod
     async def get(cls, session: AsyncSession, id: int, guild_id: int | None = None) -> 'Channel' | None:
-        stmt = select(cls).where(Channel.id == int(id))
+        stmt = select(cls).where(Channel.id == int(id)).where(Channel.message_deletor_job_id.is_(None))
 
         if guild_id:
             stmt = stmt.where(Channel.guild_id == guild_id)
@@ -87,6 +279,20 @@ class Channel(Base):
         result = await session.execute(stmt)
         return result.scalar()
 
+    @classmethod
+    async def member_guild(cls, session: AsyncSession, id: int, user_id: int) -> int | None:
+        """
+        The guild of a channel, if `user_id` is a member of it, in a single query.
+        """
+        stmt = (
+            select(Channel.guild_id)
+            .join(Member, (Member.guild_id == Channel.guild_id) & (Member.user_id == user_id))
+            .where(Channel.id == id)
+            .where(Channel.message_deletor_job_id.is_(None))
+        )
+        result = await session.execute(stmt)
+        return result.scalar()
+
     @classmethod
     async def get_all(cls, session: AsyncSession, guild_id: int) -> list['Channel']:
         stmt = select(cls).where(Channel.guild_id == guild_id)
@@ -94,6 +300,20 @@ class Channel(Base):
         result = await session.execute(stmt)
         return result.scalars().all()
 
+    @classmethod
+    async def for_user(cls, session: AsyncSession, user_id: int) -> list['Channel']:
+        """
+        The channels of every guild `user_id` is in.
+        """
+        stmt = (
+            select(cls)
+            .join(Member, Member.guild_id == Channel.guild_id)
+            .where(Member.user_id == user_id)
+            .where(Channel.message_deletor_job_id.is_(None))
+        )
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
     @classmethod
     async def get_with_pos(
         cls, session: AsyncSession, id: int, position: int, guild_id: int
@@ -146,9 +366,7 @@ class Channel(Base):
         return (await session.execute(stmt)).scalar()
 
     @classmethod
-    async def highest(
-        cls, session: AsyncSession, guild_id: int, category: int | None = None
-    ) -> Channel | None:
+    async def highest(cls, session: AsyncSession, guild_id: int, category: int | None = None) -> int | None:
         stmt = (
             select(func.max(Channel.position))
             .where(Channel.guild_id == guild_id)
@@ -157,13 +375,361 @@ class Channel(Base):
         result = await session.execute(stmt)
         return result.scalar()
 
+    async def ordinal(self, session: AsyncSession) -> int:
+        """
+        The channel's position among its siblings, by key.
+        """
+        stmt = (
+            select(func.count())
+            .select_from(Channel)
+            .where(Channel.guild_id == self.guild_id)
+            .where(Channel.parent_id == self.parent_id)
+            .where(Channel.rank < self.rank)
+        )
+        return (await session.execute(stmt)).scalar() + 1
+
     async def modify(self, session: AsyncSession, **modifications) -> None:
         stmt = update(Channel).where(Channel.id == self.id).values(**modifications)
         await session.execute(stmt)
 
         for name, value in modifications.items():
-            setattr(name, value)
+            setattr(self, name, value)
+
+    @classmethod
+    async def shift(
+        cls,
+        session: AsyncSession,
+        guild_id: int,
+        parent_id: int | None,
+        from_position: int,
+        by: int = 1,
+    ) -> None:
+        """
+        Move every sibling at or after `from_position` down by `by`, in a single statement.
+
+        A negative `by` moves them up, closing the gap a channel leaves behind.
+        """
+        stmt = (
+            update(Channel)
+            .where(Channel.guild_id == guild_id)
+            .where(Channel.parent_id == parent_id)
+            .where(Channel.position >= from_position)
+            .values(position=Channel.position + by)
+        )
+
+        await session.execute(stmt)
+
+    @classmethod
+    async def ranks(
+        cls, session: AsyncSession, guild_id: int, parent_id: int | None, exclude: int | None = None
+    ) -> list[str | None]:
+        stmt = (
+            select(Channel.rank)
+            .where(Channel.guild_id == guild_id)
+            .where(Channel.parent_id == parent_id)
+            .order_by(Channel.rank.asc().nulls_last())
+        )
+
+        if exclude is not None:
+            stmt = stmt.where(Channel.id != exclude)
+
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    @classmethod
+    async def reposition(
+        cls, session: AsyncSession, positions: list[tuple[int, int, int | None, str | None]]
+    ) -> None:
+        """
+        Set `(id, position, parent_id, rank)` for many channels in one `UPDATE ... FROM (VALUES ...)`.
+        """
+        if not positions:
+            return
+
+        moves = values(
+            column('id', BigInteger()),
+            column('position', Integer()),
+            column('parent_id', BigInteger()),
+            column('rank', String()),
+            name='moves',
+        ).data(positions)
+
+        stmt = (
+            update(Channel)
+            .where(Channel.id == moves.c.id)
+            # an all-NULL column of VALUES is typed as text by Postgres, so say what it holds
+            .values(
+                position=moves.c.position,
+                parent_id=cast(moves.c.parent_id, BigInteger()),
+                rank=cast(moves.c.rank, String()),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        await session.execute(stmt)
+
+    @classmethod
+    async def ids(cls, session: AsyncSession, guild_id: int) -> list[int]:
+        stmt = select(Channel.id).where(Channel.guild_id == guild_id)
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    @classmethod
+    async def clone(cls, session: AsyncSession, guild_id: int, ids: list[tuple[int, int]]) -> None:
+        """
+        Copy channels into `guild_id` in one `INSERT ... SELECT`, `ids` mapping their old ids to new ones.
+        """
+        if not ids:
+            return
+
+        def id_map(name: str) -> Values:
+            return values(column('old_id', BigInteger()), column('new_id', BigInteger()), name=name).data(ids)
+
+        new, parents = id_map('new'), id_map('parents')
+
+        stmt = insert(Channel).from_select(
+            ['id', 'type', 'name', 'parent_id', 'guild_id', 'position', 'rank', 'max_position'],
+            select(
+                new.c.new_id,
+                Channel.type,
+                Channel.name,
+                parents.c.new_id,
+                literal(guild_id, BigInteger()),
+                Channel.position,
+                Channel.rank,
+                Channel.max_position,
+            )
+            .join(new, new.c.old_id == Channel.id)
+            .outerjoin(parents, parents.c.old_id == Channel.parent_id),
+        )
+        await session.execute(stmt)
 
     async def delete(self, session: AsyncSession) -> None:
         stmt = delete(Channel).where(Channel.id == self.id)
         await session.execute(stmt)
+
+
+class Mention(Base):
+    """
+    A user or role mentioned by a message, parsed once when it's written.
+    """
+
+    __tablename__ = 'mentions'
+    __table_args__ = (
+        # a user's mentions, and those of their roles, newest first
+        Index('ix_mentions_target_id_id', 'target_id', 'id'),
+        Index('ix_mentions_channel_id_id', 'channel_id', 'id'),
+    )
+
+    # the mentioning message's
+    id: Mapped[int] = mapped_column(BigInteger(), primary_key=True)
+    # a user's or a role's, which never share ids
+    target_id: Mapped[int] = mapped_column(BigInteger(), primary_key=True)
+    channel_id: Mapped[int] = mapped_column(BigInteger(), ForeignKey('channels.id'))
+
+    @classmethod
+    async def targets(cls, session: AsyncSession, message_id: int) -> set[int]:
+        result = await session.execute(select(Mention.target_id).where(Mention.id == message_id))
+        return set(result.scalars().all())
+
+    @classmethod
+    async def record(
+        cls,
+        session: AsyncSession,
+        message: Message,
+        guild_id: int | None,
+        users: set[int],
+        roles: set[int],
+        previous: set[int] = frozenset(),
+    ) -> None:
+        """
+        Store `message`'s mentions, replacing `previous` ones, and count them as unread.
+
+        Only members of the guild, or those in a direct message, and the guild's own roles are kept.
+        Unread counters go up once for every user newly mentioned, directly or through a role,
+        besides the author, all in set-based statements.
+        """
+        if previous:
+            await session.execute(delete(Mention).where(Mention.id == message.id))
+
+        if not users and not roles:
+            return
+
+        user_ids = bindparam('users', list(users), type_=ARRAY(BigInteger()))
+        role_ids = bindparam('roles', list(roles), type_=ARRAY(BigInteger()))
+        new_ids = bindparam('new', list((users | roles) - previous), type_=ARRAY(BigInteger()))
+
+        if guild_id is not None:
+            mentioned_users = (
+                select(Member.user_id.label('target_id'))
+                .where(Member.guild_id == guild_id)
+                .where(Member.user_id == any_(user_ids))
+            )
+            mentioned_roles = (
+                select(Role.id).where(Role.guild_id == guild_id).where(Role.id == any_(role_ids))
+            )
+            targets = mentioned_users.union_all(mentioned_roles).subquery()
+
+            # users the new targets reach, with role members found through `member_roles`
+            reached = (
+                select(Member.user_id)
+                .where(Member.guild_id == guild_id)
+                .where(Member.user_id == any_(new_ids))
+                .union(
+                    select(MemberRole.user_id)
+                    .where(MemberRole.guild_id == guild_id)
+                    .where(MemberRole.role_id == any_(new_ids))
+                )
+                .subquery()
+            )
+        else:
+            targets = (
+                select(ChannelMember.user_id.label('target_id'))
+                .where(ChannelMember.channel_id == message.channel_id)
+                .where(ChannelMember.user_id == any_(user_ids))
+                .subquery()
+            )
+            reached = (
+                select(ChannelMember.user_id)
+                .where(ChannelMember.channel_id == message.channel_id)
+                .where(ChannelMember.user_id == any_(new_ids))
+                .subquery()
+            )
+
+        await session.execute(
+            insert(Mention).from_select(
+                ['id', 'target_id', 'channel_id'],
+                select(
+                    literal(message.id, BigInteger()),
+                    targets.c.target_id,
+                    literal(message.channel_id, BigInteger()),
+                ),
+            )
+        )
+
+        counted = upsert(UnreadMention).from_select(
+            ['user_id', 'channel_id', 'count'],
+            select(reached.c.user_id, literal(message.channel_id, BigInteger()), literal(1)).where(
+                reached.c.user_id != message.author_id
+            ),
+        )
+        await session.execute(
+            counted.on_conflict_do_update(
+                index_elements=['user_id', 'channel_id'], set_={'count': UnreadMention.count + 1}
+            )
+        )
+
+    @classmethod
+    async def for_user(
+        cls, session: AsyncSession, user_id: int, limit: int, before: int | None = None
+    ) -> list[Message]:
+        """
+        Messages mentioning `user_id` or one of their roles, newest first, paged by `before`.
+
+        Mentions in channels they can no longer see are skipped.
+        """
+        targets = select(literal(user_id, BigInteger())).union_all(
+            select(MemberRole.role_id).where(MemberRole.user_id == user_id)
+        )
+        visible = (Channel.message_deletor_job_id.is_(None)) & (
+            exists().where(Member.guild_id == Channel.guild_id).where(Member.user_id == user_id)
+            | exists().where(ChannelMember.channel_id == Channel.id).where(ChannelMember.user_id == user_id)
+        )
+        ids = (
+            select(Mention.id)
+            .join(Channel, Channel.id == Mention.channel_id)
+            .where(Mention.target_id.in_(targets))
+            .where(visible)
+            .group_by(Mention.id)
+            .order_by(Mention.id.desc())
+            .limit(limit)
+        )
+
+        if before is not None:
+            ids = ids.where(Mention.id < before)
+
+        result = await session.execute(select(Message).where(Message.id.in_(ids)).order_by(Message.id.desc()))
+        return result.scalars().all()
+
+
+class UnreadMention(Base):
+    """
+    How many times a user was mentioned in a channel since they last read it.
+    """
+
+    __tablename__ = 'unread_mentions'
+
+    user_id: Mapped[int] = mapped_column(BigInteger(), ForeignKey('users.id'), primary_key=True)
+    channel_id: Mapped[int] = mapped_column(
+        BigInteger(), ForeignKey('channels.id'), primary_key=True, index=True
+    )
+    count: Mapped[int]
+
+    @classmethod
+    async def get_all(cls, session: AsyncSession, user_id: int) -> list[UnreadMention]:
+        stmt = select(cls).where(UnreadMention.user_id == user_id).where(UnreadMention.count > 0)
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+
+class ReadState(Base):
+    """
+    The newest message a user has read in a channel.
+    """
+
+    __tablename__ = 'read_states'
+
+    user_id: Mapped[int] = mapped_column(BigInteger(), ForeignKey('users.id'), primary_key=True)
+    channel_id: Mapped[int] = mapped_column(
+        BigInteger(), ForeignKey('channels.id'), primary_key=True, index=True
+    )
+    # not a foreign key, the message may be deleted after being read
+    last_message_id: Mapped[int] = mapped_column(BigInteger())
+
+    @classmethod
+    async def get_all(cls, session: AsyncSession, user_id: int) -> list[ReadState]:
+        result = await session.execute(select(cls).where(ReadState.user_id == user_id))
+        return result.scalars().all()
+
+    @classmethod
+    async def upsert_many(cls, session: AsyncSession, acks: list[tuple[int, int, int]]) -> None:
+        """
+        Move many `(user_id, channel_id, message_id)` read states forward, never back, in one upsert.
+
+        Unread mention counts of those channels are then recounted from the mentions after what was read.
+        """
+        stmt = upsert(ReadState).values(
+            [{'user_id': u, 'channel_id': c, 'last_message_id': m} for u, c, m in acks]
+        )
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=['user_id', 'channel_id'],
+                set_={
+                    'last_message_id': func.greatest(ReadState.last_message_id, stmt.excluded.last_message_id)
+                },
+            )
+        )
+
+        acked = values(
+            column('user_id', BigInteger()), column('channel_id', BigInteger()), name='acked'
+        ).data([(u, c) for u, c, _ in acks])
+        roles = (
+            select(MemberRole.role_id)
+            .where(MemberRole.user_id == UnreadMention.user_id)
+            .correlate_except(MemberRole)
+        )
+        unread = (
+            select(func.count(Mention.id.distinct()))
+            .where(Mention.channel_id == UnreadMention.channel_id)
+            .where(Mention.id > ReadState.last_message_id)
+            .where(or_(Mention.target_id == UnreadMention.user_id, Mention.target_id.in_(roles)))
+            .scalar_subquery()
+        )
+        await session.execute(
+            update(UnreadMention)
+            .where(UnreadMention.user_id == acked.c.user_id)
+            .where(UnreadMention.channel_id == acked.c.channel_id)
+            .where(ReadState.user_id == UnreadMention.user_id)
+            .where(ReadState.channel_id == UnreadMention.channel_id)
+            .values(count=unread)
+            .execution_options(synchronize_session=False)
+        )
@@ -32,10 +32,41 @@ class Guild(Base):
     flags: Mapped[int]
     owner_id: Mapped[int] = mapped_column(BigInteger(), ForeignKey('users.id'))
     permissions: Mapped[int] = mapped_column(BigInteger())
+    # counters kept up to date under `lock`, instead of counting rows
+    channel_count: Mapped[int] = mapped_column(default=0, server_default='0')
+    member_count: Mapped[int] = mapped_column(default=0, server_default='0')
+    # highest position among channels without a parent
+    max_position: Mapped[int] = mapped_column(default=0, server_default='0')
+    deletor_job_id: Mapped[int | None] = mapped_column(BigInteger())
+    # messages older than this many days are purged, unless their channel says otherwise
+    retention_days: Mapped[int | None]
 
     @classmethod
     async def get(cls, session: AsyncSession, guild_id: int) -> Guild | None:
-        stmt = select(cls).where(Guild.id == guild_id)
+        stmt = select(cls).where(Guild.id == guild_id).where(Guild.deletor_job_id.is_(None))
+        result = await session.execute(stmt)
+        return result.scalar()
+
+    @classmethod
+    async def owns_any(cls, session: AsyncSession, user_id: int) -> bool:
+        # including guilds still being deleted, which keep referencing their owner until they're gone
+        stmt = select(Guild.id).where(Guild.owner_id == user_id).limit(1)
+        result = await session.execute(stmt)
+        return result.scalar() is not None
+
+    @classmethod
+    async def lock(cls, session: AsyncSession, guild_id: int) -> Guild | None:
+        """
+        Lock this guild's row until the transaction ends, serializing changes to its channel tree.
+
+        Returns the guild with its counters freshly read, they may only be trusted under this lock.
+        """
+        stmt = (
+            select(cls)
+            .where(Guild.id == guild_id)
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        )
         result = await session.execute(stmt)
         return result.scalar()
 
@@ -46,3 +77,19 @@ class Invite(Base):
     id: Mapped[str] = mapped_column(primary_key=True)
     guild_id: Mapped[int] = mapped_column(BigInteger(), ForeignKey('guilds.id'))
     author_id: Mapped[int] = mapped_column(BigInteger(), ForeignKey('users.id'))
+
+
+class GuildTemplate(Base):
+    __tablename__ = 'guild_templates'
+
+    code: Mapped[str] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(32))
+    # templates are of the guild as it is when used, not as it was when made
+    guild_id: Mapped[int] = mapped_column(BigInteger(), ForeignKey('guilds.id'), index=True)
+    creator_id: Mapped[int] = mapped_column(BigInteger(), ForeignKey('users.id'))
+
+    @classmethod
+    async def get(cls, session: AsyncSession, code: str) -> GuildTemplate | None:
+        stmt = select(cls).where(GuildTemplate.code == code)
+        result = await session.execute(stmt)
+        return result.scalar()
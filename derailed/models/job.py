@@ -0,0 +1,48 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+from __future__ import annotations
+
+from datetime import datetime
+from enum import Enum
+
+from sqlalchemy import BigInteger, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from .base import Base
+
+__all__ = ['DeletionJob', 'JobKind']
+
+
+class JobKind(Enum):
+    CHANNEL = 'channel'
+    GUILD = 'guild'
+    USER = 'user'
+
+
+class DeletionJob(Base):
+    __tablename__ = 'deletion_jobs'
+
+    id: Mapped[int] = mapped_column(BigInteger(), primary_key=True)
+    kind: Mapped[JobKind]
+    target_id: Mapped[int] = mapped_column(BigInteger())
+    # index of the step being worked through, see `deletion.STEPS`
+    step: Mapped[int] = mapped_column(default=0)
+    deleted: Mapped[int] = mapped_column(BigInteger(), default=0)
+    created_at: Mapped[datetime]
+    finished_at: Mapped[datetime | None] = mapped_column(index=True)
+    holder: Mapped[str | None] = mapped_column(String(128))
+    held_until: Mapped[datetime | None]
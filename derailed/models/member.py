@@ -16,13 +16,26 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 from __future__ import annotations
 
-from sqlalchemy import BigInteger, ForeignKey, String, select
+from sqlalchemy import (
+    BigInteger,
+    ForeignKey,
+    Index,
+    Select,
+    String,
+    column,
+    func,
+    insert,
+    literal,
+    select,
+    values,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from .base import Base
 from .guild import Guild
-from .user import User
+from .user import GuildPosition, User
 
 
 class RolePermissions(Base):
@@ -48,6 +61,52 @@ class Role(Base):
         result = await session.execute(stmt)
         return result.scalar()
 
+    @classmethod
+    async def ids(cls, session: AsyncSession, guild_id: int) -> list[int]:
+        stmt = select(Role.id).where(Role.guild_id == guild_id)
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    @classmethod
+    async def permissions_for(cls, session: AsyncSession, user_id: int) -> list[tuple[int, int, int, int]]:
+        """
+        The `guild_id`, `allow`, `deny` and `position` of every role `user_id` has, in any guild.
+        """
+        stmt = (
+            select(MemberRole.guild_id, RolePermissions.allow, RolePermissions.deny, Role.position)
+            .join(Role, Role.id == MemberRole.role_id)
+            .join(RolePermissions, RolePermissions.role_id == Role.id)
+            .where(MemberRole.user_id == user_id)
+        )
+        result = await session.execute(stmt)
+        return result.all()
+
+    @classmethod
+    async def clone(cls, session: AsyncSession, guild_id: int, ids: list[tuple[int, int]]) -> None:
+        """
+        Copy roles and their permissions into `guild_id`, `ids` mapping their old ids to new ones.
+        """
+        if not ids:
+            return
+
+        new = values(column('old_id', BigInteger()), column('new_id', BigInteger()), name='new').data(ids)
+
+        roles = insert(Role).from_select(
+            ['id', 'guild_id', 'name', 'position'],
+            select(new.c.new_id, literal(guild_id, BigInteger()), Role.name, Role.position).join(
+                new, new.c.old_id == Role.id
+            ),
+        )
+        permissions = insert(RolePermissions).from_select(
+            ['role_id', 'allow', 'deny'],
+            select(new.c.new_id, RolePermissions.allow, RolePermissions.deny).join(
+                new, new.c.old_id == RolePermissions.role_id
+            ),
+        )
+
+        await session.execute(roles)
+        await session.execute(permissions)
+
 
 class MemberRole(Base):
     __tablename__ = 'member_roles'
@@ -59,6 +118,8 @@ class MemberRole(Base):
 
 class Member(Base):
     __tablename__ = 'members'
+    # the primary key leads with `user_id`, listing a guild's members wants this way around
+    __table_args__ = (Index('ix_members_guild_id_user_id', 'guild_id', 'user_id'),)
 
     user_id: Mapped[int] = mapped_column(BigInteger(), ForeignKey('users.id'), primary_key=True)
     guild_id: Mapped[int] = mapped_column(BigInteger(), ForeignKey('guilds.id'), primary_key=True)
@@ -69,3 +130,64 @@ class Member(Base):
         stmt = select(cls).where(Member.user_id == user_id).where(Member.guild_id == guild_id)
         result = await session.execute(stmt)
         return result.scalar()
+
+    @staticmethod
+    def listing(guild_id: int, after: int = 0, limit: int = 100) -> Select:
+        """
+        The members of `guild_id` after the user id `after`, with their user and role ids.
+
+        Pages are keyed on `(guild_id, user_id)`, so any page costs as much as the first.
+        """
+        # a subquery per row returned, rather than grouping, keeps this a plain range scan
+        roles = func.array(
+            select(MemberRole.role_id)
+            .where(MemberRole.user_id == Member.user_id)
+            .where(MemberRole.guild_id == Member.guild_id)
+            .scalar_subquery(),
+            type_=ARRAY(BigInteger()),
+        )
+
+        return (
+            select(
+                Member.nick,
+                User.id,
+                User.username,
+                User.discriminator,
+                User.flags,
+                User.system,
+                User.suspended,
+                roles.label('roles'),
+            )
+            .join(User, User.id == Member.user_id)
+            .where(Member.guild_id == guild_id)
+            .where(Member.user_id > after)
+            .where(User.deletor_job_id.is_(None))
+            .order_by(Member.user_id)
+            .limit(limit)
+        )
+
+    @classmethod
+    async def page(cls, session: AsyncSession, guild_id: int, after: int = 0, limit: int = 100) -> list:
+        result = await session.execute(cls.listing(guild_id, after, limit))
+        return result.all()
+
+    @classmethod
+    async def guilds(cls, session: AsyncSession, user_id: int) -> list[tuple[Guild, int | None]]:
+        """
+        The guilds `user_id` is in, with their position, in the order the user placed them.
+
+        Guilds never placed come last, oldest first.
+        """
+        stmt = (
+            select(Guild, GuildPosition.position)
+            .join(Member, Member.guild_id == Guild.id)
+            .outerjoin(
+                GuildPosition,
+                (GuildPosition.user_id == Member.user_id) & (GuildPosition.guild_id == Guild.id),
+            )
+            .where(Member.user_id == user_id)
+            .where(Guild.deletor_job_id.is_(None))
+            .order_by(GuildPosition.position.asc().nulls_last(), Guild.id)
+        )
+        result = await session.execute(stmt)
+        return result.all()
@@ -37,18 +37,18 @@ class User(Base):
     password: Mapped[str]
     flags: Mapped[int]
     system: Mapped[bool]
-    deletor_job_id: Mapped[int | None]
+    deletor_job_id: Mapped[int | None] = mapped_column(BigInteger())
     suspended: Mapped[bool]
 
     @classmethod
     async def get(cls, session: AsyncSession, user_id: int) -> User | None:
-        stmt = select(cls).where(User.id == user_id)
+        stmt = select(cls).where(User.id == user_id).where(User.deletor_job_id.is_(None))
         result = await session.execute(stmt)
         return result.scalar()
 
     @classmethod
     async def get_email(cls, session: AsyncSession, email: str) -> User | None:
-        stmt = select(cls).where(User.email == email)
+        stmt = select(cls).where(User.email == email).where(User.deletor_job_id.is_(None))
         result = await session.execute(stmt)
         return result.scalar()
 
@@ -75,12 +75,7 @@ class GuildPosition(Base):
 
     @classmethod
     async def get_for(cls, session: AsyncSession, user: User) -> list[GuildPosition]:
-        stmt = (
-            select(cls)
-            .where(GuildPosition.user_id == user.id)
-            .column(GuildPosition.guild_id)
-            .column(GuildPosition.position)
-        )
+        stmt = select(cls).where(GuildPosition.user_id == user.id).order_by(GuildPosition.position)
         result = await session.execute(stmt)
         return result.scalars().all()
 
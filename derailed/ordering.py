@@ -0,0 +1,185 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import logging
+import os
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .models.channel import Channel
+from .models.guild import Guild
+
+__all__ = ['MODE', 'Rebalancer', 'key_between', 'rebalance', 'spread']
+
+log = logging.getLogger(__name__)
+
+# `dense` keeps `position` as the order, `rank` orders by fractional keys and derives `position`
+MODE = os.getenv('CHANNEL_ORDERING', 'dense')
+
+# keys are compared byte-wise, so the digits must be in ASCII order
+DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+BASE = len(DIGITS)
+
+# keys longer than this get their siblings rebalanced
+MAX_KEY_LENGTH = 12
+
+
+def _midpoint(a: str, b: str | None) -> str:
+    # a key strictly between `a` and `b`, where `b` None is infinity.
+    # neither may end in the zero digit, which keeps every key unique.
+    if b is not None:
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else DIGITS[0]) == b[n]:
+            n += 1
+
+        if n > 0:
+            return b[:n] + _midpoint(a[n:], b[n:])
+
+    da = DIGITS.index(a[0]) if a else 0
+    db = DIGITS.index(b[0]) if b is not None else BASE
+
+    if db - da > 1:
+        return DIGITS[(da + db) // 2]
+    elif b is not None and len(b) > 1:
+        return b[0]
+
+    return DIGITS[da] + _midpoint(a[1:], None)
+
+
+def _increment(a: str) -> str:
+    # the shortest key after `a`, stepping by one digit keeps repeated appends short
+    for i, digit in enumerate(a):
+        if digit != DIGITS[-1]:
+            return a[:i] + DIGITS[DIGITS.index(digit) + 1]
+
+    return _midpoint(a, None)
+
+
+def _decrement(b: str) -> str:
+    for i, digit in enumerate(b):
+        if DIGITS.index(digit) > 1:
+            return b[:i] + DIGITS[DIGITS.index(digit) - 1]
+
+    return _midpoint('', b)
+
+
+def key_between(before: str | None, after: str | None) -> str:
+    """
+    Generates a key sorting between two others, `None` meaning either end.
+    """
+    if before is not None and after is not None:
+        if before >= after:
+            raise ValueError(f'{before!r} does not sort before {after!r}')
+
+        return _midpoint(before, after)
+    elif before is not None:
+        return _increment(before)
+    elif after is not None:
+        return _decrement(after)
+
+    return _midpoint('', None)
+
+
+def spread(n: int) -> list[str]:
+    """
+    `n` evenly spaced keys, as short as possible.
+    """
+    length = 1
+    while BASE**length <= n:
+        length += 1
+
+    keys = []
+    for i in range(1, n + 1):
+        value = i * BASE**length // (n + 1)
+        digits = []
+
+        for _ in range(length):
+            value, digit = divmod(value, BASE)
+            digits.append(DIGITS[digit])
+
+        keys.append(''.join(reversed(digits)).rstrip(DIGITS[0]))
+
+    return keys
+
+
+async def rebalance(session, guild_id: int, parent_id: int | None) -> None:
+    """
+    Give every channel under `parent_id` a fresh, evenly spaced, key and a dense position.
+
+    Channels without a key, from before `rank` ordering, are ordered by their old position.
+    """
+    await Guild.lock(session, guild_id)
+
+    stmt = (
+        select(Channel.id)
+        .where(Channel.guild_id == guild_id)
+        .where(Channel.parent_id == parent_id)
+        .order_by(Channel.rank.asc().nulls_last(), Channel.position, Channel.id)
+    )
+    ids = (await session.execute(stmt)).scalars().all()
+
+    keys = spread(len(ids))
+    await Channel.reposition(session, [(cid, i + 1, parent_id, keys[i]) for i, cid in enumerate(ids)])
+
+
+class Rebalancer:
+    """
+    Rebalances sibling groups in the background, away from the requests which ran out of short keys.
+    """
+
+    def __init__(self, session_factory: async_sessionmaker, interval: float = 5.0) -> None:
+        self.session_factory = session_factory
+        self.interval = interval
+        self._pending: set[tuple[int, int | None]] = set()
+
+    def request(self, guild_id: int, parent_id: int | None) -> None:
+        self._pending.add((guild_id, parent_id))
+
+    async def sweep(self) -> None:
+        """
+        Queue every group with keys missing or too long, such as after switching to `rank` ordering.
+        """
+        stmt = (
+            select(Channel.guild_id, Channel.parent_id)
+            .where(Channel.guild_id.is_not(None))
+            .where(or_(Channel.rank.is_(None), func.length(Channel.rank) > MAX_KEY_LENGTH))
+            .distinct()
+        )
+
+        async with self.session_factory() as session:
+            for guild_id, parent_id in (await session.execute(stmt)).all():
+                self.request(guild_id, parent_id)
+
+    async def run(self) -> None:
+        await self.sweep()
+
+        while True:
+            while self._pending:
+                guild_id, parent_id = self._pending.pop()
+
+                try:
+                    async with self.session_factory() as session:
+                        await rebalance(session, guild_id, parent_id)
+                        await session.commit()
+                except Exception:
+                    log.exception('failed to rebalance channels of %d under %s', guild_id, parent_id)
+
+                # one group at a time, so live traffic takes the guild locks first
+                await asyncio.sleep(0)
+
+            await asyncio.sleep(self.interval)
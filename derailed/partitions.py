@@ -0,0 +1,233 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from .identification import IDMedium, medium
+from .models.channel import MESSAGE_PARTITIONING
+
+__all__ = [
+    'MESSAGE_PARTITIONING',
+    'Partition',
+    'archive',
+    'create_ahead',
+    'create_between',
+    'existing',
+    'partition_for',
+    'partitions_between',
+]
+
+log = logging.getLogger(__name__)
+
+# partitions are this many days of message ids, counted from the snowflake epoch
+PERIOD_DAYS = int(os.getenv('MESSAGE_PARTITION_DAYS', '30'))
+AHEAD = int(os.getenv('MESSAGE_PARTITIONS_AHEAD', '3'))
+
+_BOUND = re.compile(r"FROM \('?(\d+)'?\) TO \('?(\d+)'?\)")
+
+
+class Partition:
+    def __init__(self, name: str, lower: int, upper: int) -> None:
+        self.name = name
+        # ids from `lower` up to, but not including, `upper`
+        self.lower = lower
+        self.upper = upper
+
+
+def partition_for(when: datetime, ids: IDMedium = medium, period_days: int = PERIOD_DAYS) -> Partition:
+    """
+    The partition holding ids issued at `when`.
+
+    Partitions line up with whole periods since the epoch, so every process names them the same.
+    """
+    period = timedelta(days=period_days)
+    epoch = ids.time_of(0)
+    start = epoch + period * ((when - epoch) // period)
+
+    return Partition(f'messages_p{start:%Y%m%d}', ids.at(start), ids.at(start + period))
+
+
+def partitions_between(
+    start: datetime, end: datetime, ids: IDMedium = medium, period_days: int = PERIOD_DAYS
+) -> list[Partition]:
+    """
+    Every partition holding ids issued from `start` to `end`, both included.
+    """
+    # ids can't be issued before the epoch, earlier times get the epoch's
+    start, end = max(start, ids.time_of(0)), max(end, ids.time_of(0))
+    partitions = [partition_for(start, ids, period_days)]
+    last = partition_for(end, ids, period_days)
+
+    while partitions[-1].upper <= last.lower:
+        partitions.append(partition_for(ids.time_of(partitions[-1].upper), ids, period_days))
+
+    return partitions
+
+
+async def existing(conn: AsyncConnection) -> list[Partition]:
+    result = await conn.execute(
+        text(
+            '''
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'messages'::regclass
+            '''
+        )
+    )
+    partitions = []
+
+    for name, bound in result.all():
+        match = _BOUND.search(bound)
+
+        if match is not None:
+            partitions.append(Partition(name, int(match[1]), int(match[2])))
+
+    return sorted(partitions, key=lambda p: p.lower)
+
+
+async def create_ahead(
+    conn: AsyncConnection, ahead: int = AHEAD, now: datetime | None = None
+) -> list[Partition]:
+    """
+    Make sure the current partition and the `ahead` after it exist, returning those created.
+    """
+    now = now or datetime.now(timezone.utc)
+    return await create_between(conn, now, now + timedelta(days=PERIOD_DAYS * ahead))
+
+
+async def create_between(conn: AsyncConnection, start: datetime, end: datetime) -> list[Partition]:
+    """
+    Make sure every partition from `start` to `end` exists, returning those created.
+    """
+    have = {p.name for p in await existing(conn)}
+    created = []
+
+    for partition in partitions_between(start, end):
+        if partition.name in have:
+            continue
+
+        await conn.execute(
+            text(
+                f'CREATE TABLE IF NOT EXISTS {partition.name} PARTITION OF messages '
+                f'FOR VALUES FROM ({partition.lower}) TO ({partition.upper})'
+            )
+        )
+        created.append(partition)
+
+    return created
+
+
+async def archive(
+    conn: AsyncConnection, partition: Partition, directory: str | None, drop: bool = True
+) -> None:
+    """
+    Detach a partition, optionally writing it to a gzipped CSV in `directory`, and drop it.
+    """
+    # channels can't keep pointing at messages leaving the table
+    await conn.execute(
+        text(
+            'UPDATE channels SET last_message_id = NULL '
+            'WHERE last_message_id >= :lower AND last_message_id < :upper'
+        ),
+        {'lower': partition.lower, 'upper': partition.upper},
+    )
+    # mentions share their message's id, so they fall in the same range
+    await conn.execute(
+        text('DELETE FROM mentions WHERE id >= :lower AND id < :upper'),
+        {'lower': partition.lower, 'upper': partition.upper},
+    )
+    await conn.execute(text(f'ALTER TABLE messages DETACH PARTITION {partition.name}'))
+
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{partition.name}.csv.gz')
+        raw = (await conn.get_raw_connection()).driver_connection
+
+        with gzip.open(path, 'wb') as f:
+            await raw.copy_from_table(partition.name, output=f, format='csv', header=True)
+
+        log.info('archived %s to %s', partition.name, path)
+
+    if drop:
+        await conn.execute(text(f'DROP TABLE {partition.name}'))
+
+
+async def maintain(engine: AsyncEngine, interval: float = 6 * 3600) -> None:
+    # partitions are made months ahead, checking a few times a day leaves plenty of room
+    while True:
+        try:
+            async with engine.begin() as conn:
+                for partition in await create_ahead(conn):
+                    log.info('created message partition %s', partition.name)
+        except Exception:
+            log.exception('failed to create message partitions')
+
+        await asyncio.sleep(interval)
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from .database import engine
+
+    async with engine.begin() as conn:
+        if args.command == 'list':
+            for partition in await existing(conn):
+                start, end = medium.time_of(partition.lower), medium.time_of(partition.upper)
+                print(f'{partition.name:<22} {start:%Y-%m-%d} - {end:%Y-%m-%d}')
+        elif args.command == 'create':
+            for partition in await create_ahead(conn, args.ahead):
+                print(f'created {partition.name}')
+        elif args.command == 'archive':
+            cutoff = medium.at(datetime.now(timezone.utc) - timedelta(days=args.older_than))
+
+            for partition in await existing(conn):
+                if partition.upper <= cutoff:
+                    await archive(conn, partition, args.to, drop=not args.keep)
+                    print(f'archived {partition.name}')
+
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        'derailed.partitions', description='Manage partitions of the messages table.'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('list', help='list partitions and the time they cover')
+
+    create = commands.add_parser('create', help='create the current and upcoming partitions')
+    create.add_argument('--ahead', type=int, default=AHEAD, help='upcoming partitions to create')
+
+    archiving = commands.add_parser('archive', help='detach, and drop, partitions older than a cutoff')
+    archiving.add_argument('--older-than', type=int, required=True, metavar='DAYS')
+    archiving.add_argument('--to', metavar='DIRECTORY', help='write each partition here as gzipped CSV first')
+    archiving.add_argument('--keep', action='store_true', help='keep detached partitions as plain tables')
+
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -74,9 +74,24 @@ def merge_permissions(*perms: GuildPermission) -> int:
         for v in GuildPermissions:
             if has_bit(perm.deny, v):
                 # denials take hold infront of allows
-                value -= v
+                value &= ~v
                 continue
             elif has_bit(perm.allow, v):
-                value += v
+                value |= v
 
     return value
+
+
+def guild_permissions(roles: list[GuildPermission], owner: bool = False) -> int:
+    """
+    What a member may do guild-wide, from the permissions of their `roles`.
+    """
+    if owner:
+        return ALL_PERMISSIONS
+
+    # lowest first, so higher roles override them
+    ordered = sorted(roles, key=lambda role: role.position)
+
+    return merge_permissions(
+        *(unwrap_guild_permissions(allow=r.allow, deny=r.deny, pos=i) for i, r in enumerate(ordered))
+    )
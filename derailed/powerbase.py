@@ -19,48 +19,61 @@ import binascii
 import json
 import math
 import os
+import re
 from typing import Any, NoReturn
 
 import grpc.aio as grpc
 from fastapi import Depends, HTTPException, Path, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .database import get_db, to_dict, uses_db
+from .database import AsyncSessionFactory, get_db, to_dict, uses_db
+from .deletion import Deletor
 from .grpc import derailed_pb2_grpc
 from .grpc.auth import auth_pb2_grpc
 from .grpc.auth.auth_pb2 import CreateToken, NewToken, Valid, ValidateToken
-from .grpc.derailed_pb2 import GetGuildInfo, Message, Publ, RepliedGuildInfo, UPubl
+from .grpc.derailed_pb2 import GetGuildInfo, GetGuildsInfo, Message, Publ, RepliedGuildInfo, UPubl
 from .identification import medium
 from .models import Channel, Guild, Member, User
 from .models.channel import ChannelType
+from .ordering import MAX_KEY_LENGTH, Rebalancer, key_between, rebalance, spread
+from .ordering import MODE as ORDERING
 from .permissions import (
     GuildPermission,
+    guild_permissions,
     has_bit,
-    merge_permissions,
     unwrap_guild_permissions,
 )
+from .presence import Presences, Typing
+from .readstates import AckBuffer
+from .undefinable import UNDEFINED, Undefined
 
 
-async def uses_auth(request: Request, session: AsyncSession = Depends(uses_db)) -> User:
-    token = request.headers.get('Authorization', None)
+def parse_token(token: str | None) -> int | None:
+    """
+    Gets the user id a token claims to belong to, without validating it.
+    """
+    if not token:
+        return None
 
-    if token is None or token == '':
-        abort_auth()
+    try:
+        return int(base64.urlsafe_b64decode(token.split('.', 1)[0]).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
 
-    splits = token.split('.')
 
-    try:
-        user_id = splits[0]
-        user_id = base64.urlsafe_b64decode(user_id).decode()
-    except (binascii.Error, UnicodeDecodeError, IndexError):
+async def uses_auth(request: Request, session: AsyncSession = Depends(uses_db)) -> User:
+    token = request.headers.get('Authorization', None)
+    user_id = parse_token(token)
+
+    if user_id is None:
         abort_auth()
 
-    user = await User.get(session, int(user_id))
+    user = await User.get(session, user_id)
 
     if user is None:
         abort_auth()
 
-    is_valid = await valid_authorization(user_id, user.password, token)
+    is_valid = await valid_authorization(str(user_id), user.password, token)
 
     if is_valid is False:
         abort_auth()
@@ -70,24 +83,17 @@ async def uses_auth(request: Request, session: AsyncSession = Depends(uses_db))
 
 async def uses_no_raises_auth(request: Request, session: AsyncSession = Depends(uses_db)) -> User | None:
     token = request.headers.get('Authorization', None)
+    user_id = parse_token(token)
 
-    if token is None or token == '':
-        return None
-
-    splits = token.split('.')
-
-    try:
-        user_id = splits[0]
-        user_id = base64.urlsafe_b64decode(user_id).decode()
-    except (binascii.Error, UnicodeDecodeError, IndexError):
+    if user_id is None:
         return None
 
-    user = await User.get(session, int(user_id))
+    user = await User.get(session, user_id)
 
     if user is None:
         return None
 
-    is_valid = await valid_authorization(user_id, user.password, token)
+    is_valid = await valid_authorization(str(user_id), user.password, token)
 
     if is_valid is False:
         return None
@@ -134,6 +140,33 @@ def prepare_user(user: User, own: bool = False) -> dict[str, Any]:
     return user
 
 
+def prepare_guild_dict(guild: Guild) -> dict[str, Any]:
+    d = to_dict(guild)
+    d.pop('max_position', None)
+    d.pop('deletor_job_id', None)
+    return d
+
+
+def prepare_member(row: Any) -> dict[str, Any]:
+    """
+    A row of `Member.listing` as returned to users.
+    """
+    nick, user_id, username, discriminator, flags, system, suspended, roles = row
+
+    return {
+        'user': {
+            'id': str(user_id),
+            'username': username,
+            'discriminator': discriminator,
+            'flags': flags,
+            'system': system,
+            'suspended': suspended,
+        },
+        'nick': nick,
+        'roles': [str(role_id) for role_id in roles],
+    }
+
+
 def abort_auth() -> NoReturn:
     raise HTTPException(401, 'Invalid Authorization')
 
@@ -184,6 +217,17 @@ async def get_guild_info(guild_id: int) -> RepliedGuildInfo:
     return await guild_stub.get_guild_info(GetGuildInfo(guild_id=str(guild_id)))
 
 
+async def get_guilds_info(guild_ids: list[int]) -> dict[int, RepliedGuildInfo]:
+    """
+    `get_guild_info` for many guilds in a single call, leaving out those the gateway doesn't know of.
+    """
+    if guild_stub is None:
+        await _init_stubs()
+
+    reply = await guild_stub.get_guilds_info(GetGuildsInfo(guild_ids=[str(id) for id in guild_ids]))
+    return {int(guild_id): info for guild_id, info in reply.guilds.items()}
+
+
 async def create_token(user_id: str | int, password: str) -> str:
     if auth_stub is None:
         await _init_stubs()
@@ -241,7 +285,8 @@ def prepare_permissions(member: Member, guild: Guild, required_permissions: list
             )
         )
 
-    perms = merge_permissions(*permsl)
+    # the same as bootstrap's `effective_permissions`
+    perms = guild_permissions(permsl)
 
     for perm in required_permissions:
         if not has_bit(perms, perm):
@@ -250,42 +295,181 @@ def prepare_permissions(member: Member, guild: Guild, required_permissions: list
 
 CHANNEL_REGEX = '^[a-z0-9](?:[a-z0-9-_]{1,32}[a-z0-9])?$'
 
+# `<@user_id>` and `<@&role_id>`
+MENTION_REGEX = re.compile(r'<@(&?)(\d{1,20})>')
+# mentions past this many in one message are ignored
+MAX_MENTIONS = 50
+
+
+def prepare_mentions(content: str) -> tuple[set[int], set[int]]:
+    users: set[int] = set()
+    roles: set[int] = set()
+
+    for match in MENTION_REGEX.finditer(content):
+        if len(users) + len(roles) >= MAX_MENTIONS:
+            break
+
+        (roles if match[1] else users).add(int(match[2]))
+
+    return users, roles
+
 
 async def prepare_channel_position(
     session: AsyncSession, wanted_position: int, parent_id: int | None, guild: Guild
 ) -> None:
-    c = await Channel.get_for_pos(session, wanted_position, guild.id, parent_id)
+    await Channel.shift(session, guild.id, parent_id, wanted_position)
 
-    if c is None:
-        return
 
-    guild_channels = await Channel.get_via(session, parent_id, guild.id)
+async def prepare_category_position(session: AsyncSession, wanted_position: int, guild: Guild) -> None:
+    # categories share top-level positions with channels without one, as `Guild.max_position` does
+    await Channel.shift(session, guild.id, None, wanted_position)
+
 
-    for channel in guild_channels:
-        if channel.position >= wanted_position:
-            channel.position += 1
-            session.add(channel)
+rebalancer = Rebalancer(AsyncSessionFactory)
+deletor = Deletor(AsyncSessionFactory)
+acks = AckBuffer(AsyncSessionFactory, publish=publish_to_user)
+typing = Typing()
+presences = Presences(AsyncSessionFactory, publish_to_user, publish_to_guild)
 
-    await session.commit()
 
+async def prepare_channel_rank(
+    session: AsyncSession,
+    guild: Guild,
+    parent_id: int | None,
+    position: int | Undefined,
+    channel_id: int | None = None,
+) -> tuple[int, str]:
+    """
+    Finds the key placing a channel at `position` under `parent_id`, without touching its siblings.
+    """
+    ranks = await Channel.ranks(session, guild.id, parent_id, exclude=channel_id)
 
-async def prepare_category_position(session: AsyncSession, wanted_position: int, guild: Guild) -> None:
-    c = await Channel.get_for_pos(session, wanted_position, guild.id)
+    if None in ranks:
+        # left over from dense ordering
+        await rebalance(session, guild.id, parent_id)
+        ranks = await Channel.ranks(session, guild.id, parent_id, exclude=channel_id)
 
-    if c is None:
-        return
+    if position is UNDEFINED:
+        position = len(ranks) + 1
+    elif position > len(ranks) + 1:
+        raise HTTPException(400, 'Channel position too high')
 
-    guild_channels = await Channel.get_via(session, None, guild.id)
+    before = ranks[position - 2] if position > 1 else None
+    after = ranks[position - 1] if position <= len(ranks) else None
+    rank = key_between(before, after)
 
-    for channel in guild_channels:
-        if channel.type != ChannelType.CATEGORY:
-            continue
+    if len(rank) > MAX_KEY_LENGTH:
+        rebalancer.request(guild.id, parent_id)
 
-        if channel.position >= wanted_position:
-            channel.position += 1
-            session.add(channel)
+    if len(rank) > Channel.rank.type.length:
+        # the rebalancer fell behind, so don't wait on it
+        await rebalance(session, guild.id, parent_id)
+        return await prepare_channel_rank(session, guild, parent_id, position, channel_id)
 
-    await session.commit()
+    return position, rank
+
+
+def prepare_rank_moves(
+    channels: dict[int, Channel], moves: dict[int, tuple[int, int | None]]
+) -> list[tuple[int, int, int | None, str]]:
+    """
+    Keys for many moves at once, only the moved channels are given new ones.
+    """
+    rows: list[tuple[int, int, int | None, str]] = []
+
+    for parent_id in {parent_id for _, parent_id in moves.values()}:
+        staying = sorted(
+            (c for c in channels.values() if c.parent_id == parent_id and c.id not in moves),
+            key=lambda c: (c.rank is None, c.rank or ''),
+        )
+        order: list[tuple[int, str | None]] = [(c.id, c.rank) for c in staying]
+        moved = sorted((pos, cid) for cid, (pos, pid) in moves.items() if pid == parent_id)
+
+        for position, cid in moved:
+            order.insert(min(position - 1, len(order)), (cid, None))
+
+        group: list[tuple[int, int, int | None, str]] = []
+        before: str | None = None
+        rekey = any(c.rank is None for c in staying)
+
+        for i, (cid, rank) in enumerate(order):
+            if rekey:
+                break
+
+            if rank is None:
+                after = next((r for _, r in order[i + 1 :] if r is not None), None)
+                rank = key_between(before, after)
+                group.append((cid, i + 1, parent_id, rank))
+                # many channels moved into one gap would make for long keys
+                rekey = len(rank) > MAX_KEY_LENGTH
+
+            before = rank
+
+        if rekey:
+            # the whole group is in hand, so key all of it evenly instead
+            keys = spread(len(order))
+            group = [(cid, i + 1, parent_id, keys[i]) for i, (cid, _) in enumerate(order)]
+
+        rows.extend(group)
+
+    return rows
+
+
+def prepare_max_positions(
+    guild: Guild, channels: dict[int, Channel], moves: dict[int, tuple[int, int | None]]
+) -> None:
+    """
+    Recount `max_position` of every parent `moves` touch, from the guild's channels already in hand.
+    """
+    parents = {parent_id for _, parent_id in moves.values()} | {channels[cid].parent_id for cid in moves}
+    groups: dict[int | None, list[int]] = {parent_id: [] for parent_id in parents}
+
+    for channel in channels.values():
+        position, parent_id = moves.get(channel.id, (channel.position, channel.parent_id))
+
+        if parent_id in groups:
+            groups[parent_id].append(position or 0)
+
+    for parent_id, positions in groups.items():
+        # under rank ordering stored positions go stale, so count instead
+        highest = len(positions) if ORDERING == 'rank' else max(positions, default=0)
+        (channels[parent_id] if parent_id is not None else guild).max_position = highest
+
+
+def prepare_channels(channels: list[Channel]) -> list[dict[str, Any]]:
+    """
+    Channels as returned to users, with positions derived from their keys under rank ordering.
+    """
+    dicts = [to_dict(channel) for channel in channels]
+
+    if ORDERING == 'rank':
+        groups: dict[Any, list[dict[str, Any]]] = {}
+
+        for d in dicts:
+            groups.setdefault(d['parent_id'], []).append(d)
+
+        for group in groups.values():
+            group.sort(key=lambda d: (d['rank'] is None, d['rank'] or ''))
+
+            for i, d in enumerate(group):
+                d['position'] = i + 1
+
+    for d in dicts:
+        d.pop('rank', None)
+        d.pop('max_position', None)
+
+    return dicts
+
+
+def prepare_channel_dict(channel: Channel, position: int | None = None) -> dict[str, Any]:
+    d = to_dict(channel)
+    d.pop('rank', None)
+    d.pop('max_position', None)
+
+    if position is not None:
+        d['position'] = position
+
+    return d
 
 
 async def prepare_guild_channel(session: AsyncSession, channel_id: int, guild: Guild) -> Channel:
@@ -310,23 +494,39 @@ async def prepare_channel(session: AsyncSession, channel_id: int) -> Channel:
     return channel
 
 
-def prepare_default_channels(guild: Guild, session: AsyncSession) -> None:
-    cat = Channel(
-        id=medium.snowflake(),
-        name='general',
-        parent_id=None,
-        type=ChannelType.CATEGORY,
-        guild_id=guild.id,
-        position=1,
-    )
-    general = Channel(
-        id=medium.snowflake(),
-        name='general',
-        parent_id=cat.id,
-        type=ChannelType.TEXT,
-        last_message_id=None,
-        guild_id=guild.id,
-        position=1,
-    )
-
-    session.add_all([cat, general])
+def prepare_default_channels(guild: Guild) -> list[dict[str, Any]]:
+    """
+    Rows of the channels every new guild starts with, to be inserted at once, counted into `guild`.
+    """
+    cat, general = medium.take(2)
+    rank = spread(1)[0] if ORDERING == 'rank' else None
+
+    rows = [
+        {
+            'id': cat,
+            'name': 'general',
+            'parent_id': None,
+            'type': ChannelType.CATEGORY,
+            'guild_id': guild.id,
+            'position': 1,
+            'rank': rank,
+            'max_position': 1,
+            'last_message_id': None,
+        },
+        {
+            'id': general,
+            'name': 'general',
+            'parent_id': cat,
+            'type': ChannelType.TEXT,
+            'guild_id': guild.id,
+            'position': 1,
+            'rank': rank,
+            'max_position': 0,
+            'last_message_id': None,
+        },
+    ]
+
+    guild.channel_count += len(rows)
+    guild.max_position += 1
+
+    return rows
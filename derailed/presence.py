@@ -0,0 +1,227 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import BigInteger, cast, column, delete, select, update, values
+from sqlalchemy.dialects.postgresql import insert as upsert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .models.activity import Activity, ActivityType
+from .models.member import Member
+from .models.user import DefaultStatus, Settings
+
+__all__ = ['Presences', 'Typing', 'presence_event']
+
+log = logging.getLogger(__name__)
+
+TYPING_WINDOW = float(os.getenv('TYPING_WINDOW', '8'))
+PRESENCE_WINDOW_MS = float(os.getenv('PRESENCE_WINDOW_MS', '2000'))
+
+Publish = Callable[[Any, str, dict[str, Any]], Awaitable[None]]
+
+
+class Typing:
+    """
+    Who was lately announced typing where, so `TYPING_START` goes out once every `window` seconds.
+
+    Clients send typing every few seconds while a user types, each of which would otherwise be
+    another event to every member. Kept per worker, so a user's requests spread over several workers
+    may each be announced.
+    """
+
+    def __init__(self, window: float = TYPING_WINDOW) -> None:
+        self.window = window
+        self._until: dict[tuple[int, int], float] = {}
+        self._next_prune = 0.0
+
+    def announced(self, user_id: int, channel_id: int) -> bool:
+        return self._until.get((user_id, channel_id), 0.0) > time.monotonic()
+
+    def announce(self, user_id: int, channel_id: int) -> None:
+        now = time.monotonic()
+
+        # forget everyone who stopped, once a window
+        if now >= self._next_prune:
+            self._until = {key: until for key, until in self._until.items() if until > now}
+            self._next_prune = now + self.window
+
+        self._until[(user_id, channel_id)] = now + self.window
+
+
+class Presences:
+    """
+    Status and activity changes held by this worker and written behind, the last of a window winning.
+
+    Clients flap between statuses as they go idle and come back, so changes merge per user and
+    every `interval` seconds the latest are written in a few set-based statements and published once,
+    to the user and to every guild they're in.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        publish_to_user: Publish | None = None,
+        publish_to_guild: Publish | None = None,
+        interval: float = PRESENCE_WINDOW_MS / 1000,
+    ) -> None:
+        self.session_factory = session_factory
+        self.publish_to_user = publish_to_user
+        self.publish_to_guild = publish_to_guild
+        self.interval = interval
+        # user id to what changed, `activity` being None once cleared
+        self._pending: dict[int, dict[str, Any]] = {}
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def set(self, user_id: int, **changes: Any) -> dict[str, Any]:
+        """
+        Merge `status` and `activity` changes in, returning everything pending for the user.
+        """
+        merged = self._pending.setdefault(user_id, {})
+        merged.update(changes)
+        return merged
+
+    async def write(self, changes: dict[int, dict[str, Any]]) -> dict[int, list[int]]:
+        """
+        Write `changes`, returning the guilds of every user changed.
+        """
+        statuses = [(u, c['status']) for u, c in changes.items() if 'status' in c]
+        now = datetime.utcnow()
+        activities = [
+            {'user_id': u, 'type': ActivityType.CUSTOM, 'content': c['activity'], 'created_at': now}
+            for u, c in changes.items()
+            if c.get('activity') is not None
+        ]
+        cleared = [u for u, c in changes.items() if 'activity' in c and c['activity'] is None]
+
+        async with self.session_factory() as session:
+            if statuses:
+                rows = values(
+                    column('user_id', BigInteger()), column('status', Settings.status.type), name='statuses'
+                ).data(statuses)
+                await session.execute(
+                    update(Settings)
+                    .where(Settings.user_id == rows.c.user_id)
+                    .values(status=cast(rows.c.status, Settings.status.type))
+                    .execution_options(synchronize_session=False)
+                )
+
+            if activities:
+                stmt = upsert(Activity).values(activities)
+                await session.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=['user_id'],
+                        set_={
+                            'type': stmt.excluded.type,
+                            'content': stmt.excluded.content,
+                            'created_at': stmt.excluded.created_at,
+                        },
+                    )
+                )
+
+            if cleared:
+                await session.execute(
+                    delete(Activity)
+                    .where(Activity.user_id.in_(cleared))
+                    .execution_options(synchronize_session=False)
+                )
+
+            result = await session.execute(
+                select(Member.user_id, Member.guild_id).where(Member.user_id.in_(list(changes)))
+            )
+            await session.commit()
+
+        guilds: dict[int, list[int]] = {}
+
+        for user_id, guild_id in result.all():
+            guilds.setdefault(user_id, []).append(guild_id)
+
+        return guilds
+
+    async def flush(self) -> int:
+        """
+        Write and publish every pending change, returning for how many users.
+
+        Changes which failed to be written are merged back in, under any made since.
+        """
+        changes, self._pending = self._pending, {}
+
+        if not changes:
+            return 0
+
+        try:
+            guilds = await self.write(changes)
+        except Exception:
+            for user_id, change in changes.items():
+                self._pending[user_id] = {**change, **self._pending.get(user_id, {})}
+            raise
+
+        publishes = []
+
+        for user_id, change in changes.items():
+            data = presence_event(user_id, change)
+
+            if self.publish_to_user is not None:
+                publishes.append(self.publish_to_user(user_id, 'PRESENCE_UPDATE', data))
+
+            if self.publish_to_guild is not None:
+                # invisible users look offline to everyone else
+                if change.get('status') is DefaultStatus.OFFLINE:
+                    data = {'user_id': str(user_id), 'status': 'offline'}
+
+                for guild_id in guilds.get(user_id, []):
+                    publishes.append(self.publish_to_guild(guild_id, 'PRESENCE_UPDATE', data))
+
+        await asyncio.gather(*publishes, return_exceptions=True)
+        return len(changes)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+
+            try:
+                await self.flush()
+            except Exception:
+                log.exception('failed to write presences, %d left pending', self.pending)
+
+    async def drain(self) -> None:
+        """
+        Flush what's left, for shutting down.
+        """
+        if self._pending:
+            log.info('draining %d presences', self.pending)
+            await self.flush()
+
+
+def presence_event(user_id: int, change: dict[str, Any]) -> dict[str, Any]:
+    data: dict[str, Any] = {'user_id': str(user_id)}
+
+    if 'status' in change:
+        data['status'] = change['status'].value
+
+    if 'activity' in change:
+        content = change['activity']
+        data['activity'] = content and {'type': ActivityType.CUSTOM.value, 'content': content}
+
+    return data
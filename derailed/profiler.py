@@ -0,0 +1,222 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import hmac
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from types import FrameType
+
+__all__ = ['ProfilerMiddleware', 'Sampler', 'TaskProfile']
+
+log = logging.getLogger(__name__)
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _thread_stack(frame: FrameType | None) -> list[str]:
+    stack = []
+
+    while frame is not None:
+        stack.append(_frame_name(frame))
+        frame = frame.f_back
+
+    stack.reverse()
+    return stack
+
+
+def _await_stack(coro) -> list[str]:
+    # the chain of coroutines this task is suspended in, outermost first
+    stack = []
+
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None)
+
+        if frame is not None:
+            stack.append(_frame_name(frame))
+
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None)
+
+    stack.append('[awaiting]')
+    return stack
+
+
+class TaskProfile:
+    def __init__(self, task: asyncio.Task, loop: asyncio.AbstractEventLoop, thread_id: int) -> None:
+        self.task = task
+        self.loop = loop
+        self.thread_id = thread_id
+        self.samples: Counter[str] = Counter()
+        self.started_at = time.perf_counter()
+
+    def sample(self, frames: dict[int, FrameType]) -> None:
+        if asyncio.current_task(self.loop) is self.task:
+            stack = _thread_stack(frames.get(self.thread_id))
+        else:
+            stack = _await_stack(self.task.get_coro())
+
+        if stack:
+            self.samples[';'.join(stack)] += 1
+
+    def collapsed(self) -> str:
+        """
+        Samples in the collapsed-stack format understood by flamegraph.pl and speedscope.
+        """
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+
+class Sampler(threading.Thread):
+    """
+    A single daemon thread sampling every running `TaskProfile`.
+
+    Sleeps on an event while there is nothing to profile.
+    """
+
+    def __init__(self, interval: float) -> None:
+        super().__init__(name='derailed-profiler', daemon=True)
+        self.interval = interval
+        self._profiles: set[TaskProfile] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def add(self, profile: TaskProfile) -> None:
+        with self._lock:
+            self._profiles.add(profile)
+        self._wake.set()
+
+    def remove(self, profile: TaskProfile) -> None:
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def run(self) -> None:
+        while True:
+            with self._lock:
+                profiles = list(self._profiles)
+
+                if not profiles:
+                    self._wake.clear()
+
+            if not profiles:
+                self._wake.wait()
+                continue
+
+            frames = sys._current_frames()
+
+            for profile in profiles:
+                try:
+                    profile.sample(frames)
+                except Exception:
+                    # racing the event loop thread, a torn sample is simply dropped
+                    continue
+
+            del frames
+            time.sleep(self.interval)
+
+
+class ProfilerMiddleware:
+    """
+    Opt-in sampling of slow requests.
+
+    A request is profiled when it carries a `X-Derailed-Profile` header matching `PROFILE_TOKEN`,
+    when it is picked by `PROFILE_SAMPLE_RATE`, or once it has been running longer than
+    `PROFILE_THRESHOLD_MS`. Profiles are written to `PROFILE_DIR` as collapsed stacks.
+    Requests which aren't picked only cost a header lookup, a random number and a timer.
+    """
+
+    def __init__(
+        self,
+        app,
+        directory: str = 'profiles',
+        token: str | None = None,
+        sample_rate: float = 0.0,
+        threshold_ms: float | None = None,
+        interval_ms: float = 5.0,
+    ) -> None:
+        self.app = app
+        self.directory = directory
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        self.threshold = threshold_ms / 1000 if threshold_ms else None
+        self.enabled = bool(self.token or self.sample_rate or self.threshold)
+        self._sampler: Sampler | None = None
+        self._interval = interval_ms / 1000
+
+    def _requested(self, scope) -> bool:
+        if self.token is not None:
+            for name, value in scope['headers']:
+                if name == b'x-derailed-profile':
+                    return hmac.compare_digest(value, self.token)
+
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _start(self, profile: TaskProfile) -> None:
+        if self._sampler is None:
+            self._sampler = Sampler(self._interval)
+            self._sampler.start()
+
+        self._sampler.add(profile)
+
+    async def __call__(self, scope, receive, send) -> None:
+        if not self.enabled or scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        requested = self._requested(scope)
+
+        if not requested and self.threshold is None:
+            await self.app(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+        profile = TaskProfile(asyncio.current_task(), loop, threading.get_ident())
+        timer: asyncio.TimerHandle | None = None
+
+        if requested:
+            self._start(profile)
+        else:
+            timer = loop.call_later(self.threshold, self._start, profile)
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+            if self._sampler is not None:
+                self._sampler.remove(profile)
+
+            if profile.samples:
+                await loop.run_in_executor(None, self._write, scope, profile)
+
+    def _write(self, scope, profile: TaskProfile) -> None:
+        elapsed = (time.perf_counter() - profile.started_at) * 1000
+        path = scope['path'].strip('/').replace('/', '_') or 'index'
+        name = f'{int(time.time() * 1000)}-{scope["method"]}-{path}-{elapsed:.0f}ms.collapsed'
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(os.path.join(self.directory, name), 'w') as f:
+            f.write(profile.collapsed())
+
+        log.info('wrote profile %s (%d samples)', name, sum(profile.samples.values()))
@@ -0,0 +1,178 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+__all__ = ['QueryBudgetExceeded', 'QueryStats', 'QueryWatchMiddleware', 'budget', 'install', 'watch']
+
+log = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv('QUERY_WATCH_SLOW_MS', '100'))
+REPEAT_THRESHOLD = int(os.getenv('QUERY_WATCH_REPEAT', '5'))
+
+
+class QueryBudgetExceeded(AssertionError):
+    def __init__(self, stats: 'QueryStats', limit: int) -> None:
+        self.stats = stats
+        self.limit = limit
+
+        super().__init__(f'{stats.name or "block"} ran {stats.count} statements, budget was {limit}')
+
+
+class QueryStats:
+    def __init__(self, name: str | None = None) -> None:
+        self.name = name
+        self.count: int = 0
+        self.shapes: Counter[str] = Counter()
+        self.slow: list[tuple[str, float, tuple[str, ...]]] = []
+
+    def repeated(self, threshold: int = REPEAT_THRESHOLD) -> list[tuple[str, int]]:
+        """
+        Statement shapes ran at least `threshold` times, usually an N+1.
+        """
+        return [(shape, n) for shape, n in self.shapes.most_common() if n >= threshold]
+
+
+_current: ContextVar[QueryStats | None] = ContextVar('query_stats', default=None)
+_installed: set[int] = set()
+
+
+def _param_shape(parameters: Any) -> tuple[str, ...]:
+    if isinstance(parameters, dict):
+        return tuple(f'{k}:{type(v).__name__}' for k, v in parameters.items())
+    elif isinstance(parameters, (list, tuple)):
+        return tuple(type(v).__name__ for v in parameters)
+    return (type(parameters).__name__,)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault('query_watch_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed = (time.perf_counter() - conn.info['query_watch_start'].pop()) * 1000
+    stats = _current.get()
+
+    if stats is not None:
+        stats.count += 1
+        stats.shapes[statement] += 1
+
+    if elapsed >= SLOW_QUERY_MS:
+        shape = _param_shape(parameters)
+
+        if stats is not None:
+            stats.slow.append((statement, elapsed, shape))
+
+        log.warning('slow query (%.1fms) params=%s: %s', elapsed, shape, statement)
+
+
+def _handle_error(context) -> None:
+    # a failed statement never reaches `_after_cursor_execute`, so drop the start it pushed
+    conn = context.connection
+
+    if conn is not None and conn.info.get('query_watch_start'):
+        conn.info['query_watch_start'].pop()
+
+
+def install(engine: Engine) -> None:
+    """
+    Attach the statement counters to `engine`.
+
+    For async engines pass `engine.sync_engine`.
+    """
+    if id(engine) in _installed:
+        return
+
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+    _installed.add(id(engine))
+
+
+@contextmanager
+def watch(limit: int | None = None, name: str | None = None) -> Iterator[QueryStats]:
+    """
+    Count the statements executed inside this block.
+
+    Raises `QueryBudgetExceeded` on exit if more than `limit` statements ran.
+    """
+    stats = QueryStats(name)
+    token = _current.set(stats)
+
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+    if limit is not None and stats.count > limit:
+        raise QueryBudgetExceeded(stats, limit)
+
+
+def budget(limit: int) -> Callable:
+    """
+    Declare the maximum amount of statements a route may run.
+    """
+
+    def wrapper(func: Callable) -> Callable:
+        func.__query_budget__ = limit
+        return func
+
+    return wrapper
+
+
+class QueryWatchMiddleware:
+    """
+    Per-request statement accounting for development and staging.
+
+    When `strict` is set, routes going over their declared `budget` raise
+    `QueryBudgetExceeded` instead of only being logged, which fails tests.
+    """
+
+    def __init__(self, app, strict: bool = False) -> None:
+        self.app = app
+        self.strict = strict
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        name = f'{scope["method"]} {scope["path"]}'
+
+        with watch(name=name) as stats:
+            await self.app(scope, receive, send)
+
+        for shape, n in stats.repeated():
+            log.warning('%s repeated a statement %d times: %s', name, n, shape)
+
+        limit = getattr(scope.get('endpoint'), '__query_budget__', None)
+
+        if limit is not None and stats.count > limit:
+            if self.strict:
+                raise QueryBudgetExceeded(stats, limit)
+
+            log.warning('%s ran %d statements, budget was %d', name, stats.count, limit)
+        else:
+            log.debug('%s ran %d statements', name, stats.count)
@@ -0,0 +1,116 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .models.channel import ReadState
+
+__all__ = ['AckBuffer']
+
+log = logging.getLogger(__name__)
+
+FLUSH_MS = float(os.getenv('ACK_FLUSH_MS', '300'))
+# read states upserted per statement
+BATCH_SIZE = int(os.getenv('ACK_BATCH_SIZE', '1000'))
+
+Publish = Callable[[Any, str, dict[str, Any]], Awaitable[None]]
+
+
+class AckBuffer:
+    """
+    Acks held in memory by this worker and written behind, many at a time.
+
+    Every message a user sees is acked, yet only the newest of a channel matters, so acks merge
+    into the highest message id per user and channel and are upserted every `interval` seconds.
+    The upsert keeps the highest id as well, other workers writing the same read states.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        publish: Publish | None = None,
+        interval: float = FLUSH_MS / 1000,
+        batch_size: int = BATCH_SIZE,
+    ) -> None:
+        self.session_factory = session_factory
+        self.publish = publish
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending: dict[tuple[int, int], int] = {}
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def ack(self, user_id: int, channel_id: int, message_id: int) -> None:
+        key = (user_id, channel_id)
+
+        if message_id > self._pending.get(key, 0):
+            self._pending[key] = message_id
+
+    async def flush(self) -> int:
+        """
+        Upsert every pending ack, returning how many there were.
+
+        Acks which failed to be written are merged back in, to be tried again with the next flush.
+        """
+        pending, self._pending = list(self._pending.items()), {}
+
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start : start + self.batch_size]
+
+            try:
+                async with self.session_factory() as session:
+                    await ReadState.upsert_many(session, [(u, c, m) for (u, c), m in batch])
+                    await session.commit()
+            except Exception:
+                for (user_id, channel_id), message_id in pending[start:]:
+                    self.ack(user_id, channel_id, message_id)
+                raise
+
+            if self.publish is not None:
+                # other sessions of the user catch up on what they read, once per flush
+                await asyncio.gather(
+                    *(
+                        self.publish(u, 'MESSAGE_ACK', {'channel_id': str(c), 'message_id': str(m)})
+                        for (u, c), m in batch
+                    ),
+                    return_exceptions=True,
+                )
+
+        return len(pending)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+
+            try:
+                await self.flush()
+            except Exception:
+                log.exception('failed to flush acks, %d left pending', self.pending)
+
+    async def drain(self) -> None:
+        """
+        Flush what's left, for shutting down.
+        """
+        if self._pending:
+            log.info('draining %d acks', self.pending)
+            await self.flush()
@@ -0,0 +1,148 @@
+"""
+Copyright (C) 2021-2023 Derailed.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU Affero General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Affero General Public License for more details.
+
+You should have received a copy of the GNU Affero General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .identification import IDMedium, medium
+from .models.channel import Channel, Mention, Message
+from .models.guild import Guild
+
+__all__ = ['Purger']
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '1000'))
+PAUSE_MS = float(os.getenv('RETENTION_PAUSE_MS', '100'))
+# the most messages purged per second, however quickly the database keeps up
+MAX_RATE = float(os.getenv('RETENTION_MAX_RATE', '5000'))
+INTERVAL = float(os.getenv('RETENTION_INTERVAL', '3600'))
+
+
+class Purger:
+    """
+    Deletes messages older than their channel's, or else their guild's, `retention_days`.
+
+    Message ids start with the time they were made at, so everything older than the cutoff is a
+    range of ids, deleted oldest first through `ix_messages_channel_id_id` without a timestamp index.
+    """
+
+    def __init__(
+        self,
+        session_factory: async_sessionmaker,
+        ids: IDMedium = medium,
+        batch_size: int = BATCH_SIZE,
+        pause: float = PAUSE_MS / 1000,
+        max_rate: float = MAX_RATE,
+        interval: float = INTERVAL,
+    ) -> None:
+        self.session_factory = session_factory
+        self.ids = ids
+        self.batch_size = batch_size
+        self.pause = pause
+        self.max_rate = max_rate
+        self.interval = interval
+
+    async def policies(self) -> list[tuple[int, int]]:
+        """
+        `(channel_id, retention_days)` of every channel with a policy.
+        """
+        days = func.coalesce(Channel.retention_days, Guild.retention_days)
+        stmt = (
+            select(Channel.id, days)
+            .outerjoin(Guild, Guild.id == Channel.guild_id)
+            .where(days.is_not(None))
+            .where(Channel.message_deletor_job_id.is_(None))
+        )
+
+        async with self.session_factory() as session:
+            return (await session.execute(stmt)).all()
+
+    async def purge(self, channel_id: int, before: int) -> int:
+        """
+        Delete a channel's messages with ids below `before`, one batch per transaction.
+        """
+        purged = 0
+
+        while True:
+            async with self.session_factory() as session:
+                # the channel may not keep pointing at a message about to be purged
+                await session.execute(
+                    update(Channel)
+                    .where(Channel.id == channel_id)
+                    .where(Channel.last_message_id < before)
+                    .values(last_message_id=None)
+                    .execution_options(synchronize_session=False)
+                )
+
+                oldest = (
+                    select(Message.id)
+                    .where(Message.channel_id == channel_id)
+                    .where(Message.id < before)
+                    .order_by(Message.id)
+                    .limit(self.batch_size)
+                )
+                await session.execute(
+                    delete(Mention).where(Mention.id.in_(oldest)).execution_options(synchronize_session=False)
+                )
+                result = await session.execute(
+                    delete(Message).where(Message.id.in_(oldest)).execution_options(synchronize_session=False)
+                )
+                await session.commit()
+
+            done = result.rowcount
+            purged += done
+
+            if done < self.batch_size:
+                return purged
+
+            await asyncio.sleep(max(self.pause, done / self.max_rate))
+
+    async def sweep(self) -> int:
+        now = datetime.now(timezone.utc)
+        purged = 0
+
+        for channel_id, days in await self.policies():
+            try:
+                purged += await self.purge(channel_id, self.ids.at(now - timedelta(days=days)))
+            except Exception:
+                log.exception('failed to purge messages of channel %d', channel_id)
+
+        if purged:
+            log.info('purged %d messages past their retention', purged)
+
+        return purged
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                log.exception('retention sweep failed')
+
+            await asyncio.sleep(self.interval)
+
+
+if __name__ == '__main__':
+    from .database import AsyncSessionFactory
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(Purger(AsyncSessionFactory).run())
@@ -14,22 +14,32 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi import APIRouter, Body, Depends, HTTPException, Request
 from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ...database import to_dict, uses_db
+from ...database import uses_db
+from ...deletion import schedule
 from ...identification import medium, version
 from ...models.channel import Channel, ChannelType
+from ...models.guild import Guild
+from ...models.job import JobKind
 from ...models.user import User
 from ...permissions import GuildPermissions
 from ...powerbase import (
     CHANNEL_REGEX,
+    ORDERING,
+    deletor,
     prepare_category_position,
+    prepare_channel_dict,
     prepare_channel_position,
+    prepare_channel_rank,
+    prepare_channels,
     prepare_guild_channel,
+    prepare_max_positions,
     prepare_membership,
     prepare_permissions,
+    prepare_rank_moves,
     publish_to_guild,
     uses_auth,
 )
@@ -52,7 +62,10 @@ async def get_channel(
 
     prepare_permissions(member, guild, [GuildPermissions.VIEW_CHANNEL.value])
 
-    return channel
+    if ORDERING == 'rank':
+        return prepare_channel_dict(channel, await channel.ordinal(session))
+
+    return prepare_channel_dict(channel)
 
 
 @version('/guilds/{guild_id}/channels', 1, router, 'GET')
@@ -64,7 +77,7 @@ async def get_channels(
     # TODO: check permissions
     channels = await Channel.get_all(session, guild.id)
 
-    return to_dict(channels)
+    return prepare_channels(channels)
 
 
 class CreateChannel(BaseModel):
@@ -86,6 +99,14 @@ async def create_channel(
 
     prepare_permissions(member, guild, [GuildPermissions.CREATE_CHANNELS.value])
 
+    # held until commit, so concurrent creates can't interleave their shifts, inserts and counters
+    guild = await Guild.lock(session, guild.id)
+
+    if guild.channel_count >= 500:
+        raise HTTPException(400, 'Max channel count already reached')
+
+    parent: Channel | None = None
+
     if data.parent_id:
         parent = await Channel.get(session, data.parent_id, guild_id)
 
@@ -93,49 +114,59 @@ async def create_channel(
             raise HTTPException(400, 'Parent channel does not exist')
 
         if parent.type != ChannelType.CATEGORY or data.type == ChannelType.CATEGORY:
-            raise HTTPException('Parent is not of right type, or child is not of right type')
-
-    channel_count = await Channel.count(session, guild.id)
+            raise HTTPException(400, 'Parent is not of right type, or child is not of right type')
 
-    if channel_count == 500:
-        raise HTTPException(400, 'Max channel count already reached')
+    parent_id = parent.id if parent else None
+    siblings = parent or guild
+    rank: str | None = None
 
-    if data.type == 0:
-        highest_channel = await Channel.highest(session, guild_id)
+    if ORDERING == 'rank':
+        position, rank = await prepare_channel_rank(session, guild, parent_id, data.position)
     else:
-        highest_channel = await Channel.highest(session, guild_id, category=data.parent_id)
+        highest = siblings.max_position
 
-    if (highest_channel.position + 1) < data.position and position is not None:
-        raise HTTPException(400, 'Channel position too high')
-    else:
-        position = (highest_channel.position + 1) if data.position is UNDEFINED else data.position
+        if data.position is UNDEFINED:
+            position = highest + 1
+        elif data.position > highest + 1:
+            raise HTTPException(400, 'Channel position too high')
+        else:
+            position = data.position
 
-    if data.type == 0:
-        await prepare_category_position(session, position, guild)
-    else:
-        await prepare_channel_position(session, position, data.parent_id, guild)
+        if data.type == ChannelType.CATEGORY:
+            await prepare_category_position(session, position, guild)
+        else:
+            await prepare_channel_position(session, position, parent_id, guild)
 
     channel = Channel(
         id=medium.snowflake(),
         type=data.type,
-        parent_id=parent.id,
+        parent_id=parent_id,
         name=data.name,
         guild_id=guild_id,
+        position=position,
+        rank=rank,
         last_message_id=None,
     )
 
+    guild.channel_count += 1
+    siblings.max_position += 1
+
     session.add(channel)
     await session.commit()
 
-    await publish_to_guild(guild_id, 'CHANNEL_CREATE', to_dict(channel))
+    channel_dict = prepare_channel_dict(channel)
 
-    return channel
+    await publish_to_guild(guild_id, 'CHANNEL_CREATE', channel_dict)
+
+    return channel_dict
 
 
 class ModifyChannel(BaseModel):
     name: str | Undefined = Field(UNDEFINED, regex=CHANNEL_REGEX)
     position: int | Undefined = Field(UNDEFINED, gt=0, lt=500)
     parent_id: int | Undefined = Field(UNDEFINED)
+    # null falls back to the guild's policy
+    retention_days: int | None | Undefined = Field(UNDEFINED, gt=0, le=3650)
 
 
 @version('/guilds/{guild_id}/channels/{channel_id}', 1, router, 'PATCH')
@@ -158,38 +189,157 @@ async def modify_channel(
     if data.name:
         mods['name'] = data.name
 
+    if data.retention_days is not UNDEFINED:
+        mods['retention_days'] = data.retention_days
+
     if data.parent_id or data.position:
-        if channel.type == ChannelType.CATEGORY:
-            highest_channel = await Channel.highest(session, guild_id)
-        else:
-            highest_channel = await Channel.highest(session, guild_id, category=data.parent_id)
+        guild = await Guild.lock(session, guild.id)
+        # the channel was read before the lock, and may have moved since
+        await session.refresh(channel)
 
-    if data.parent_id:
-        parent = await Channel.get(session, data.parent_id, guild.id)
+        old_parent = await Channel.get(session, channel.parent_id) if channel.parent_id else None
+        parent = old_parent
 
-        if parent is None or parent.type != ChannelType.CATEGORY or data.type == ChannelType.CATEGORY:
-            raise HTTPException(400, 'Parent is not of right type, or child is not of right type')
+        if data.parent_id:
+            parent = await Channel.get(session, data.parent_id, guild.id)
 
-        await prepare_channel_position(session, highest_channel['position'] + 1, data.parent_id, guild)
-        mods['parent_id'] = data.parent_id
+            if parent is None or parent.type != ChannelType.CATEGORY or channel.type == ChannelType.CATEGORY:
+                raise HTTPException(400, 'Parent is not of right type, or child is not of right type')
 
-    if position:
-        if (highest_channel.position + 1) < data.position and position is not None:
-            raise HTTPException(400, 'Channel position too high')
-        else:
-            position = (highest_channel.position + 1) if data.position is UNDEFINED else data.position
+            mods['parent_id'] = parent.id
 
-        if data.type == 0:
-            await prepare_category_position(session, position, guild)
+        parent_id = parent.id if parent else None
+        old_siblings, siblings = old_parent or guild, parent or guild
+
+        if ORDERING == 'rank':
+            position, mods['rank'] = await prepare_channel_rank(
+                session, guild, parent_id, data.position, channel_id=channel.id
+            )
         else:
-            await prepare_channel_position(session, position, data.parent_id, guild)
+            if channel.position is not None:
+                # close the gap left behind, keeping positions dense
+                await Channel.shift(session, guild.id, channel.parent_id, channel.position + 1, by=-1)
+
+            highest = siblings.max_position - (1 if siblings is old_siblings else 0)
+
+            if data.position is UNDEFINED:
+                position = highest + 1
+            elif data.position > highest + 1:
+                raise HTTPException(400, 'Channel position too high')
+            else:
+                position = data.position
+
+            if channel.type == ChannelType.CATEGORY:
+                await prepare_category_position(session, position, guild)
+            else:
+                await prepare_channel_position(session, position, parent_id, guild)
+
+        if siblings is not old_siblings:
+            old_siblings.max_position -= 1
+            siblings.max_position += 1
+
         mods['position'] = position
 
-    await channel.modify(session, **mods)
+    if mods:
+        await channel.modify(session, **mods)
+        await session.commit()
+
+    if ORDERING == 'rank' and 'position' not in mods:
+        channel_dict = prepare_channel_dict(channel, await channel.ordinal(session))
+    else:
+        channel_dict = prepare_channel_dict(channel)
+
+    await publish_to_guild(guild.id, 'CHANNEL_UPDATE', channel_dict)
+
+    return channel_dict
 
-    await publish_to_guild(guild.id, 'CHANNEL_UPDATE', to_dict(channel))
 
-    return to_dict(channel)
+class ChannelPosition(BaseModel):
+    id: int
+    position: int = Field(gt=0, lt=500)
+    parent_id: int | None | Undefined = Field(UNDEFINED)
+
+
+@version('/guilds/{guild_id}/channels', 1, router, 'PATCH')
+async def modify_channel_positions(
+    request: Request,
+    guild_id: int,
+    data: list[ChannelPosition] = Body(min_items=1, max_items=500),
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
+) -> None:
+    guild, member = await prepare_membership(guild_id, user, session)
+
+    prepare_permissions(member, guild, [GuildPermissions.MODIFY_CHANNELS.value])
+
+    guild = await Guild.lock(session, guild.id)
+
+    channels = {channel.id: channel for channel in await Channel.get_all(session, guild.id)}
+    moves: dict[int, tuple[int, int | None]] = {}
+
+    for move in data:
+        channel = channels.get(move.id)
+
+        if channel is None:
+            raise HTTPException(400, f'Channel {move.id} does not exist')
+
+        if move.id in moves:
+            raise HTTPException(400, f'Channel {move.id} was given more than once')
+
+        parent_id = channel.parent_id if move.parent_id is UNDEFINED else move.parent_id
+
+        if parent_id is not None:
+            parent = channels.get(parent_id)
+
+            if parent is None or parent.type != ChannelType.CATEGORY or channel.type == ChannelType.CATEGORY:
+                raise HTTPException(400, 'Parent is not of right type, or child is not of right type')
+
+        moves[move.id] = (move.position, parent_id)
+
+    # validate the resulting tree once, rather than shuffling siblings for every move
+    taken: dict[tuple[int | None, int], list[int]] = {}
+
+    for channel in channels.values():
+        if channel.id in moves:
+            position, parent_id = moves[channel.id]
+        elif ORDERING == 'rank':
+            # moves are inserted in between their new siblings, so only clash with each other
+            continue
+        else:
+            position, parent_id = channel.position, channel.parent_id
+
+        taken.setdefault((parent_id, position), []).append(channel.id)
+
+    for (_, position), ids in taken.items():
+        if len(ids) > 1 and any(cid in moves for cid in ids):
+            raise HTTPException(400, f'Position {position} would be taken twice')
+
+    if ORDERING == 'rank':
+        rows = prepare_rank_moves(channels, moves)
+    else:
+        rows = [(cid, position, parent_id, None) for cid, (position, parent_id) in moves.items()]
+
+    await Channel.reposition(session, rows)
+    prepare_max_positions(guild, channels, moves)
+    await session.commit()
+
+    for cid, position, parent_id, rank in rows:
+        channels[cid].position = position
+        channels[cid].parent_id = parent_id
+        channels[cid].rank = rank
+
+    channel_dicts = prepare_channels(list(channels.values()))
+    updated = [
+        {'id': d['id'], 'position': d['position'], 'parent_id': d['parent_id']}
+        for d in channel_dicts
+        if int(d['id']) in moves
+    ]
+
+    await publish_to_guild(
+        guild.id, 'CHANNEL_POSITIONS_UPDATE', {'guild_id': str(guild.id), 'channels': updated}
+    )
+
+    return channel_dicts
 
 
 @version('/guilds/{guild_id}/channels/{channel_id}', 1, router, 'DELETE', status_code=204)
@@ -204,9 +354,29 @@ async def delete_channel(
 
     prepare_permissions(member, guild, [GuildPermissions.MODIFY_CHANNELS.value])
 
+    guild = await Guild.lock(session, guild.id)
     channel = await prepare_guild_channel(session, channel_id, guild)
 
-    await channel.delete(session)
+    if channel.type == ChannelType.CATEGORY and channel.max_position > 0:
+        raise HTTPException(400, 'Category still has channels')
+
+    parent_id, position = channel.parent_id, channel.position
+    parent = await Channel.get(session, parent_id) if parent_id else None
+
+    # gone from the guild right away, its messages are deleted in the background
+    job = schedule(session, JobKind.CHANNEL, channel.id)
+    await channel.modify(
+        session, guild_id=None, parent_id=None, position=None, rank=None, message_deletor_job_id=str(job.id)
+    )
+
+    if ORDERING != 'rank' and position is not None:
+        await Channel.shift(session, guild.id, parent_id, position + 1, by=-1)
+
+    guild.channel_count -= 1
+    (parent or guild).max_position -= 1
+
+    await session.commit()
+    deletor.wake()
 
     await publish_to_guild(guild.id, 'CHANNEL_DELETE', {'channel_id': channel.id, 'guild_id': guild.id})
 
@@ -14,35 +14,48 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import time
+import zlib
 from datetime import datetime
+from typing import AsyncIterator
 
+import msgspec
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ...database import to_dict, uses_db
+from ...database import AsyncSessionFactory, to_dict, uses_db
 from ...identification import medium, version
-from ...models.channel import Message
+from ...models.channel import Channel, ChannelMember, Mention, Message
 from ...models.user import User
 from ...permissions import GuildPermissions
 from ...powerbase import (
     abort_forb,
+    acks,
     prepare_channel,
     prepare_membership,
+    prepare_mentions,
     prepare_permissions,
     publish_to_guild,
+    typing,
     uses_auth,
 )
+from ...querywatch import budget
 from ...undefinable import UNDEFINED, Undefined
 
 router = APIRouter()
 
 
 @version('/channels/{channel_id}/messages', 1, router, 'GET')
+@budget(5)
 async def get_messages(
     channel_id: int,
     request: Request,
     limit: int = Query(50, gt=0, lt=100),
+    before: int | None = Query(None),
+    after: int | None = Query(None),
     session: AsyncSession = Depends(uses_db),
     user: User = Depends(uses_auth),
 ) -> None:
@@ -56,12 +69,167 @@ async def get_messages(
         if user not in channel.members:
             raise HTTPException(403, 'You are forbidden from this channel')
 
-    messages = await Message.sorted_channel(session, channel, limit)
+    messages = await Message.sorted_channel(session, channel, limit, before=before, after=after)
+
+    return to_dict(messages)
+
+
+class ExportedMessage(msgspec.Struct):
+    id: str
+    author_id: str
+    channel_id: str
+    content: str
+    timestamp: datetime
+    edited_timestamp: datetime | None
+
+
+EXPORT_FORMATS = {
+    'ndjson': (msgspec.json.Encoder(), b'\n', 'application/x-ndjson'),
+    'msgpack': (msgspec.msgpack.Encoder(), b'', 'application/x-msgpack'),
+}
+
+# rows fetched from the cursor, and encoded and sent, at a time
+EXPORT_CHUNK = 1000
+
+
+async def stream_export(channel_id: int, format: str, compress: bool) -> AsyncIterator[bytes]:
+    encoder, separator, _ = EXPORT_FORMATS[format]
+    # gzip framing, for a file readable by any gzip tool
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    stmt = (
+        select(
+            Message.id,
+            Message.author_id,
+            Message.channel_id,
+            Message.content,
+            Message.timestamp,
+            Message.edited_timestamp,
+        )
+        .where(Message.channel_id == channel_id)
+        .order_by(Message.id)
+        .execution_options(yield_per=EXPORT_CHUNK)
+    )
+
+    # its own session, as the stream outlives the request's handler
+    async with AsyncSessionFactory() as session:
+        result = await session.stream(stmt)
+
+        async for rows in result.partitions():
+            chunk = bytearray()
+
+            for id, author_id, cid, content, timestamp, edited_timestamp in rows:
+                message = ExportedMessage(
+                    str(id), str(author_id), str(cid), content, timestamp, edited_timestamp
+                )
+                encoder.encode_into(message, chunk, -1)
+                chunk.extend(separator)
+
+            # only fetching more once the client took this chunk in, keeps memory flat
+            yield compressor.compress(chunk) if compressor else bytes(chunk)
+
+    if compressor:
+        yield compressor.flush()
+
+
+@version('/channels/{channel_id}/messages/export', 1, router, 'GET')
+async def export_messages(
+    channel_id: int,
+    request: Request,
+    format: str = Query('ndjson', regex='^(ndjson|msgpack)$'),
+    gzip: bool = Query(False),
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
+) -> None:
+    channel = await prepare_channel(session, int(channel_id))
+
+    if channel.guild_id is not None:
+        guild, member = await prepare_membership(channel.guild_id, user, session)
+
+        prepare_permissions(member, guild, [GuildPermissions.VIEW_MESSAGE_HISTORY.value])
+    else:
+        if not await ChannelMember.has(session, channel.id, user.id):
+            raise HTTPException(403, 'You are forbidden from this channel')
+
+    filename = f'{channel.id}.{format}' + ('.gz' if gzip else '')
+
+    return StreamingResponse(
+        stream_export(channel.id, format, gzip),
+        media_type='application/gzip' if gzip else EXPORT_FORMATS[format][2],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+
+@version('/guilds/{guild_id}/messages/search', 1, router, 'GET')
+@budget(5)
+async def search_guild_messages(
+    guild_id: int,
+    request: Request,
+    content: str = Query(min_length=1, max_length=256),
+    channel_id: int | None = Query(None),
+    author_id: int | None = Query(None),
+    before: int | None = Query(None),
+    after: int | None = Query(None),
+    limit: int = Query(25, gt=0, le=100),
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
+) -> None:
+    guild, member = await prepare_membership(guild_id, user, session)
+
+    prepare_permissions(member, guild, [GuildPermissions.VIEW_MESSAGE_HISTORY.value])
+
+    messages = await Message.search(
+        session,
+        content,
+        user.id,
+        limit,
+        guild_id=guild.id,
+        channel_id=channel_id,
+        author_id=author_id,
+        before=before,
+        after=after,
+    )
+
+    return to_dict(messages)
+
+
+@version('/channels/{channel_id}/messages/search', 1, router, 'GET')
+@budget(5)
+async def search_channel_messages(
+    channel_id: int,
+    request: Request,
+    content: str = Query(min_length=1, max_length=256),
+    author_id: int | None = Query(None),
+    before: int | None = Query(None),
+    after: int | None = Query(None),
+    limit: int = Query(25, gt=0, le=100),
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
+) -> None:
+    channel = await prepare_channel(session, channel_id)
+
+    if channel.guild_id is not None:
+        guild, member = await prepare_membership(channel.guild_id, user, session)
+
+        prepare_permissions(member, guild, [GuildPermissions.VIEW_MESSAGE_HISTORY.value])
+
+    # direct messages are narrowed to those the user is in by the query itself
+    messages = await Message.search(
+        session,
+        content,
+        user.id,
+        limit,
+        guild_id=channel.guild_id,
+        channel_id=channel.id,
+        author_id=author_id,
+        before=before,
+        after=after,
+    )
 
     return to_dict(messages)
 
 
 @version('/channels/{channel_id}/messages/{message_id}', 1, router, 'GET')
+@budget(5)
 async def get_message(
     channel_id: int,
     request: Request,
@@ -120,6 +288,8 @@ async def create_message(
     )
 
     session.add(message)
+    users, roles = prepare_mentions(message.content)
+    await Mention.record(session, message, channel.guild_id, users, roles)
     await session.commit()
 
     channel.last_message_id = message.id
@@ -159,6 +329,9 @@ async def edit_message(
     message.content = data.content
 
     session.add(message)
+    users, roles = prepare_mentions(message.content)
+    previous = await Mention.targets(session, message.id)
+    await Mention.record(session, message, channel.guild_id, users, roles, previous)
     await session.commit()
 
     if channel.guild_id is not None:
@@ -201,3 +374,97 @@ async def delete_message(
         )
 
     return ''
+
+
+@version('/channels/{channel_id}/messages/{message_id}/ack', 1, router, 'POST', status_code=204)
+async def ack_message(
+    channel_id: int,
+    message_id: int,
+    request: Request,
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
+) -> None:
+    channel = await prepare_channel(session, channel_id)
+
+    if channel.guild_id is not None:
+        await prepare_membership(channel.guild_id, user, session)
+    else:
+        if not await ChannelMember.has(session, channel.id, user.id):
+            raise HTTPException(403, 'You are forbidden from this channel')
+
+    # nothing can be read past the newest message, which also spares looking the message up
+    if channel.last_message_id is not None:
+        acks.ack(user.id, channel.id, min(message_id, channel.last_message_id))
+
+    return ''
+
+
+@version('/channels/{channel_id}/typing', 1, router, 'POST', status_code=204)
+@budget(2)
+async def start_typing(
+    channel_id: int,
+    request: Request,
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
+) -> None:
+    # still typing, since announced moments ago. authenticating is all this costs
+    if typing.announced(user.id, channel_id):
+        return ''
+
+    guild_id = await Channel.member_guild(session, channel_id, user.id)
+
+    if guild_id is None:
+        raise HTTPException(404, 'Channel not found')
+
+    typing.announce(user.id, channel_id)
+    await publish_to_guild(
+        guild_id,
+        'TYPING_START',
+        {
+            'user_id': str(user.id),
+            'channel_id': str(channel_id),
+            'guild_id': str(guild_id),
+            'timestamp': int(time.time()),
+        },
+    )
+
+    return ''
+
+
+class BulkDeleteMessages(BaseModel):
+    messages: list[int] = Field(min_items=2, max_items=100)
+
+
+@version('/channels/{channel_id}/messages/bulk-delete', 1, router, 'POST', status_code=204)
+async def bulk_delete_messages(
+    data: BulkDeleteMessages,
+    channel_id: int,
+    request: Request,
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
+) -> None:
+    channel = await prepare_channel(session, channel_id)
+
+    if channel.guild_id is None:
+        raise HTTPException(400, 'Messages can only be bulk deleted in guild channels')
+
+    guild, member = await prepare_membership(channel.guild_id, user, session)
+
+    # once for every message, whoever wrote them
+    prepare_permissions(member, guild, [GuildPermissions.MODIFY_MESSAGES.value])
+
+    deleted = await Message.delete_many(session, channel.id, list(set(data.messages)))
+    await session.commit()
+
+    if deleted:
+        await publish_to_guild(
+            channel.guild_id,
+            'MESSAGE_DELETE_BULK',
+            {
+                'ids': [str(message_id) for message_id in deleted],
+                'guild_id': str(channel.guild_id),
+                'channel_id': str(channel.id),
+            },
+        )
+
+    return ''
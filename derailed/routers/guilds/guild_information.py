@@ -15,15 +15,27 @@ You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 from time import time
+from typing import AsyncIterator
 
-from fastapi import APIRouter, Depends, Request
+import msgspec
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ...database import to_dict, uses_db
+from ...database import AsyncSessionFactory, uses_db
 from ...identification import version
 from ...models.guild import Guild
 from ...models.member import Member
-from ...powerbase import get_guild_info, prepare_guild, prepare_membership
+from ...models.user import User
+from ...powerbase import (
+    get_guild_info,
+    prepare_guild,
+    prepare_guild_dict,
+    prepare_member,
+    prepare_membership,
+    uses_auth,
+)
+from ...querywatch import budget
 
 router = APIRouter()
 
@@ -36,8 +48,9 @@ async def get_guild_preview(
 
     guild_info = await get_guild_info(str(guild_id))
 
-    gid = to_dict(guild)
+    gid = prepare_guild_dict(guild)
     gid['approximate_presence_count'] = guild_info.presences
+    gid['approximate_member_count'] = guild.member_count
     gid['available'] = guild_info.available
 
     return gid
@@ -45,4 +58,64 @@ async def get_guild_preview(
 
 @version('/guilds/{guild_id}', 1, router, 'GET')
 async def get_guild(request: Request, md: tuple[Guild, Member] = Depends(prepare_membership)) -> None:
-    return to_dict(md[0])
+    return prepare_guild_dict(md[0])
+
+
+@version('/guilds/{guild_id}/members', 1, router, 'GET')
+@budget(4)
+async def get_members(
+    guild_id: int,
+    request: Request,
+    after: int = Query(0, ge=0),
+    limit: int = Query(100, gt=0, le=1000),
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
+) -> None:
+    guild, _ = await prepare_membership(guild_id, user, session)
+
+    rows = await Member.page(session, guild.id, after, limit)
+
+    return [prepare_member(row) for row in rows]
+
+
+MEMBER_ENCODER = msgspec.json.Encoder()
+
+# members fetched, and encoded and sent, at a time
+MEMBER_CHUNK = 1000
+
+
+async def stream_members(guild_id: int) -> AsyncIterator[bytes]:
+    after = 0
+
+    while True:
+        # a session per chunk, so slow readers hold neither a connection nor a snapshot open
+        async with AsyncSessionFactory() as session:
+            rows = await Member.page(session, guild_id, after, MEMBER_CHUNK)
+
+        if not rows:
+            return
+
+        chunk = bytearray()
+
+        for row in rows:
+            MEMBER_ENCODER.encode_into(prepare_member(row), chunk, -1)
+            chunk.extend(b'\n')
+
+        yield bytes(chunk)
+
+        if len(rows) < MEMBER_CHUNK:
+            return
+
+        after = rows[-1].id
+
+
+@version('/guilds/{guild_id}/members/stream', 1, router, 'GET')
+async def stream_guild_members(
+    guild_id: int,
+    request: Request,
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
+) -> StreamingResponse:
+    guild, _ = await prepare_membership(guild_id, user, session)
+
+    return StreamingResponse(stream_members(guild.id), media_type='application/x-ndjson')
@@ -14,17 +14,24 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel, Field
+from sqlalchemy import insert
 
 from ...database import AsyncSession, to_dict, uses_db
+from ...deletion import schedule
 from ...identification import medium, version
-from ...models.guild import Guild
-from ...models.member import Member
+from ...models.channel import Channel
+from ...models.guild import Guild, GuildTemplate
+from ...models.job import JobKind
+from ...models.member import Member, Role
 from ...models.user import User
 from ...permissions import DEFAULT_PERMISSIONS, GuildPermissions
 from ...powerbase import (
+    abort_forb,
+    deletor,
     prepare_default_channels,
+    prepare_guild_dict,
     prepare_membership,
     prepare_permissions,
     publish_to_guild,
@@ -53,43 +60,150 @@ async def create_guild(
         owner_id=user.id,
         flags=0,
         permissions=DEFAULT_PERMISSIONS,
+        channel_count=0,
+        member_count=1,
+        max_position=0,
     )
-    session.add(guild)
     member = Member(user_id=user.id, guild_id=guild.id, nick=None)
-    session.add(member)
+    session.add_all([guild, member])
 
+    # a single transaction, so a guild is never seen without its channels
+    await session.execute(insert(Channel), prepare_default_channels(guild))
     await session.commit()
 
-    prepare_default_channels(guild, session)
+    await publish_to_user(user_id=user.id, event='GUILD_CREATE', data=prepare_guild_dict(guild))
+
+    return prepare_guild_dict(guild)
+
+
+class CreateTemplate(BaseModel):
+    name: str = Field(min_length=1, max_length=32)
+
+
+@version('/guilds/{guild_id}/templates', 1, router, 'POST', status_code=201)
+async def create_guild_template(
+    request: Request,
+    guild_id: int,
+    data: CreateTemplate,
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
+) -> None:
+    guild, member = await prepare_membership(guild_id, user, session)
+
+    prepare_permissions(member, guild, [GuildPermissions.MODIFY_GUILD.value])
+
+    template = GuildTemplate(code=medium.invite(), name=data.name, guild_id=guild.id, creator_id=user.id)
+    session.add(template)
 
     await session.commit()
 
-    await publish_to_user(user_id=user.id, event='GUILD_CREATE', data=to_dict(guild))
+    return to_dict(template)
 
-    return to_dict(guild)
+
+@version('/guilds/templates/{code}', 1, router, 'POST', status_code=201)
+async def create_guild_from_template(
+    request: Request,
+    code: str,
+    data: CreateGuild,
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
+) -> None:
+    template = await GuildTemplate.get(session, code)
+
+    if template is None:
+        raise HTTPException(404, 'Template not found')
+
+    # the source's channel tree can't change while it's copied
+    source = await Guild.lock(session, template.guild_id)
+
+    # its guild is gone, or on its way out
+    if source is None or source.deletor_job_id is not None:
+        raise HTTPException(404, 'Template not found')
+
+    channel_ids = await Channel.ids(session, source.id)
+    role_ids = await Role.ids(session, source.id)
+
+    # every id up front, so the copies are made in a fixed number of statements however large
+    ids = medium.take(1 + len(channel_ids) + len(role_ids))
+    new_channel_ids, new_role_ids = ids[1 : len(channel_ids) + 1], ids[len(channel_ids) + 1 :]
+
+    guild = Guild(
+        id=ids[0],
+        name=data.name,
+        owner_id=user.id,
+        flags=0,
+        permissions=source.permissions,
+        channel_count=len(channel_ids),
+        member_count=1,
+        max_position=source.max_position,
+    )
+    member = Member(user_id=user.id, guild_id=guild.id, nick=None)
+    session.add_all([guild, member])
+
+    await Channel.clone(session, guild.id, list(zip(channel_ids, new_channel_ids)))
+    await Role.clone(session, guild.id, list(zip(role_ids, new_role_ids)))
+    await session.commit()
+
+    await publish_to_user(user_id=user.id, event='GUILD_CREATE', data=prepare_guild_dict(guild))
+
+    return prepare_guild_dict(guild)
 
 
 class ModifyGuild(BaseModel):
     name: str | Undefined = Field(UNDEFINED, min_length=1, max_length=30)
+    # messages older than this are purged, null keeping them forever
+    retention_days: int | None | Undefined = Field(UNDEFINED, gt=0, le=3650)
 
 
 @version('/guilds/{guild_id}', 1, router, 'PATCH')
 async def modify_guild(
-    request: Request, guild_id: int, data: CreateGuild, session: AsyncSession = Depends(uses_db)
+    request: Request,
+    guild_id: int,
+    data: ModifyGuild,
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
 ) -> None:
-    guild, member = await prepare_membership(guild_id)
+    guild, member = await prepare_membership(guild_id, user, session)
+
+    if not data.name and data.retention_days is UNDEFINED:
+        return prepare_guild_dict(guild)
 
-    if not data.name:
-        return to_dict(guild)
+    prepare_permissions(member, guild, [GuildPermissions.MODIFY_GUILD.value])
 
-    await prepare_permissions(member, guild, [GuildPermissions.MODIFY_GUILD])
+    if data.name:
+        guild.name = data.name
 
-    guild.name = data.name
+    if data.retention_days is not UNDEFINED:
+        guild.retention_days = data.retention_days
 
     session.add(guild)
 
     await session.commit()
 
-    await publish_to_guild(guild.id, 'GUILD_UPDATE', to_dict(guild))
+    await publish_to_guild(guild.id, 'GUILD_UPDATE', prepare_guild_dict(guild))
+
+    return prepare_guild_dict(guild)
+
+
+@version('/guilds/{guild_id}', 1, router, 'DELETE', status_code=204)
+async def delete_guild(
+    request: Request,
+    guild_id: int,
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
+) -> None:
+    guild, _ = await prepare_membership(guild_id, user, session)
+
+    if guild.owner_id != user.id:
+        abort_forb()
+
+    # hidden right away, its channels, messages and members are deleted in the background
+    job = schedule(session, JobKind.GUILD, guild.id)
+    guild.deletor_job_id = job.id
+
+    await session.commit()
+    deletor.wake()
+
+    await publish_to_guild(guild.id, 'GUILD_DELETE', {'guild_id': str(guild.id)})
 
-    return to_dict(guild)
+    return ''
@@ -14,25 +14,41 @@ GNU Affero General Public License for more details.
 You should have received a copy of the GNU Affero General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import asyncio
 from random import randint
+from typing import Any, AsyncIterator, Awaitable, Callable, TypeVar
 
+import msgspec
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
-from fastapi import APIRouter, Depends, HTTPException, Request, exceptions
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, exceptions
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, EmailStr, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..database import to_dict, uses_db
+from ..database import AsyncSessionFactory, to_dict, uses_db
+from ..deletion import schedule
 from ..identification import medium, version
-from ..models import Settings, User
+from ..models import Guild, Settings, User
+from ..models.channel import Channel, Mention, UnreadMention
+from ..models.job import JobKind
+from ..models.member import Member, Role
 from ..models.user import DefaultStatus
+from ..permissions import GuildPermission, guild_permissions, unwrap_guild_permissions
 from ..powerbase import (
     abort_auth,
     create_token,
+    deletor,
+    get_guilds_info,
+    prepare_channels,
+    prepare_guild_dict,
     prepare_user,
+    presences,
     publish_to_user,
     uses_auth,
 )
+from ..presence import presence_event
+from ..querywatch import budget
 from ..undefinable import UNDEFINED, Undefined
 
 router = APIRouter()
@@ -155,6 +171,179 @@ async def get_me(request: Request, user: User = Depends(uses_auth)) -> None:
     return prepare_user(user, True)
 
 
+T = TypeVar('T')
+
+BOOTSTRAP_ENCODER = msgspec.json.Encoder()
+# guilds encoded and sent at a time
+BOOTSTRAP_CHUNK = 50
+
+
+async def _query(fetch: Callable[..., Awaitable[T]], *args: Any) -> T:
+    # a session each, as one session can't run statements concurrently
+    async with AsyncSessionFactory() as session:
+        return await fetch(session, *args)
+
+
+async def stream_bootstrap(head: dict[str, Any], guilds: list[dict[str, Any]]) -> AsyncIterator[bytes]:
+    # `head` with `guilds` as its last key, encoded a few guilds at a time
+    chunk = bytearray(BOOTSTRAP_ENCODER.encode(head)[:-1])
+    chunk.extend(b',"guilds":[')
+
+    for i, guild in enumerate(guilds):
+        if i:
+            chunk.extend(b',')
+
+        BOOTSTRAP_ENCODER.encode_into(guild, chunk, -1)
+
+        if (i + 1) % BOOTSTRAP_CHUNK == 0:
+            yield bytes(chunk)
+            chunk.clear()
+
+    chunk.extend(b']}')
+    yield bytes(chunk)
+
+
+@version('/users/@me/bootstrap', 1, router, 'GET')
+@budget(5)
+async def bootstrap(request: Request, user: User = Depends(uses_auth)) -> StreamingResponse:
+    settings, guilds, channels, roles = await asyncio.gather(
+        _query(Settings.get, user),
+        _query(Member.guilds, user.id),
+        _query(Channel.for_user, user.id),
+        _query(Role.permissions_for, user.id),
+    )
+
+    by_guild: dict[int, list[Channel]] = {}
+    granted: dict[int, list[GuildPermission]] = {}
+
+    for channel in channels:
+        by_guild.setdefault(channel.guild_id, []).append(channel)
+
+    for guild_id, allow, deny, position in roles:
+        role = unwrap_guild_permissions(allow=allow, deny=deny, pos=position)
+        granted.setdefault(guild_id, []).append(role)
+
+    payload = []
+
+    for guild, position in guilds:
+        data = prepare_guild_dict(guild)
+        data['position'] = position
+        owner = guild.owner_id == user.id
+        data['effective_permissions'] = guild_permissions(granted.get(guild.id, []), owner)
+        data['channels'] = prepare_channels(by_guild.get(guild.id, []))
+        payload.append(data)
+
+    head = {'user': prepare_user(user, True), 'settings': to_dict(settings) if settings else None}
+
+    return StreamingResponse(stream_bootstrap(head, payload), media_type='application/json')
+
+
+@version('/users/@me/guilds', 1, router, 'GET')
+@budget(2)
+async def get_my_guilds(
+    request: Request,
+    with_counts: bool = Query(False),
+    session: AsyncSession = Depends(uses_db),
+    user: User = Depends(uses_auth),
+) -> None:
+    guilds = await Member.guilds(session, user.id)
+    infos = await get_guilds_info([guild.id for guild, _ in guilds]) if with_counts and guilds else {}
+
+    result = []
+
+    for guild, position in guilds:
+        data = prepare_guild_dict(guild)
+        data['position'] = position
+
+        if with_counts:
+            info = infos.get(guild.id)
+            data['approximate_member_count'] = guild.member_count
+            data['approximate_presence_count'] = info.presences if info else 0
+            data['available'] = info.available if info else False
+
+        result.append(data)
+
+    return result
+
+
+@version('/users/@me/mentions', 1, router, 'GET')
+async def get_mentions(
+    request: Request,
+    limit: int = Query(25, gt=0, le=100),
+    before: int | None = Query(None),
+    user: User = Depends(uses_auth),
+    session: AsyncSession = Depends(uses_db),
+) -> None:
+    messages = await Mention.for_user(session, user.id, limit, before)
+
+    return to_dict(messages)
+
+
+@version('/users/@me/mentions/unread', 1, router, 'GET')
+async def get_unread_mentions(
+    request: Request, user: User = Depends(uses_auth), session: AsyncSession = Depends(uses_db)
+) -> None:
+    unread = await UnreadMention.get_all(session, user.id)
+
+    return [{'channel_id': str(u.channel_id), 'count': u.count} for u in unread]
+
+
+class CustomActivity(BaseModel):
+    content: str = Field(min_length=1, max_length=15)
+
+
+class PatchPresence(BaseModel):
+    status: DefaultStatus | Undefined = Field(UNDEFINED)
+    activity: CustomActivity | None | Undefined = Field(UNDEFINED)
+
+
+@version('/users/@me/presence', 1, router, 'PATCH', status_code=202)
+async def patch_presence(request: Request, data: PatchPresence, user: User = Depends(uses_auth)) -> None:
+    changes = {}
+
+    if data.status is not UNDEFINED:
+        changes['status'] = data.status
+
+    if data.activity is not UNDEFINED:
+        changes['activity'] = data.activity.content if data.activity else None
+
+    if not changes:
+        raise HTTPException(400, 'Nothing to change')
+
+    # written, and published, with whatever else changes within the window
+    return presence_event(user.id, presences.set(user.id, **changes))
+
+
+class DeleteMe(BaseModel):
+    password: str
+
+
+@version('/users/@me', 1, router, 'DELETE', status_code=204)
+async def delete_me(
+    request: Request,
+    data: DeleteMe,
+    user: User = Depends(uses_auth),
+    session: AsyncSession = Depends(uses_db),
+) -> None:
+    try:
+        pw_hsh.verify(user.password, data.password)
+    except VerifyMismatchError:
+        raise HTTPException(401, 'Invalid password')
+
+    if await Guild.owns_any(session, user.id):
+        raise HTTPException(400, 'Delete or transfer your guilds first')
+
+    # locked out right away, everything they made is deleted in the background
+    job = schedule(session, JobKind.USER, user.id)
+    user.deletor_job_id = job.id
+
+    session.add(user)
+    await session.commit()
+    deletor.wake()
+
+    return ''
+
+
 class Login(BaseModel):
     email: EmailStr
     password: str
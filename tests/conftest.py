@@ -0,0 +1,120 @@
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Tuple
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.dialects.postgresql import asyncpg
+
+from benchmarks.stand_ins import FakeGateway, Postgres
+
+
+@pytest.fixture(scope='session')
+def app():
+    if not Postgres.available():
+        pytest.skip('Postgres is unavailable, install it or set BENCH_PG_URI')
+
+    with FakeGateway(), Postgres() as uri:
+        os.environ['PG_URI'] = uri
+
+        from derailed.app import app as curapp
+
+        yield curapp
+
+
+@pytest.fixture(scope='session')
+def client(app):
+    # the engine's connections belong to one loop, so share a single client
+    with TestClient(app) as client:
+        yield client
+
+
+class FakeSession:
+    async def commit(self):
+        pass
+
+
+@pytest.fixture
+def session_factory():
+    # for code writing behind, whose statements are stubbed out by each test
+    @asynccontextmanager
+    async def factory():
+        yield FakeSession()
+
+    return factory
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+    def scalars(self):
+        return FakeResult([row[0] if isinstance(row, tuple) else row for row in self.rows])
+
+    def scalar(self):
+        return self.scalars().rows[0] if self.rows else None
+
+
+class RecordingSession:
+    """
+    Compiles, as asyncpg would, every statement executed, answering with queued rows.
+    """
+
+    def __init__(self):
+        self.statements = []
+        self._results = []
+
+    def returning(self, *results):
+        self._results.extend(results)
+
+    async def execute(self, stmt, params=None):
+        self.statements.append(stmt.compile(dialect=asyncpg.dialect()))
+        return FakeResult(self._results.pop(0) if self._results else [])
+
+    async def scalar(self, stmt, params=None):
+        return (await self.execute(stmt, params)).scalar()
+
+    async def commit(self):
+        pass
+
+
+@pytest.fixture
+def recording_session():
+    return RecordingSession()
+
+
+# store history of failures per test class name and per index in parametrize (if parametrize used)
+_test_failed_incremental: Dict[str, Dict[Tuple[int, ...], str]] = {}
+
+
+def pytest_runtest_makereport(item, call):
+    if 'incremental' in item.keywords:
+        # incremental marker is used
+        if call.excinfo is not None:
+            # the test has failed
+            # retrieve the class name of the test
+            cls_name = str(item.cls)
+            # retrieve the index of the test (if parametrize is used in combination with incremental)
+            parametrize_index = tuple(item.callspec.indices.values()) if hasattr(item, 'callspec') else ()
+            # retrieve the name of the test function
+            test_name = item.originalname or item.name
+            # store in _test_failed_incremental the original name of the failed test
+            _test_failed_incremental.setdefault(cls_name, {}).setdefault(parametrize_index, test_name)
+
+
+def pytest_runtest_setup(item):
+    if 'incremental' in item.keywords:
+        # retrieve the class name of the test
+        cls_name = str(item.cls)
+        # check if a previous test has failed for this class
+        if cls_name in _test_failed_incremental:
+            # retrieve the index of the test (if parametrize is used in combination with incremental)
+            parametrize_index = tuple(item.callspec.indices.values()) if hasattr(item, 'callspec') else ()
+            # retrieve the name of the first test function to fail for this class name and index
+            test_name = _test_failed_incremental[cls_name].get(parametrize_index, None)
+            # if name found, test has failed for the combination of class name & test name
+            if test_name is not None:
+                pytest.xfail('previous test failed ({})'.format(test_name))
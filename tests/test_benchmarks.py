@@ -0,0 +1,73 @@
+import os
+
+import grpc
+
+from benchmarks.hdr import Histogram
+from benchmarks.scale import Distributions, Plan
+from benchmarks.stand_ins import FakeGateway
+from derailed.grpc import derailed_pb2_grpc
+from derailed.grpc.auth import auth_pb2_grpc
+from derailed.grpc.auth.auth_pb2 import CreateToken, ValidateToken
+from derailed.grpc.derailed_pb2 import Message, Publ
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+
+    for us in range(1, 10_001):
+        histogram.record(us / 1_000_000)
+
+    assert histogram.count == 10_000
+    assert histogram.percentile(50) == 5000
+    assert histogram.percentile(99) == 9900
+    assert histogram.max == 10_000
+    # bucketed to 3 significant figures
+    assert len(histogram.buckets) < 2000
+
+
+def test_fake_gateway():
+    with FakeGateway() as gateway:
+        with grpc.insecure_channel(os.environ['AUTH_CHANNEL']) as channel:
+            auth = auth_pb2_grpc.AuthorizationStub(channel)
+            token = auth.create(CreateToken(user_id='1', password='pw')).token
+
+            assert auth.validate(ValidateToken(user_id='1', password='pw', token=token)).valid
+            assert not auth.validate(ValidateToken(user_id='1', password='other', token=token)).valid
+
+        with grpc.insecure_channel(os.environ['GUILD_CHANNEL']) as channel:
+            guild = derailed_pb2_grpc.GuildStub(channel)
+            guild.publish(Publ(guild_id='1', message=Message(event='GUILD_UPDATE', data='{}')))
+
+        assert gateway.events.published['GUILD_UPDATE'] == 1
+
+
+def test_scale_plan_is_deterministic():
+    dist = Distributions(users=2000, guilds=200, members=20_000, messages=50_000, members_per_channel=20)
+    plan, again = Plan(dist, seed=3), Plan(dist, seed=3)
+    guild = max(range(dist.guilds), key=lambda g: plan.sizes[g])
+
+    members = plan.members(guild)
+    assert members == again.members(guild)
+    assert plan.guild(guild, members) == again.guild(guild, members)
+    assert list(plan.messages(guild, members)) == list(again.messages(guild, members))
+
+    # skewed, with one guild far busier than the typical one
+    assert plan.sizes[guild] > 10 * sorted(plan.sizes)[dist.guilds // 2]
+
+
+def test_scale_ids_are_unique_and_ordered():
+    dist = Distributions(users=500, guilds=20, members=2000, messages=20_000, members_per_channel=10)
+    plan = Plan(dist)
+    ids = []
+
+    for guild in range(dist.guilds):
+        messages = list(plan.messages(guild, plan.members(guild)))
+        ids.extend(m[0] for m in messages)
+
+        by_channel = {}
+        for m in messages:
+            by_channel.setdefault(m[3], []).append(m[0])
+        assert all(channel == sorted(channel) for channel in by_channel.values())
+
+    assert len(set(ids)) == len(ids)
+    assert min(ids) > 0
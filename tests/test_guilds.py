@@ -0,0 +1,237 @@
+import json
+
+import pytest
+
+
+@pytest.mark.incremental
+class TestGuildCounters:
+    def test_create_guild(self, client):
+        resp = client.post(
+            '/v1/register', json={'username': 'owner', 'email': 'owner@test.com', 'password': 'ABcdef148'}
+        )
+        assert resp.status_code == 201
+        pytest.owner_token = resp.json()['token']
+
+        headers = {'Authorization': pytest.owner_token}
+
+        resp = client.post('/v1/guilds', json={'name': 'counted'}, headers=headers)
+        assert resp.status_code == 201
+        assert resp.json()['member_count'] == 1
+        assert resp.json()['channel_count'] == 2
+        pytest.guild_id = resp.json()['id']
+
+    def test_create_channels(self, client):
+        headers = {'Authorization': pytest.owner_token}
+
+        resp = client.post(
+            f'/v1/guilds/{pytest.guild_id}/channels', json={'type': 1, 'name': 'first'}, headers=headers
+        )
+        assert resp.status_code == 201
+        pytest.first_id = resp.json()['id']
+
+        resp = client.post(
+            f'/v1/guilds/{pytest.guild_id}/channels',
+            json={'type': 1, 'name': 'second', 'position': 1},
+            headers=headers,
+        )
+        assert resp.status_code == 201
+        assert resp.json()['position'] == 1
+
+        resp = client.get(f'/v1/guilds/{pytest.guild_id}/preview')
+        assert resp.json()['channel_count'] == 4
+        assert 'max_position' not in resp.json() and 'deletor_job_id' not in resp.json()
+        assert resp.json()['approximate_member_count'] == 1
+
+    def test_delete_channel_closes_gap(self, client):
+        headers = {'Authorization': pytest.owner_token}
+
+        resp = client.delete(f'/v1/guilds/{pytest.guild_id}/channels/{pytest.first_id}', headers=headers)
+        assert resp.status_code == 204
+
+        resp = client.get(f'/v1/guilds/{pytest.guild_id}/channels', headers=headers)
+        top_level = sorted(c['position'] for c in resp.json() if c['parent_id'] is None)
+        assert top_level == [1, 2]
+
+        resp = client.get(f'/v1/guilds/{pytest.guild_id}/preview')
+        assert resp.json()['channel_count'] == 3
+
+
+@pytest.mark.incremental
+class TestChannelPositions:
+    def test_create_guild(self, client):
+        resp = client.post(
+            '/v1/register', json={'username': 'mover', 'email': 'mover@test.com', 'password': 'ABcdef148'}
+        )
+        assert resp.status_code == 201
+        pytest.mover_token = resp.json()['token']
+
+        headers = {'Authorization': pytest.mover_token}
+
+        resp = client.post('/v1/guilds', json={'name': 'moving'}, headers=headers)
+        assert resp.status_code == 201
+        pytest.moving_id = resp.json()['id']
+
+        resp = client.get(f'/v1/guilds/{pytest.moving_id}/channels', headers=headers)
+        (category,) = [c for c in resp.json() if c['type'] == 0]
+        pytest.category_id = category['id']
+
+    def create(self, client, **data):
+        headers = {'Authorization': pytest.mover_token}
+
+        resp = client.post(f'/v1/guilds/{pytest.moving_id}/channels', json=data, headers=headers)
+        assert resp.status_code == 201
+        return resp.json()
+
+    def top_level(self, client):
+        headers = {'Authorization': pytest.mover_token}
+
+        resp = client.get(f'/v1/guilds/{pytest.moving_id}/channels', headers=headers)
+        return sorted((c['position'], c['id']) for c in resp.json() if c['parent_id'] is None)
+
+    def test_append_channel(self, client):
+        pytest.tail_id = self.create(client, type=1, name='tail')['id']
+
+        assert self.top_level(client) == [(1, pytest.category_id), (2, pytest.tail_id)]
+
+    def test_insert_channel(self, client):
+        pytest.middle_id = self.create(client, type=1, name='middle', position=2)['id']
+
+        assert self.top_level(client) == [
+            (1, pytest.category_id),
+            (2, pytest.middle_id),
+            (3, pytest.tail_id),
+        ]
+
+    def test_append_category(self, client):
+        pytest.end_id = self.create(client, type=0, name='end')['id']
+
+        assert self.top_level(client)[-1] == (4, pytest.end_id)
+
+    def test_insert_category(self, client):
+        pytest.front_id = self.create(client, type=0, name='front', position=1)['id']
+
+        # channels without a category make way too, as they do when a category is deleted
+        assert self.top_level(client) == [
+            (1, pytest.front_id),
+            (2, pytest.category_id),
+            (3, pytest.middle_id),
+            (4, pytest.tail_id),
+            (5, pytest.end_id),
+        ]
+
+    def test_move_top_level(self, client):
+        loose_id = self.create(client, type=1, name='loose')['id']
+
+        # every moved channel stays top-level, so each parent_id sent to Postgres is NULL
+        resp = client.patch(
+            f'/v1/guilds/{pytest.moving_id}/channels',
+            json=[{'id': loose_id, 'position': 1}, {'id': pytest.front_id, 'position': 6}],
+            headers={'Authorization': pytest.mover_token},
+        )
+        assert resp.status_code == 200
+
+        order = [cid for _, cid in self.top_level(client)]
+        assert order == [
+            loose_id,
+            pytest.category_id,
+            pytest.middle_id,
+            pytest.tail_id,
+            pytest.end_id,
+            pytest.front_id,
+        ]
+
+
+@pytest.mark.incremental
+class TestGuildTemplates:
+    def test_create_template(self, client):
+        resp = client.post(
+            '/v1/register',
+            json={'username': 'templater', 'email': 'templater@test.com', 'password': 'ABcdef148'},
+        )
+        assert resp.status_code == 201
+        pytest.templater_token = resp.json()['token']
+        headers = {'Authorization': pytest.templater_token}
+
+        resp = client.post('/v1/guilds', json={'name': 'source'}, headers=headers)
+        pytest.source_id = resp.json()['id']
+        client.post(
+            f'/v1/guilds/{pytest.source_id}/channels', json={'type': 0, 'name': 'extra'}, headers=headers
+        )
+
+        resp = client.post(
+            f'/v1/guilds/{pytest.source_id}/templates', json={'name': 'base'}, headers=headers
+        )
+        assert resp.status_code == 201
+        pytest.template_code = resp.json()['code']
+
+    def test_create_from_template(self, client):
+        headers = {'Authorization': pytest.templater_token}
+
+        resp = client.post(
+            f'/v1/guilds/templates/{pytest.template_code}', json={'name': 'copy'}, headers=headers
+        )
+        assert resp.status_code == 201
+        assert resp.json()['channel_count'] == 3
+        guild_id = resp.json()['id']
+
+        source = client.get(f'/v1/guilds/{pytest.source_id}/channels', headers=headers).json()
+        copy = client.get(f'/v1/guilds/{guild_id}/channels', headers=headers).json()
+
+        def tree(channels):
+            names = {c['id']: c['name'] for c in channels}
+            return sorted((c['name'], names.get(c['parent_id']), c['position']) for c in channels)
+
+        assert tree(copy) == tree(source)
+        assert not {c['id'] for c in copy} & {c['id'] for c in source}
+
+    def test_unknown_template(self, client):
+        headers = {'Authorization': pytest.templater_token}
+
+        resp = client.post('/v1/guilds/templates/unknown', json={'name': 'copy'}, headers=headers)
+        assert resp.status_code == 404
+
+
+@pytest.mark.incremental
+class TestMemberListing:
+    def test_list_members(self, client):
+        resp = client.post(
+            '/v1/register', json={'username': 'lister', 'email': 'lister@test.com', 'password': 'ABcdef148'}
+        )
+        assert resp.status_code == 201
+        pytest.lister_id = resp.json()['id']
+        pytest.lister_headers = {'Authorization': resp.json()['token']}
+
+        resp = client.post('/v1/guilds', json={'name': 'listed'}, headers=pytest.lister_headers)
+        pytest.listed_id = resp.json()['id']
+
+        resp = client.get(f'/v1/guilds/{pytest.listed_id}/members', headers=pytest.lister_headers)
+        assert resp.status_code == 200
+        assert resp.json() == [
+            {
+                'user': {
+                    'id': pytest.lister_id,
+                    'username': 'lister',
+                    'discriminator': resp.json()[0]['user']['discriminator'],
+                    'flags': 0,
+                    'system': False,
+                    'suspended': False,
+                },
+                'nick': None,
+                'roles': [],
+            }
+        ]
+
+        resp = client.get(
+            f'/v1/guilds/{pytest.listed_id}/members',
+            params={'after': pytest.lister_id},
+            headers=pytest.lister_headers,
+        )
+        assert resp.json() == []
+
+    def test_stream_members(self, client):
+        resp = client.get(f'/v1/guilds/{pytest.listed_id}/members/stream', headers=pytest.lister_headers)
+        assert resp.status_code == 200
+
+        lines = resp.text.splitlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])['user']['id'] == pytest.lister_id
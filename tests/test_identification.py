@@ -0,0 +1,138 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from derailed.identification import (
+    MAX_CLOCK_WAIT_MS,
+    MAX_LEASED_NODE_ID,
+    MAX_SEQUENCE,
+    DatabaseLease,
+    FileLease,
+    IDMedium,
+    _clock_wait,
+)
+
+
+def test_snowflakes_are_unique_and_increasing():
+    medium = IDMedium(node_id=7)
+    ids = [medium.snowflake() for _ in range(20_000)]
+
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert all((i >> 12) & 0x3FF == 7 for i in ids)
+
+
+def test_sequence_overflow_waits_for_next_millisecond():
+    medium = IDMedium(node_id=0)
+    ids = [medium.snowflake() for _ in range((MAX_SEQUENCE + 1) * 3)]
+
+    timestamps = [i >> 22 for i in ids]
+    per_ms = {ts: timestamps.count(ts) for ts in set(timestamps)}
+
+    assert max(per_ms.values()) <= MAX_SEQUENCE + 1
+    assert len(set(ids)) == len(ids)
+
+
+def test_take_mixes_with_snowflake():
+    medium = IDMedium(node_id=2)
+    ids = [medium.snowflake()] + medium.take(10_000) + [medium.snowflake()]
+
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_threads_do_not_collide():
+    medium = IDMedium(node_id=3)
+    results: list[list[int]] = [[] for _ in range(8)]
+
+    def work(out: list[int]) -> None:
+        for _ in range(5_000):
+            out.append(medium.snowflake())
+
+    threads = [threading.Thread(target=work, args=(out,)) for out in results]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    ids = [i for out in results for i in out]
+    assert len(set(ids)) == len(ids)
+
+
+def test_invalid_node_id():
+    with pytest.raises(ValueError):
+        IDMedium(node_id=1024)
+
+    # kept for the importer
+    with pytest.raises(ValueError):
+        IDMedium(node_id=MAX_LEASED_NODE_ID + 1)
+
+
+def test_file_leases_are_exclusive(tmp_path):
+    first = FileLease(str(tmp_path))
+    second = FileLease(str(tmp_path))
+
+    assert first.acquire() != second.acquire()
+
+    node = first.node_id
+    first.release(high_water=1)
+
+    third = FileLease(str(tmp_path))
+    assert third.acquire() == node
+
+
+def test_clock_wait(monkeypatch):
+    monkeypatch.setattr('derailed.identification.time.time', lambda: 1000.0)
+
+    assert _clock_wait(999_000) == 0
+    assert _clock_wait(1_000_004) == 0.005
+
+    with pytest.raises(RuntimeError):
+        _clock_wait(1_000_001 + MAX_CLOCK_WAIT_MS)
+
+
+def test_ids_bound_time_ranges():
+    medium = IDMedium(node_id=3)
+    now = datetime.now(timezone.utc)
+    snowflake = medium.snowflake()
+
+    assert medium.at(now - timedelta(seconds=1)) < snowflake < medium.at(now + timedelta(seconds=1))
+    assert abs(medium.time_of(snowflake) - now) < timedelta(seconds=1)
+    assert medium.at(datetime(2000, 1, 1, tzinfo=timezone.utc)) == 0
+
+
+def test_lost_lease_stops_ids(monkeypatch):
+    medium = IDMedium(node_id=4)
+    lease = DatabaseLease(None, ttl=0.003)
+    lease.node_id = 4
+
+    class Unavailable(Exception):
+        pass
+
+    async def renew(high_water):
+        return False
+
+    async def acquire():
+        # node 4 may be someone else's by now
+        with pytest.raises(RuntimeError, match='lease'):
+            medium.snowflake()
+
+        with pytest.raises(RuntimeError, match='lease'):
+            medium.take(2)
+
+        raise Unavailable
+
+    monkeypatch.setattr(lease, 'renew', renew)
+    monkeypatch.setattr(lease, 'acquire', acquire)
+
+    with pytest.raises(Unavailable):
+        asyncio.run(lease.keep_alive(medium))
+
+    # nothing was leased, so still nothing is issued
+    with pytest.raises(RuntimeError, match='lease'):
+        medium.snowflake()
+
+    medium.node_id = 5
+    assert (medium.snowflake() >> 12) & 1023 == 5
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import msgspec
+import pytest
+
+from derailed.identification import MAX_LEASED_NODE_ID, MAX_NODE_ID, SEQUENCE_BITS, IDMedium
+from derailed.importer import TimedIds, read_records
+
+
+def test_read_concatenated_msgpack(tmp_path):
+    records = [
+        {'id': i, 'content': 'a' * (i * 7), 'nested': [{'x': -i, 'y': 1.5}, None, True], 'raw': b'\0' * i}
+        for i in range(300)
+    ]
+    path = tmp_path / 'messages.msgpack'
+    path.write_bytes(b''.join(msgspec.msgpack.encode(r) for r in records))
+
+    # a tiny chunk size splits most records between reads
+    assert list(read_records(str(path), chunk_size=7)) == records
+
+
+def test_read_jsonl(tmp_path):
+    path = tmp_path / 'users.jsonl'
+    path.write_text('{"id": 1}\n\n{"id": 2}\n')
+
+    assert list(read_records(str(path))) == [{'id': 1}, {'id': 2}]
+
+
+def test_timed_ids_follow_time():
+    medium = IDMedium(node_id=1)
+    timed = TimedIds(medium)
+    when = datetime(2023, 6, 1)
+
+    same = [timed.at(when) for _ in range(5000)]
+    later = timed.at(when + timedelta(milliseconds=1))
+
+    assert len(set(same)) == 5000
+    assert all(medium.at(when) <= i < later for i in same)
+
+
+def test_timed_ids_keep_to_import_nodes():
+    medium = IDMedium(node_id=MAX_LEASED_NODE_ID)
+    timed = TimedIds(medium)
+    when = datetime(2023, 6, 1)
+
+    nodes = {(timed.at(when) >> SEQUENCE_BITS) & MAX_NODE_ID for _ in range(70000)}
+    assert min(nodes) > MAX_LEASED_NODE_ID
+
+    # a leased node can't issue an id in the same millisecond which is the same as any of these
+    assert (medium.snowflake() >> SEQUENCE_BITS) & MAX_NODE_ID == MAX_LEASED_NODE_ID
+
+
+def test_timed_ids_refuse_pre_epoch():
+    timed = TimedIds(IDMedium(node_id=1))
+
+    with pytest.raises(ValueError, match='before the snowflake epoch'):
+        timed.at(datetime(2022, 12, 31, 23, 59, 59))
+
+    # the epoch itself is fine
+    assert timed.at(datetime(2023, 1, 1)) >> 22 == 0
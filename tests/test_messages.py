@@ -0,0 +1,173 @@
+import gzip
+import json
+
+import msgspec
+import pytest
+
+
+@pytest.mark.incremental
+class TestBulkDelete:
+    def test_setup(self, client):
+        resp = client.post(
+            '/v1/register',
+            json={'username': 'moderator', 'email': 'moderator@test.com', 'password': 'ABcdef148'},
+        )
+        pytest.moderator_token = resp.json()['token']
+        headers = {'Authorization': pytest.moderator_token}
+
+        guild_id = client.post('/v1/guilds', json={'name': 'spammed'}, headers=headers).json()['id']
+        channels = client.get(f'/v1/guilds/{guild_id}/channels', headers=headers).json()
+        pytest.spammed_id = next(c['id'] for c in channels if c['type'] == 1)
+
+        pytest.spam = [
+            client.post(
+                f'/v1/channels/{pytest.spammed_id}/messages', json={'content': f'spam {i}'}, headers=headers
+            ).json()['id']
+            for i in range(3)
+        ]
+
+    def test_bulk_delete(self, client):
+        headers = {'Authorization': pytest.moderator_token}
+
+        resp = client.post(
+            f'/v1/channels/{pytest.spammed_id}/messages/bulk-delete',
+            json={'messages': pytest.spam[1:]},
+            headers=headers,
+        )
+        assert resp.status_code == 204
+
+        resp = client.get(f'/v1/channels/{pytest.spammed_id}/messages', headers=headers)
+        assert [m['id'] for m in resp.json()] == pytest.spam[:1]
+
+    def test_bulk_delete_limits(self, client):
+        resp = client.post(
+            f'/v1/channels/{pytest.spammed_id}/messages/bulk-delete',
+            json={'messages': pytest.spam[:1]},
+            headers={'Authorization': pytest.moderator_token},
+        )
+        assert resp.status_code == 422
+
+    def test_export(self, client):
+        headers = {'Authorization': pytest.moderator_token}
+        url = f'/v1/channels/{pytest.spammed_id}/messages/export'
+
+        resp = client.get(url, headers=headers)
+        assert resp.status_code == 200
+        lines = resp.content.splitlines()
+        assert [json.loads(line)['id'] for line in lines] == pytest.spam[:1]
+
+        resp = client.get(url, params={'format': 'msgpack', 'gzip': True}, headers=headers)
+        assert resp.status_code == 200
+        assert msgspec.msgpack.decode(gzip.decompress(resp.content))['content'] == 'spam 0'
+
+
+@pytest.mark.incremental
+class TestSearch:
+    def test_setup(self, client):
+        resp = client.post(
+            '/v1/register',
+            json={'username': 'searcher', 'email': 'searcher@test.com', 'password': 'ABcdef148'},
+        )
+        pytest.searcher_token = resp.json()['token']
+        headers = {'Authorization': pytest.searcher_token}
+
+        resp = client.post('/v1/guilds', json={'name': 'searched'}, headers=headers)
+        pytest.searched_guild = resp.json()['id']
+        channels = client.get(f'/v1/guilds/{pytest.searched_guild}/channels', headers=headers).json()
+        pytest.searched_id = next(c['id'] for c in channels if c['type'] == 1)
+
+        pytest.found = [
+            client.post(
+                f'/v1/channels/{pytest.searched_id}/messages', json={'content': content}, headers=headers
+            ).json()['id']
+            for content in ('trains are running late', 'nothing to see', 'the train is here')
+        ]
+
+    def test_search(self, client):
+        headers = {'Authorization': pytest.searcher_token}
+
+        url = f'/v1/guilds/{pytest.searched_guild}/messages/search'
+
+        resp = client.get(url, params={'content': 'train'}, headers=headers)
+        assert resp.status_code == 200
+        assert [m['id'] for m in resp.json()] == [pytest.found[2], pytest.found[0]]
+
+        resp = client.get(
+            f'/v1/channels/{pytest.searched_id}/messages/search',
+            params={'content': 'train', 'limit': 1, 'before': pytest.found[2]},
+            headers=headers,
+        )
+        assert [m['id'] for m in resp.json()] == [pytest.found[0]]
+
+    def test_search_outsider(self, client):
+        resp = client.post(
+            '/v1/register',
+            json={'username': 'outsider', 'email': 'outsider@test.com', 'password': 'ABcdef148'},
+        )
+
+        resp = client.get(
+            f'/v1/guilds/{pytest.searched_guild}/messages/search',
+            params={'content': 'train'},
+            headers={'Authorization': resp.json()['token']},
+        )
+        assert resp.status_code == 403
+
+
+@pytest.mark.incremental
+class TestMentions:
+    def test_setup(self, client):
+        resp = client.post(
+            '/v1/register',
+            json={'username': 'mentioner', 'email': 'mentioner@test.com', 'password': 'ABcdef148'},
+        )
+        pytest.mentioner_token = resp.json()['token']
+        pytest.mentioner_id = resp.json()['id']
+        headers = {'Authorization': pytest.mentioner_token}
+
+        guild_id = client.post('/v1/guilds', json={'name': 'mentions'}, headers=headers).json()['id']
+        channels = client.get(f'/v1/guilds/{guild_id}/channels', headers=headers).json()
+        pytest.mention_channel = next(c['id'] for c in channels if c['type'] == 1)
+
+    def test_mentions(self, client):
+        headers = {'Authorization': pytest.mentioner_token}
+        url = f'/v1/channels/{pytest.mention_channel}/messages'
+
+        content = f'note to <@{pytest.mentioner_id}>'
+        mentions = [
+            client.post(url, json={'content': content}, headers=headers).json()['id'] for _ in range(2)
+        ]
+        client.post(url, json={'content': 'no one'}, headers=headers)
+
+        resp = client.get('/v1/users/@me/mentions', params={'limit': 1}, headers=headers)
+        assert [m['id'] for m in resp.json()] == mentions[1:]
+
+        resp = client.get('/v1/users/@me/mentions', params={'before': mentions[1]}, headers=headers)
+        assert [m['id'] for m in resp.json()] == mentions[:1]
+
+        # mentioning yourself isn't unread
+        resp = client.get('/v1/users/@me/mentions/unread', headers=headers)
+        assert resp.json() == []
+
+    def test_prepare_mentions(self, app):
+        from derailed.powerbase import MAX_MENTIONS, prepare_mentions
+
+        assert prepare_mentions('hi <@1> and <@&2>, <@1> again, not <@x> or @3') == ({1}, {2})
+        users, roles = prepare_mentions(' '.join(f'<@{i}>' for i in range(MAX_MENTIONS * 2)))
+        assert len(users) == MAX_MENTIONS and not roles
+
+    def test_ack(self, client):
+        headers = {'Authorization': pytest.mentioner_token}
+        last = client.get(f'/v1/channels/{pytest.mention_channel}/messages', headers=headers).json()[0]['id']
+
+        resp = client.post(f'/v1/channels/{pytest.mention_channel}/messages/{last}/ack', headers=headers)
+        assert resp.status_code == 204
+
+    def test_typing(self, client):
+        headers = {'Authorization': pytest.mentioner_token}
+
+        for _ in range(2):
+            resp = client.post(f'/v1/channels/{pytest.mention_channel}/typing', headers=headers)
+            assert resp.status_code == 204
+
+        resp = client.post('/v1/channels/1/typing', headers=headers)
+        assert resp.status_code == 404
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from derailed.ordering import key_between, spread
+
+
+def test_key_between_ends():
+    first = key_between(None, None)
+
+    assert key_between(None, first) < first
+    assert key_between(first, None) > first
+
+
+def test_key_between_is_strictly_between():
+    rng = random.Random(0)
+    keys = [key_between(None, None)]
+
+    for _ in range(2000):
+        i = rng.randint(0, len(keys))
+        before = keys[i - 1] if i > 0 else None
+        after = keys[i] if i < len(keys) else None
+        keys.insert(i, key_between(before, after))
+
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(keys)
+    assert not any(k.endswith('0') for k in keys)
+
+
+@pytest.mark.parametrize('prepend', [False, True])
+def test_repeated_ends_keep_keys_short(prepend):
+    keys = [key_between(None, None)]
+
+    for _ in range(100):
+        keys.append(key_between(None, keys[-1]) if prepend else key_between(keys[-1], None))
+
+    assert keys == sorted(keys, reverse=prepend)
+    assert max(len(k) for k in keys) <= 4
+
+
+def test_key_between_rejects_unordered():
+    with pytest.raises(ValueError):
+        key_between('b', 'a')
+
+
+@pytest.mark.parametrize('n', [0, 1, 61, 62, 500, 5000])
+def test_spread(n):
+    keys = spread(n)
+
+    assert len(keys) == n
+    assert keys == sorted(keys)
+    assert len(set(keys)) == n
+    assert all(keys) and not any(k.endswith('0') for k in keys)
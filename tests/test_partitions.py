@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta, timezone
+
+from derailed.identification import IDMedium
+from derailed.partitions import partition_for, partitions_between
+
+
+def test_partitions_cover_their_period():
+    medium = IDMedium(node_id=1)
+    when = datetime(2023, 6, 15, 12, tzinfo=timezone.utc)
+    partition = partition_for(when, medium, period_days=30)
+
+    assert partition.lower <= medium.at(when) < partition.upper
+    assert partition.upper - partition.lower == (30 * 24 * 3600 * 1000) << 22
+
+
+def test_partitions_line_up():
+    medium = IDMedium(node_id=1)
+    first = partition_for(datetime(2023, 6, 15, tzinfo=timezone.utc), medium, period_days=7)
+    same = partition_for(medium.time_of(first.upper - 1), medium, period_days=7)
+    following = partition_for(medium.time_of(first.upper), medium, period_days=7)
+
+    assert same.name == first.name
+    assert following.lower == first.upper
+    assert following.name != first.name
+    assert medium.time_of(following.lower) - medium.time_of(first.lower) == timedelta(days=7)
+
+
+def test_partitions_between_cover_history():
+    medium = IDMedium(node_id=1)
+    oldest = datetime(2023, 2, 3, tzinfo=timezone.utc)
+    newest = datetime(2023, 7, 20, tzinfo=timezone.utc)
+    partitions = partitions_between(oldest, newest, medium, period_days=30)
+
+    assert partitions[0].lower <= medium.at(oldest)
+    assert medium.at(newest) < partitions[-1].upper
+    assert all(a.upper == b.lower for a, b in zip(partitions, partitions[1:]))
+    assert len(partitions) == 6
+
+    # a single moment, or history from before the epoch, still gets a partition
+    assert len(partitions_between(oldest, oldest, medium, period_days=30)) == 1
+    assert partitions_between(datetime(2020, 1, 1, tzinfo=timezone.utc), oldest, medium, 30)[0].lower == 0
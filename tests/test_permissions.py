@@ -0,0 +1,29 @@
+from derailed.permissions import (
+    ALL_PERMISSIONS,
+    GuildPermissions,
+    guild_permissions,
+    unwrap_guild_permissions,
+)
+
+VIEW = GuildPermissions.VIEW_CHANNEL
+SEND = GuildPermissions.CREATE_MESSAGES
+KICK = GuildPermissions.KICK_MEMBERS
+
+
+def test_higher_roles_override_lower_ones():
+    roles = [
+        unwrap_guild_permissions(allow=SEND, deny=0, pos=9),
+        unwrap_guild_permissions(allow=KICK, deny=SEND, pos=3),
+        unwrap_guild_permissions(allow=VIEW | SEND, deny=0, pos=1),
+    ]
+
+    assert guild_permissions(roles) == VIEW | SEND | KICK
+    assert guild_permissions(roles[1:]) == VIEW | KICK
+
+
+def test_denying_what_was_never_allowed():
+    roles = [unwrap_guild_permissions(allow=VIEW, deny=GuildPermissions.BAN_MEMBERS, pos=1)]
+
+    assert guild_permissions(roles) == VIEW
+    assert guild_permissions([]) == 0
+    assert guild_permissions([], owner=True) == ALL_PERMISSIONS
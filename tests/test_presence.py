@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from derailed.models.user import DefaultStatus
+from derailed.presence import Presences, Typing
+
+
+def test_typing_is_announced_once_a_window(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('derailed.presence.time.monotonic', lambda: now[0])
+    typing = Typing(window=5)
+
+    assert not typing.announced(1, 10)
+    typing.announce(1, 10)
+    assert typing.announced(1, 10)
+    assert not typing.announced(1, 11)
+
+    now[0] += 5
+    assert not typing.announced(1, 10)
+
+    # those who stopped typing are forgotten
+    typing.announce(2, 10)
+    assert list(typing._until) == [(2, 10)]
+
+
+def test_presences_write_the_last_change_once(session_factory):
+    written = []
+    published = []
+
+    async def publish(target, event, data):
+        published.append((target, data))
+
+    presences = Presences(session_factory, publish_to_user=publish, publish_to_guild=publish)
+
+    async def write(changes):
+        written.append(changes)
+        return {1: [100]}
+
+    presences.write = write
+
+    for status in (DefaultStatus.BUSY, DefaultStatus.ONLINE, DefaultStatus.BUSY):
+        presences.set(1, status=status)
+    presences.set(1, activity='away')
+
+    assert asyncio.run(presences.flush()) == 1
+    assert written == [{1: {'status': DefaultStatus.BUSY, 'activity': 'away'}}]
+
+    event = {'user_id': '1', 'status': 'busy', 'activity': {'type': 0, 'content': 'away'}}
+    assert published == [(1, event), (100, event)]
+    assert presences.pending == 0
+
+
+def test_invisible_looks_offline_to_guilds(session_factory):
+    published = []
+
+    async def publish(target, event, data):
+        published.append((target, data))
+
+    async def write(changes):
+        return {1: [100]}
+
+    presences = Presences(session_factory, publish_to_user=publish, publish_to_guild=publish)
+    presences.write = write
+    presences.set(1, status=DefaultStatus.OFFLINE)
+    asyncio.run(presences.flush())
+
+    assert published == [
+        (1, {'user_id': '1', 'status': 'invisible'}),
+        (100, {'user_id': '1', 'status': 'offline'}),
+    ]
+
+
+def test_failed_presences_are_kept(session_factory):
+    async def write(changes):
+        raise ConnectionError
+
+    presences = Presences(session_factory)
+    presences.write = write
+    presences.set(1, status=DefaultStatus.BUSY, activity=None)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(presences.flush())
+
+    # changes made in the meantime win
+    presences.set(1, status=DefaultStatus.BUST)
+    assert presences._pending == {1: {'status': DefaultStatus.BUST, 'activity': None}}
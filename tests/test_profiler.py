@@ -0,0 +1,42 @@
+import asyncio
+import os
+import time
+
+from derailed.profiler import ProfilerMiddleware
+
+
+async def slow_app(scope, receive, send):
+    await asyncio.sleep(0.05)
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+
+
+def call(middleware, headers=()):
+    scope = {'type': 'http', 'method': 'GET', 'path': '/guilds/1', 'headers': list(headers)}
+    asyncio.run(middleware(scope, None, None))
+
+
+def test_disabled_writes_nothing(tmp_path):
+    call(ProfilerMiddleware(slow_app, directory=str(tmp_path)))
+    assert os.listdir(tmp_path) == []
+
+
+def test_header_trigger(tmp_path):
+    middleware = ProfilerMiddleware(slow_app, directory=str(tmp_path), token='secret')
+
+    call(middleware, [(b'x-derailed-profile', b'wrong')])
+    assert os.listdir(tmp_path) == []
+
+    call(middleware, [(b'x-derailed-profile', b'secret')])
+    (name,) = os.listdir(tmp_path)
+    assert name.endswith('.collapsed')
+
+    content = (tmp_path / name).read_text()
+    assert 'slow_app' in content
+    assert '[awaiting]' in content
+
+
+def test_threshold_trigger(tmp_path):
+    call(ProfilerMiddleware(slow_app, directory=str(tmp_path), threshold_ms=20))
+    assert len(os.listdir(tmp_path)) == 1
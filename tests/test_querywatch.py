@@ -0,0 +1,48 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from derailed.querywatch import QueryBudgetExceeded, install, watch
+
+
+@pytest.fixture()
+def engine():
+    engine = create_engine('sqlite://')
+    install(engine)
+    return engine
+
+
+def test_counts_and_repeats(engine):
+    with engine.connect() as conn, watch() as stats:
+        for _ in range(6):
+            conn.execute(text('SELECT 1'))
+        conn.execute(text('SELECT 2'))
+
+    assert stats.count == 7
+    assert stats.repeated(5) == [('SELECT 1', 6)]
+
+
+def test_budget_exceeded(engine):
+    with pytest.raises(QueryBudgetExceeded):
+        with engine.connect() as conn, watch(limit=1):
+            conn.execute(text('SELECT 1'))
+            conn.execute(text('SELECT 1'))
+
+
+def test_outside_watch_not_counted(engine):
+    with engine.connect() as conn:
+        conn.execute(text('SELECT 1'))
+
+        with watch(limit=0) as stats:
+            pass
+
+    assert stats.count == 0
+
+
+def test_failed_statement_drops_its_start(engine):
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text('SELECT * FROM missing'))
+
+        assert conn.info['query_watch_start'] == []
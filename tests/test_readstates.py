@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from derailed.models.channel import ReadState
+from derailed.readstates import AckBuffer
+
+
+def test_acks_merge_to_the_newest(monkeypatch, session_factory):
+    written = []
+    published = []
+
+    async def upsert_many(session, acks):
+        written.append(acks)
+
+    async def publish(user_id, event, data):
+        published.append((user_id, data['message_id']))
+
+    monkeypatch.setattr(ReadState, 'upsert_many', upsert_many)
+    buffer = AckBuffer(session_factory, publish=publish, batch_size=1)
+
+    for message_id in (5, 9, 3):
+        buffer.ack(1, 10, message_id)
+    buffer.ack(2, 10, 4)
+
+    assert buffer.pending == 2
+    assert asyncio.run(buffer.flush()) == 2
+    assert written == [[(1, 10, 9)], [(2, 10, 4)]]
+    assert published == [(1, '9'), (2, '4')]
+    assert buffer.pending == 0
+
+
+def test_failed_acks_are_kept(monkeypatch, session_factory):
+    async def upsert_many(session, acks):
+        raise ConnectionError
+
+    monkeypatch.setattr(ReadState, 'upsert_many', upsert_many)
+    buffer = AckBuffer(session_factory)
+    buffer.ack(1, 10, 5)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(buffer.flush())
+
+    # a newer ack arriving in the meantime wins
+    buffer.ack(1, 10, 8)
+    assert buffer._pending == {(1, 10): 8}
@@ -0,0 +1,64 @@
+import asyncio
+import itertools
+
+import pytest
+
+from derailed.models.channel import Channel, Message
+from derailed.ordering import rebalance, spread
+
+SEARCH_FILTERS = ['channel_id', 'author_id', 'before', 'after']
+
+
+@pytest.mark.parametrize('guild_id', [None, 1])
+@pytest.mark.parametrize(
+    'filters',
+    [combo for n in range(len(SEARCH_FILTERS) + 1) for combo in itertools.combinations(SEARCH_FILTERS, n)],
+)
+def test_search_filters(recording_session, guild_id, filters):
+    kwargs = {name: i + 10 for i, name in enumerate(filters)}
+    asyncio.run(Message.search(recording_session, 'hello', 2, 25, guild_id=guild_id, **kwargs))
+
+    (sql,) = recording_session.statements
+    text = str(sql)
+
+    assert ('messages.id < ' in text) == ('before' in filters)
+    assert ('messages.id > ' in text) == ('after' in filters)
+    assert ('messages.author_id = ' in text) == ('author_id' in filters)
+    assert ('messages.channel_id = ' in text) == ('channel_id' in filters)
+
+
+def test_reposition_top_level(recording_session):
+    asyncio.run(Channel.reposition(recording_session, [(1, 2, None, None), (2, 1, None, None)]))
+
+    (sql,) = recording_session.statements
+    text = str(sql)
+
+    # VALUES full of untyped NULLs would otherwise be text, which Postgres won't assign to a bigint
+    assert 'parent_id=CAST(moves.parent_id AS BIGINT)' in text
+    assert 'rank=CAST(moves.rank AS VARCHAR)' in text
+
+
+def test_rebalance_top_level(recording_session):
+    # the guild lock, then the top-level channels in their current order
+    recording_session.returning([], [(5,), (7,), (6,)])
+    asyncio.run(rebalance(recording_session, 1, None))
+
+    _, siblings, moves = recording_session.statements
+
+    assert 'channels.parent_id IS NULL' in str(siblings)
+    assert 'parent_id=CAST(moves.parent_id AS BIGINT)' in str(moves)
+
+    # the NULL parent_id is rendered inline, leaving id, position and rank bound per row
+    keys = spread(3)
+    assert list(moves.params.values()) == [5, 1, keys[0], 7, 2, keys[1], 6, 3, keys[2]]
+
+
+def test_shift_top_level(recording_session):
+    asyncio.run(Channel.shift(recording_session, 1, None, 3))
+
+    (sql,) = recording_session.statements
+    text = str(sql)
+
+    # categories and channels without one are siblings, whichever of them is being placed
+    assert 'channels.parent_id IS NULL' in text
+    assert 'channels.type' not in text
@@ -0,0 +1,89 @@
+import pytest
+
+from derailed.permissions import ALL_PERMISSIONS
+
+
+@pytest.mark.incremental
+class TestUserRouter:
+    def test_register(self, client):
+        resp = client.post(
+            '/v1/register', json={'username': 'test', 'email': 'test@test.com', 'password': 'ABcdef148'}
+        )
+        assert resp.status_code == 201
+        assert resp.json()['username'] == 'test'
+        assert resp.json()['email'] == 'test@test.com'
+        with pytest.raises(KeyError):
+            resp.json()['password']
+        assert isinstance(resp.json()['id'], str)
+        assert isinstance(resp.json()['discriminator'], str)
+        assert resp.json()['system'] is False
+        assert resp.json()['suspended'] is False
+        assert resp.json()['token']
+        pytest.user_token = resp.json()['token']
+
+    def test_get_me(self, client):
+        resp = client.get('/v1/users/@me', headers={'Authorization': pytest.user_token})
+        assert resp.status_code == 200
+        assert resp.json()['username'] == 'test'
+        assert resp.json()['email'] == 'test@test.com'
+        with pytest.raises(KeyError):
+            resp.json()['password']
+        assert isinstance(resp.json()['id'], str)
+        assert isinstance(resp.json()['discriminator'], str)
+        assert resp.json()['system'] is False
+        assert resp.json()['suspended'] is False
+        with pytest.raises(KeyError):
+            assert resp.json()['token']
+
+    def test_delete_me(self, client):
+        headers = {'Authorization': pytest.user_token}
+
+        resp = client.request('DELETE', '/v1/users/@me', json={'password': 'wrong-password'}, headers=headers)
+        assert resp.status_code == 401
+
+        resp = client.request('DELETE', '/v1/users/@me', json={'password': 'ABcdef148'}, headers=headers)
+        assert resp.status_code == 204
+
+        resp = client.get('/v1/users/@me', headers=headers)
+        assert resp.status_code == 401
+
+
+@pytest.mark.incremental
+class TestBootstrap:
+    def test_bootstrap(self, client):
+        resp = client.post(
+            '/v1/register', json={'username': 'booted', 'email': 'booted@test.com', 'password': 'ABcdef148'}
+        )
+        assert resp.status_code == 201
+        headers = {'Authorization': resp.json()['token']}
+        pytest.booted_headers = headers
+
+        first = client.post('/v1/guilds', json={'name': 'first'}, headers=headers).json()
+        second = client.post('/v1/guilds', json={'name': 'second'}, headers=headers).json()
+
+        resp = client.get('/v1/users/@me/bootstrap', headers=headers)
+        assert resp.status_code == 200
+
+        data = resp.json()
+        assert data['user']['username'] == 'booted'
+        assert data['settings']['status'] == 'online'
+        assert [g['id'] for g in data['guilds']] == [first['id'], second['id']]
+
+        for guild in data['guilds']:
+            assert len(guild['channels']) == 2
+            assert {c['guild_id'] for c in guild['channels']} == {guild['id']}
+            assert guild['effective_permissions'] == ALL_PERMISSIONS
+
+    def test_my_guilds(self, client):
+        headers = pytest.booted_headers
+
+        resp = client.get('/v1/users/@me/guilds', headers=headers)
+        assert resp.status_code == 200
+        assert [g['name'] for g in resp.json()] == ['first', 'second']
+        assert 'approximate_presence_count' not in resp.json()[0]
+
+        resp = client.get('/v1/users/@me/guilds', params={'with_counts': True}, headers=headers)
+        for guild in resp.json():
+            assert guild['approximate_presence_count'] == int(guild['id']) % 1000
+            assert guild['approximate_member_count'] == 1
+            assert guild['available'] is True